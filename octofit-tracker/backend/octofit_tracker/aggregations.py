@@ -0,0 +1,216 @@
+"""
+Native MongoDB aggregation pipelines for leaderboards and team stats.
+
+These bypass djongo's SQL translation and run the grouping, summing and
+ranking on the server. Each ``*_pipeline`` function only builds the
+pipeline; the ``*`` query functions run it against ``db`` (the live
+database by default, or a ``tests.support.FakeDatabase`` in tests).
+
+Ranking uses ``$setWindowFields``/``$rank`` (MongoDB 5.0+), which gives the
+same competition ranking as the incremental engine in ``ranking.py``.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .mongo import get_db
+from .tiering import both_tiers
+
+PERIODS = ('day', 'week', 'month')
+
+
+def period_bounds(period, at=None):
+    """
+    Return the ``[start, end)`` datetimes of the day/week/month containing ``at``.
+
+    Raises ``ValueError`` for an unknown period, or one that does not fit
+    in the supported date range (e.g. the last day of year 9999).
+    """
+    if period not in PERIODS:
+        raise ValueError(f'Unknown period {period!r}; expected one of {", ".join(PERIODS)}')
+    at = at or timezone.now()
+    try:
+        if isinstance(at, datetime):
+            day = (timezone.localtime(at) if timezone.is_aware(at) else at).date()
+        else:
+            day = at
+        if period == 'day':
+            start = day
+            end = day + timedelta(days=1)
+        elif period == 'week':
+            start = day - timedelta(days=day.weekday())
+            end = start + timedelta(weeks=1)
+        else:
+            start = day.replace(day=1)
+            end = (start + timedelta(days=32)).replace(day=1)
+        start, end = datetime.combine(start, time.min), datetime.combine(end, time.min)
+        if settings.USE_TZ:
+            start, end = timezone.make_aware(start), timezone.make_aware(end)
+    except OverflowError:
+        raise ValueError(f'The {period} containing {at:%Y-%m-%d} is outside the supported date range')
+    return start, end
+
+
+def _completed_between(since=None, until=None):
+    match = {}
+    if since is not None:
+        match['$gte'] = since
+    if until is not None:
+        match['$lt'] = until
+    return {'completed_at': match} if match else {}
+
+
+def _rank_stages(limit=None):
+    stages = [
+        {'$setWindowFields': {
+            'sortBy': {'total_points': -1},
+            'output': {'rank': {'$rank': {}}},
+        }},
+        {'$sort': {'rank': 1, 'entity_id': 1}},
+    ]
+    if limit:
+        stages.append({'$limit': limit})
+    return stages
+
+
+def _team_name_stage():
+    return {'$lookup': {
+        'from': 'teams',
+        'localField': '_id',
+        'foreignField': '_id',
+        'as': 'team',
+    }}
+
+
+def individual_leaderboard_pipeline(limit=None):
+    """Rank users by their all-time ``total_points`` (reads ``users``)."""
+    return [
+        {'$project': {
+            '_id': 0,
+            'type': 'individual',
+            'entity_id': '$_id',
+            'entity_name': '$name',
+            'entity_alias': '$alias',
+            'team_id': '$team_id',
+            'total_points': '$total_points',
+            'activities_count': '$activities_completed',
+        }},
+    ] + _rank_stages(limit)
+
+
+def team_leaderboard_pipeline(limit=None):
+    """
+    Rank teams by the points of the activities logged for them (reads both
+    activity tiers). Like the incremental team rows, an activity counts
+    for the team it was logged for, not its user's current team.
+    """
+    return both_tiers() + [
+        {'$match': {'team_id': {'$nin': [None, '']}}},
+        {'$group': {
+            '_id': '$team_id',
+            'total_points': {'$sum': '$points_earned'},
+            'activities_count': {'$sum': 1},
+        }},
+        _team_name_stage(),
+        {'$project': {
+            '_id': 0,
+            'type': 'team',
+            'entity_id': '$_id',
+            'entity_name': {'$first': '$team.name'},
+            'total_points': 1,
+            'activities_count': 1,
+            'member_count': {'$first': '$team.member_count'},
+        }},
+    ] + _rank_stages(limit)
+
+
+def period_leaderboard_pipeline(board_type, since=None, until=None, limit=None):
+    """Rank users or teams by points earned in ``[since, until)`` (reads both activity tiers)."""
+    match = _completed_between(since, until)
+    if board_type == 'team':
+        group = {
+            '_id': '$team_id',
+            'total_points': {'$sum': '$points_earned'},
+            'activities_count': {'$sum': 1},
+            'members': {'$addToSet': '$user_id'},
+        }
+        project = {
+            '_id': 0,
+            'type': 'team',
+            'entity_id': '$_id',
+            'entity_name': {'$first': '$team.name'},
+            'total_points': 1,
+            'activities_count': 1,
+            'member_count': {'$size': '$members'},
+        }
+    else:
+        group = {
+            '_id': '$user_id',
+            'entity_name': {'$first': '$user_name'},
+            'entity_alias': {'$first': '$user_alias'},
+            'team_id': {'$first': '$team_id'},
+            'total_points': {'$sum': '$points_earned'},
+            'activities_count': {'$sum': 1},
+        }
+        project = {
+            '_id': 0,
+            'type': 'individual',
+            'entity_id': '$_id',
+            'entity_name': 1,
+            'entity_alias': 1,
+            'team_id': 1,
+            'total_points': 1,
+            'activities_count': 1,
+        }
+    stages = both_tiers(match)
+    stages.append({'$group': group})
+    if board_type == 'team':
+        stages.append(_team_name_stage())
+    return stages + [{'$project': project}] + _rank_stages(limit)
+
+
+def team_activity_totals_pipeline(team_id=None, since=None, until=None):
+    """Per-team, per-workout activity counts, quantities and points (reads both activity tiers)."""
+    match = _completed_between(since, until)
+    if team_id is not None:
+        match['team_id'] = team_id
+    return both_tiers(match) + [
+        {'$group': {
+            '_id': {'team_id': '$team_id', 'workout_id': '$workout_id'},
+            'workout_name': {'$first': '$workout_name'},
+            'unit': {'$first': '$unit'},
+            'activities_count': {'$sum': 1},
+            'total_quantity': {'$sum': '$quantity'},
+            'total_points': {'$sum': '$points_earned'},
+        }},
+        {'$project': {
+            '_id': 0,
+            'team_id': '$_id.team_id',
+            'workout_id': '$_id.workout_id',
+            'workout_name': 1,
+            'unit': 1,
+            'activities_count': 1,
+            'total_quantity': 1,
+            'total_points': 1,
+        }},
+        {'$sort': {'team_id': 1, 'total_points': -1}},
+    ]
+
+
+def live_leaderboard(board_type='individual', limit=None, db=None):
+    db = db if db is not None else get_db()
+    if board_type == 'team':
+        return list(db.activities.aggregate(team_leaderboard_pipeline(limit)))
+    return list(db.users.aggregate(individual_leaderboard_pipeline(limit)))
+
+
+def period_leaderboard(board_type='individual', since=None, until=None, limit=None, db=None):
+    db = db if db is not None else get_db()
+    pipeline = period_leaderboard_pipeline(board_type, since, until, limit)
+    return list(db.activities.aggregate(pipeline))
+
+
+def team_activity_totals(team_id=None, since=None, until=None, db=None):
+    db = db if db is not None else get_db()
+    return list(db.activities.aggregate(team_activity_totals_pipeline(team_id, since, until)))
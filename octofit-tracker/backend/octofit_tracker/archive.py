@@ -0,0 +1,329 @@
+"""
+Columnar archive of the ``activities`` collection.
+
+``export()`` streams activities in ``(completed_at, _id)`` order from a
+server-side cursor and writes them as monthly partitions::
+
+    <ARCHIVE_DIR>/activities/month=2024-05/part-00000.json
+    <ARCHIVE_DIR>/activities/month=2024-05/part-00000.<column>.bin
+
+Each part is a set of column files in an Arrow-like layout: fixed-width
+little-endian buffers (``int64`` numbers, ``completed_at`` as microseconds
+since the epoch), ids dictionary-encoded as ``int32`` codes, and the
+activity ``_id`` as offsets plus UTF-8 data. The JSON manifest (written
+last, so a part without one is ignored) records the row count, the
+``completed_at`` range and the dictionaries. The files can be
+memory-mapped and used in place, without parsing, by
+``archive_analytics.py`` (or by ``numpy.memmap``/Arrow buffers directly).
+
+Runs are incremental: every manifest records the ``(completed_at, _id)``
+of its last row, and the next run continues after the greatest one (the
+watermark). Since a part only counts once its manifest exists, a run that
+dies part-way resumes without gaps or duplicates. Only activities
+completed more than ``lag`` ago are exported, so ones still being logged
+late are not skipped.
+
+Activities carry no insertion time, so the watermark cannot see changes
+behind it: an upload back-dated by more than ``lag``, an edited or
+deleted activity, or one that aged into the cold tier (``tiering.py``)
+before it was exported leaves its month out of date. ``verify()``
+compares the row count and points of every month up to the watermark
+with both tiers and reports the months that differ, and ``rebuild()``
+re-exports such a month from both tiers. An activity moved to another
+user or team without a points change is not detected.
+"""
+import json
+import os
+import shutil
+import sys
+from array import array
+from datetime import datetime, timedelta
+
+from django.conf import settings
+
+from .mongo import get_db
+from .rollups import to_utc_naive
+from .tiering import COLD, HOT, both_tiers
+
+TABLE = 'activities'
+ROWS_PER_PART = 1000000
+BATCH_SIZE = 10000
+DEFAULT_LAG = timedelta(hours=1)
+EPOCH = datetime(1970, 1, 1)
+
+# {column: kind}; 'dict' columns are int32 codes into the part's dictionary.
+COLUMNS = {
+    '_id': 'utf8',
+    'user_id': 'dict',
+    'team_id': 'dict',
+    'workout_id': 'dict',
+    'quantity': 'int64',
+    'points_earned': 'int64',
+    'completed_at': 'timestamp_us',
+}
+TYPECODES = {'dict': 'i', 'int64': 'q', 'timestamp_us': 'q'}
+PROJECTION = {name: 1 for name in COLUMNS}
+
+
+def to_micros(value):
+    delta = to_utc_naive(value) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def table_dir(directory):
+    return os.path.join(directory, TABLE)
+
+
+def partition_name(completed_at):
+    return f'month={completed_at:%Y-%m}'
+
+
+def partition_bounds(partition):
+    """``[start, end)`` of the month a partition holds."""
+    start = datetime.strptime(partition, 'month=%Y-%m')
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+
+def _write_buffer(path, values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    with open(path, 'wb') as handle:
+        values.tofile(handle)
+
+
+def _write_json(path, data):
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as handle:
+        json.dump(data, handle)
+    os.replace(temporary, path)
+
+
+def manifests(directory, partitions=None):
+    """``(partition, manifest path)`` of every complete part, in order."""
+    root = table_dir(directory)
+    if not os.path.isdir(root):
+        return []
+    found = []
+    for partition in sorted(os.listdir(root)):
+        if not partition.startswith('month=') or (partitions is not None and partition not in partitions):
+            continue
+        for name in sorted(os.listdir(os.path.join(root, partition))):
+            if name.startswith('part-') and name.endswith('.json'):
+                found.append((partition, os.path.join(root, partition, name)))
+    return found
+
+
+def read_manifest(path):
+    with open(path, encoding='utf-8') as handle:
+        return json.load(handle)
+
+
+def read_watermark(directory):
+    """``(completed_at, _id)`` of the last exported activity, or ``None``."""
+    last = max((tuple(read_manifest(path)['last']) for _, path in manifests(directory)), default=None)
+    return (from_micros(last[0]), last[1]) if last else None
+
+
+class _PartWriter:
+    """Accumulates the rows of one part of one partition."""
+
+    def __init__(self, partition):
+        self.partition = partition
+        self.rows = 0
+        self.offsets = array('q', [0])
+        self.data = bytearray()
+        self.codes = {name: array('i') for name, kind in COLUMNS.items() if kind == 'dict'}
+        self.dictionaries = {name: {} for name in self.codes}
+        self.numbers = {name: array('q') for name, kind in COLUMNS.items() if kind in ('int64', 'timestamp_us')}
+        self.points = 0
+
+    def append(self, document):
+        self.data += document['_id'].encode('utf-8')
+        self.offsets.append(len(self.data))
+        for name, codes in self.codes.items():
+            dictionary = self.dictionaries[name]
+            value = document.get(name) or ''
+            codes.append(dictionary.setdefault(value, len(dictionary)))
+        for name, values in self.numbers.items():
+            value = document.get(name)
+            values.append(to_micros(value) if name == 'completed_at' else int(value or 0))
+        self.points += int(document.get('points_earned') or 0)
+        self.rows += 1
+
+    def write(self, directory, last):
+        """Write the column files, then the manifest. Returns the manifest path."""
+        partition_dir = os.path.join(table_dir(directory), self.partition)
+        os.makedirs(partition_dir, exist_ok=True)
+        number = sum(1 for name in os.listdir(partition_dir) if name.startswith('part-') and name.endswith('.json'))
+        stem = os.path.join(partition_dir, f'part-{number:05d}')
+        columns = {'_id': {'type': 'utf8', 'offsets': f'{os.path.basename(stem)}._id.offsets.bin',
+                           'data': f'{os.path.basename(stem)}._id.data.bin'}}
+        _write_buffer(f'{stem}._id.offsets.bin', self.offsets)
+        with open(f'{stem}._id.data.bin', 'wb') as handle:
+            handle.write(self.data)
+        for name, values in list(self.codes.items()) + list(self.numbers.items()):
+            _write_buffer(f'{stem}.{name}.bin', values)
+            columns[name] = {'type': COLUMNS[name], 'file': f'{os.path.basename(stem)}.{name}.bin'}
+        completed = self.numbers['completed_at']
+        manifest = {
+            'rows': self.rows,
+            'points': self.points,
+            'columns': columns,
+            'dictionaries': {name: list(dictionary) for name, dictionary in self.dictionaries.items()},
+            'completed_at': {'min': min(completed), 'max': max(completed)},
+            'last': [to_micros(last['completed_at']), last['_id']],
+        }
+        _write_json(f'{stem}.json', manifest)
+        return f'{stem}.json'
+
+
+def _write_parts(documents, directory, rows_per_part, progress):
+    """Write ``documents`` (in ``(completed_at, _id)`` order) as parts. Returns ``(rows, manifest paths)``."""
+    parts, total = [], 0
+    writer, last = None, None
+
+    def flush(writer, last):
+        parts.append(writer.write(directory, last))
+        if progress:
+            progress(writer.partition, writer.rows)
+
+    for document in documents:
+        partition = partition_name(to_utc_naive(document['completed_at']))
+        if writer is not None and (writer.partition != partition or writer.rows >= rows_per_part):
+            flush(writer, last)
+            writer = None
+        if writer is None:
+            writer = _PartWriter(partition)
+        writer.append(document)
+        last = document
+        total += 1
+    if writer is not None:
+        flush(writer, last)
+    return total, parts
+
+
+def export(db=None, directory=None, until=None, lag=DEFAULT_LAG, rows_per_part=ROWS_PER_PART,
+           batch_size=BATCH_SIZE, progress=None):
+    """
+    Append the activities completed since the watermark (and before
+    ``until``, default now minus ``lag``) to the archive in ``directory``.
+    Returns ``{'rows': ..., 'parts': [manifest paths]}``.
+    """
+    db = db if db is not None else get_db()
+    directory = directory or settings.ARCHIVE_DIR
+    until = to_utc_naive(until) if until is not None else datetime.utcnow() - lag
+    query = {'completed_at': {'$lt': until}}
+    watermark = read_watermark(directory)
+    if watermark is not None:
+        after, last_id = watermark
+        query = {'$and': [query, {'$or': [
+            {'completed_at': {'$gt': after}},
+            {'completed_at': after, '_id': {'$gt': last_id}},
+        ]}]}
+    cursor = (db.activities.find(query, PROJECTION)
+              .sort([('completed_at', 1), ('_id', 1)]).batch_size(batch_size))
+    try:
+        total, parts = _write_parts(cursor, directory, rows_per_part, progress)
+    finally:
+        cursor.close()
+    return {'rows': total, 'parts': parts}
+
+
+def _through(watermark, start, end):
+    """Activities completed in ``[start, end)`` and at or before the watermark."""
+    after, last_id = watermark
+    return {'$and': [
+        {'completed_at': {'$gte': start, '$lt': end}},
+        {'$or': [{'completed_at': {'$lt': after}}, {'completed_at': after, '_id': {'$lte': last_id}}]},
+    ]}
+
+
+def _live_totals(db, match):
+    # Grouped by _id first so an activity caught mid-move counts once.
+    rows = list(db[HOT].aggregate(both_tiers(match) + [
+        {'$group': {'_id': '$_id', 'points': {'$first': '$points_earned'}}},
+        {'$group': {'_id': None, 'rows': {'$sum': 1}, 'points': {'$sum': '$points'}}},
+    ], allowDiskUse=True))
+    return (rows[0]['rows'], rows[0]['points']) if rows else (0, 0)
+
+
+def _first_month(db):
+    firsts = [document['completed_at'] for tier in (HOT, COLD)
+              for document in db[tier].find({}, {'completed_at': 1}).sort([('completed_at', 1)]).limit(1)]
+    return partition_name(to_utc_naive(min(firsts))) if firsts else None
+
+
+def verify(db=None, directory=None):
+    """
+    Compare every archived month, and every month with activities up to
+    the watermark, against both tiers. Returns ``[{'partition',
+    'archived': (rows, points), 'live': (rows, points)}]`` for the months
+    that differ.
+    """
+    db = db if db is not None else get_db()
+    directory = directory or settings.ARCHIVE_DIR
+    watermark = read_watermark(directory)
+    if watermark is None:
+        return []
+    archived = {}
+    for partition, path in manifests(directory):
+        manifest = read_manifest(path)
+        rows, points = archived.get(partition, (0, 0))
+        archived[partition] = (rows + manifest['rows'], points + manifest.get('points', 0))
+    months = set(archived)
+    month = _first_month(db)
+    last = partition_name(watermark[0])
+    while month is not None and month <= last:
+        months.add(month)
+        month = partition_name(partition_bounds(month)[1])
+    stale = []
+    for partition in sorted(months):
+        live = _live_totals(db, _through(watermark, *partition_bounds(partition)))
+        if live != archived.get(partition, (0, 0)):
+            stale.append({'partition': partition, 'archived': archived.get(partition, (0, 0)), 'live': live})
+    return stale
+
+
+def _once(documents):
+    # Sorted by _id within a timestamp, so a document in both tiers comes twice in a row.
+    previous = None
+    for document in documents:
+        if previous is None or document['_id'] != previous['_id']:
+            yield document
+        previous = document
+
+
+def rebuild(partition, db=None, directory=None, rows_per_part=ROWS_PER_PART, progress=None):
+    """
+    Re-export one month (``month=YYYY-MM``) from both tiers, up to the
+    watermark, and swap it in for the archived one. Readers listing the
+    archive during the swap can briefly miss the month.
+    Returns ``{'rows': ..., 'parts': [manifest paths]}``.
+    """
+    db = db if db is not None else get_db()
+    directory = directory or settings.ARCHIVE_DIR
+    watermark = read_watermark(directory)
+    if watermark is None:
+        return {'rows': 0, 'parts': []}
+    documents = db[HOT].aggregate(both_tiers(_through(watermark, *partition_bounds(partition))) + [
+        {'$project': PROJECTION},
+        {'$sort': {'completed_at': 1, '_id': 1}},
+    ], allowDiskUse=True)
+    staging = os.path.join(directory, f'.rebuild-{partition}')
+    shutil.rmtree(staging, ignore_errors=True)
+    total, parts = _write_parts(_once(documents), staging, rows_per_part, progress)
+    target = os.path.join(table_dir(directory), partition)
+    replaced = os.path.join(table_dir(directory), f'.replaced-{partition}')
+    if os.path.isdir(target):
+        os.rename(target, replaced)
+    if parts:
+        os.makedirs(table_dir(directory), exist_ok=True)
+        os.rename(os.path.join(table_dir(staging), partition), target)
+    shutil.rmtree(replaced, ignore_errors=True)
+    shutil.rmtree(staging, ignore_errors=True)
+    return {'rows': total, 'parts': [path.replace(staging, directory, 1) for path in parts]}
@@ -0,0 +1,176 @@
+"""
+Historical reports computed from the columnar archive (``archive.py``)
+instead of the database.
+
+The column files of every part are memory-mapped and read in place: the
+operating system pages them in on demand and shares them between
+processes, and nothing is parsed or copied. With NumPy installed the
+aggregates are vectorized kernels over the mapped buffers
+(``np.bincount`` over the dictionary codes, boolean masks for time
+ranges), which run at memory bandwidth. Without it the same buffers are
+read through ``memoryview`` with plain loops, which gives the same
+results, only slower.
+
+Partitions outside the requested time range are skipped by name, and
+parts by the ``completed_at`` range of their manifest.
+"""
+import mmap
+import os
+import sys
+from array import array
+from collections import defaultdict
+
+from django.conf import settings
+
+from .archive import TYPECODES, manifests, partition_name, read_manifest, to_micros
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional, see module docstring
+    numpy = None
+
+GROUP_COLUMNS = {'user': 'user_id', 'team': 'team_id', 'workout': 'workout_id'}
+DTYPES = {'i': '<i4', 'q': '<i8'}
+
+
+class Part:
+    """One archived part with its columns memory-mapped."""
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(path)
+        self.manifest = read_manifest(path)
+        self.rows = self.manifest['rows']
+        self._maps = []
+
+    def column(self, name):
+        """The column as a NumPy array, or a ``memoryview`` of ints without NumPy."""
+        spec = self.manifest['columns'][name]
+        typecode = TYPECODES[spec['type']]
+        with open(os.path.join(self.directory, spec['file']), 'rb') as handle:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        if numpy is not None:
+            return numpy.frombuffer(mapped, dtype=DTYPES[typecode])
+        view = memoryview(mapped).cast(typecode)
+        if sys.byteorder == 'big':
+            values = array(typecode, view)
+            values.byteswap()
+            return values
+        return view
+
+    def dictionary(self, name):
+        return self.manifest['dictionaries'][name]
+
+    def overlaps(self, since, until):
+        bounds = self.manifest['completed_at']
+        return (since is None or bounds['max'] >= since) and (until is None or bounds['min'] < until)
+
+    def close(self):
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                # Still referenced by an array handed out by column().
+                pass
+        self._maps = []
+
+
+def _partitions(directory, since, until):
+    """Partition names between ``since`` and ``until`` (``None`` for all)."""
+    if since is None and until is None:
+        return None
+    names = {partition for partition, _ in manifests(directory)}
+    low = partition_name(since) if since is not None else ''
+    high = partition_name(until) if until is not None else '~'
+    return {name for name in names if low <= name <= high}
+
+
+def parts(directory=None, since=None, until=None):
+    """The archived parts holding activities completed in ``[since, until)``."""
+    directory = directory or settings.ARCHIVE_DIR
+    since_us = to_micros(since) if since is not None else None
+    until_us = to_micros(until) if until is not None else None
+    found = []
+    for _partition, path in manifests(directory, _partitions(directory, since, until)):
+        part = Part(path)
+        if part.rows and part.overlaps(since_us, until_us):
+            found.append(part)
+    return found
+
+
+def _aggregate_numpy(part, codes, size, since, until):
+    points = part.column('points_earned')
+    quantity = part.column('quantity')
+    if since is not None or until is not None:
+        completed = part.column('completed_at')
+        mask = numpy.ones(part.rows, dtype=bool)
+        if since is not None:
+            mask &= completed >= since
+        if until is not None:
+            mask &= completed < until
+        codes, points, quantity = codes[mask], points[mask], quantity[mask]
+    return zip(
+        numpy.bincount(codes, weights=points, minlength=size).astype(numpy.int64).tolist(),
+        numpy.bincount(codes, minlength=size).tolist(),
+        numpy.bincount(codes, weights=quantity, minlength=size).astype(numpy.int64).tolist(),
+    )
+
+
+def _aggregate_python(part, codes, size, since, until):
+    totals = [[0, 0, 0] for _ in range(size)]
+    points, quantity = part.column('points_earned'), part.column('quantity')
+    if since is None and until is None:
+        for code, earned, amount in zip(codes, points, quantity):
+            row = totals[code]
+            row[0] += earned
+            row[1] += 1
+            row[2] += amount
+        return totals
+    for code, earned, amount, completed in zip(codes, points, quantity, part.column('completed_at')):
+        if (since is None or completed >= since) and (until is None or completed < until):
+            row = totals[code]
+            row[0] += earned
+            row[1] += 1
+            row[2] += amount
+    return totals
+
+
+def totals(by='user', directory=None, since=None, until=None):
+    """
+    Points, activity count and quantity per user, team or workout over the
+    archived activities completed in ``[since, until)``, ranked like
+    ``aggregations.period_leaderboard``: ``[{entity_id, total_points,
+    activities_count, quantity, rank}, ...]``.
+    """
+    if by not in GROUP_COLUMNS:
+        raise ValueError(f"'by' must be one of {', '.join(GROUP_COLUMNS)}")
+    column = GROUP_COLUMNS[by]
+    since_us = to_micros(since) if since is not None else None
+    until_us = to_micros(until) if until is not None else None
+    aggregate = _aggregate_numpy if numpy is not None else _aggregate_python
+    merged = defaultdict(lambda: [0, 0, 0])
+    for part in parts(directory, since, until):
+        try:
+            # The manifest range is checked per part; rows only need a mask at the edges.
+            bounds = part.manifest['completed_at']
+            low = since_us if since_us is not None and bounds['min'] < since_us else None
+            high = until_us if until_us is not None and bounds['max'] >= until_us else None
+            dictionary = part.dictionary(column)
+            for entity_id, (points, count, quantity) in zip(
+                    dictionary, aggregate(part, part.column(column), len(dictionary), low, high)):
+                if count and entity_id:
+                    row = merged[entity_id]
+                    row[0] += points
+                    row[1] += count
+                    row[2] += quantity
+        finally:
+            part.close()
+    rows = [{'entity_id': entity_id, 'total_points': points, 'activities_count': count, 'quantity': quantity}
+            for entity_id, (points, count, quantity) in merged.items()]
+    rows.sort(key=lambda row: (-row['total_points'], row['entity_id']))
+    for position, row in enumerate(rows):
+        previous = rows[position - 1] if position else None
+        same = previous is not None and previous['total_points'] == row['total_points']
+        row['rank'] = previous['rank'] if same else position + 1
+    return rows
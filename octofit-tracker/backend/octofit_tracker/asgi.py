@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up. /api/stream/ (Server-Sent Events and
+# WebSockets, see push.py) is served outside Django's request cycle.
+from octofit_tracker.push import PushRouter  # noqa: E402
+
+application = PushRouter(django_application)
@@ -0,0 +1,37 @@
+"""
+Non-blocking MongoDB access for the async views (``async_views.py``).
+
+``get_async_db()`` returns a motor database for the same server and
+database as the djongo connection, configured with the same client
+options (``mongo.client_options()``) and pool listener.
+Motor clients are bound to the event loop they were first used on, so one
+client is kept per running loop. motor is only needed when the async views
+are served (``pip install motor``); tests use ``tests/support/fake_motor.py``.
+"""
+import asyncio
+import weakref
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .instrumentation import command_timer, pool_metrics
+from .mongo import client_options
+
+try:
+    import motor.motor_asyncio as motor_asyncio
+except ImportError:  # optional dependency
+    motor_asyncio = None
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_db():
+    """The motor database of the running event loop."""
+    if motor_asyncio is None:
+        raise ImproperlyConfigured('The async API views require motor (pip install motor).')
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = motor_asyncio.AsyncIOMotorClient(event_listeners=[pool_metrics, command_timer],
+                                                                   **client_options())
+    return client[settings.DATABASES['default']['NAME']]
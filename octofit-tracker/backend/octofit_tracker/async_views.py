@@ -0,0 +1,159 @@
+"""
+Async (ASGI-native) versions of the hot read endpoints.
+
+These are plain Django coroutine views on motor (``async_mongo.py``): a
+request waiting on MongoDB parks its coroutine instead of holding a worker
+thread, so one ASGI worker can serve thousands of concurrent pollers.
+Independent queries of one response (the reads of a team dashboard) are
+issued together with ``asyncio.gather``.
+
+Documents are converted with the compiled serializers
+(``fast_serializers.py``) and rendered by the orjson renderer, so the
+items are identical to those of the synchronous ViewSets. Conditional GET
+uses the same version counters and validators as ``conditional.py``.
+Under WSGI the views still work, each on its own event loop.
+"""
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+
+from . import team_summaries, versions
+from .async_mongo import get_async_db
+from .conditional import not_modified, set_validators, validators
+from .fast_serializers import compile_serializer
+from .models import Activity, Leaderboard, Team, User
+from .renderers import TimedORJSONRenderer
+from .serializers import ActivitySerializer, LeaderboardSerializer
+
+RECENT_ACTIVITIES = 20
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+_current_versions = sync_to_async(versions.current, thread_sensitive=False)
+
+
+def _json(data, status=200):
+    content = TimedORJSONRenderer().render(data)
+    return HttpResponse(content, status=status, content_type='application/json')
+
+
+class _BadRequest(Exception):
+    def __init__(self, detail):
+        self.detail = detail
+
+
+def _int_param(request, name, default, maximum):
+    try:
+        value = int(request.GET.get(name, default))
+    except ValueError:
+        raise _BadRequest({name: 'Must be an integer.'})
+    return max(1, min(value, maximum))
+
+
+def async_get(*collections):
+    """
+    GET/HEAD-only async view reading ``collections`` (``db_table`` names),
+    with ETag/Last-Modified validation before the view runs.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                response = _json({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+                response['Allow'] = 'GET, HEAD'
+                return response
+            conditional = None
+            if versions.shared():
+                key = (view.__name__, sorted(kwargs.items()), request.get_full_path())
+                conditional = validators(key, await _current_versions(collections))
+            if conditional and not_modified(request, *conditional):
+                response = HttpResponse(status=304)
+            else:
+                try:
+                    response = await view(request, **kwargs)
+                except _BadRequest as exc:
+                    return _json(exc.detail, status=400)
+            if conditional and response.status_code in (200, 304):
+                set_validators(response, *conditional)
+            return response
+        return wrapper
+    return decorator
+
+
+def _not_found():
+    return _json({'detail': 'Not found.'}, status=404)
+
+
+def _recent(db, field, value, limit):
+    return (db[Activity._meta.db_table].find({field: value})
+            .sort(team_summaries.RECENT_SORT).limit(limit).to_list(limit))
+
+
+@async_get('leaderboard')
+async def leaderboard(request):
+    """The all-time leaderboard (?type=individual|team&limit=), ranked."""
+    board_type = request.GET.get('type', 'individual')
+    if board_type not in ('individual', 'team'):
+        raise _BadRequest({'type': "Must be 'individual' or 'team'."})
+    limit = _int_param(request, 'limit', 100, 1000)
+    db = get_async_db()
+    documents = await (db[Leaderboard._meta.db_table].find({'type': board_type})
+                       .sort([('rank', 1), ('_id', 1)]).limit(limit).to_list(limit))
+    return _json({'results': compile_serializer(LeaderboardSerializer).many_documents(documents)})
+
+
+@async_get('activities')
+async def recent_activities(request):
+    """The most recent activities."""
+    db = get_async_db()
+    documents = await (db[Activity._meta.db_table].find()
+                       .sort(team_summaries.RECENT_SORT)
+                       .limit(RECENT_ACTIVITIES).to_list(RECENT_ACTIVITIES))
+    return _json(compile_serializer(ActivitySerializer).many_documents(documents))
+
+
+@async_get('users', 'activities')
+async def user_activities(request, pk):
+    """A user's most recent activities (?limit=)."""
+    limit = _int_param(request, 'limit', DEFAULT_LIMIT, MAX_LIMIT)
+    db = get_async_db()
+    user, documents = await asyncio.gather(
+        db[User._meta.db_table].find_one({'_id': pk}, {'_id': 1}),
+        _recent(db, 'user_id', pk, limit),
+    )
+    if user is None:
+        return _not_found()
+    return _json({'results': compile_serializer(ActivitySerializer).many_documents(documents)})
+
+
+@async_get('teams', 'activities')
+async def team_activities(request, pk):
+    """A team's most recent activities (?limit=)."""
+    limit = _int_param(request, 'limit', DEFAULT_LIMIT, MAX_LIMIT)
+    db = get_async_db()
+    team, documents = await asyncio.gather(
+        db[Team._meta.db_table].find_one({'_id': pk}, {'_id': 1}),
+        _recent(db, 'team_id', pk, limit),
+    )
+    if team is None:
+        return _not_found()
+    return _json({'results': compile_serializer(ActivitySerializer).many_documents(documents)})
+
+
+@async_get('teams', 'users', 'leaderboard', 'team_summaries')
+async def team_dashboard(request, pk):
+    """The team dashboard (``team_summaries.py``), its four reads issued together."""
+    members = _int_param(request, 'members', team_summaries.DEFAULT_MEMBERS, team_summaries.MAX_MEMBERS)
+    db = get_async_db()
+    team, summary, member_documents, standing = await asyncio.gather(
+        db[Team._meta.db_table].find_one({'_id': pk}),
+        db[team_summaries.COLLECTION].find_one({'_id': pk}),
+        db[User._meta.db_table].find({'team_id': pk})
+        .sort(team_summaries.MEMBER_SORT).limit(members).to_list(members),
+        db[Leaderboard._meta.db_table].find_one({'type': 'team', 'entity_id': pk}, {'rank': 1}),
+    )
+    if team is None:
+        return _not_found()
+    return _json(team_summaries.build_dashboard(team, summary, member_documents, standing))
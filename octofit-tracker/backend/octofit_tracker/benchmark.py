@@ -0,0 +1,194 @@
+"""
+In-process HTTP benchmarks for the API routes.
+
+Every GET route registered on the router is exercised (list, detail, one
+filtered, searched and ordered variant of the list, and each GET extra
+action) through Django's test ``Client``, with several client threads
+issuing requests at once. For every endpoint the run records latency
+percentiles, throughput, the number of MongoDB commands one request
+issues (``queries``: counted by ``instrumentation.command_timer``, so ORM
+queries on every alias and raw pymongo calls alike) and the memory that
+request allocated at peak (``tracemalloc``).
+
+Results are plain JSON so they can be stored as a baseline and compared
+against later runs; ``compare()`` lists the endpoints that regressed
+beyond a threshold.
+"""
+import json
+import math
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from .instrumentation import count_commands
+
+DEFAULT_THRESHOLD = 0.25
+# Differences below this many milliseconds are treated as noise.
+LATENCY_FLOOR_MS = 2.0
+
+Endpoint = namedtuple('Endpoint', 'name path')
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values`` (``fraction`` in [0, 1])."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+def sample_rows(registry):
+    """``{basename: row}``: one stored row per ViewSet, used to build URLs."""
+    samples = {}
+    for _prefix, viewset, basename in registry:
+        samples[basename] = viewset.queryset.model.objects.values().first()
+    return samples
+
+
+def plan_endpoints(registry, samples):
+    """The ``Endpoint`` list to benchmark for a router ``registry``."""
+    endpoints = []
+    for _prefix, viewset, basename in registry:
+        sample = samples.get(basename)
+        list_url = reverse(f'{basename}-list')
+        endpoints.append(Endpoint(f'{basename}-list', list_url))
+        pk = sample[viewset.queryset.model._meta.pk.attname] if sample else None
+        if pk is not None:
+            endpoints.append(Endpoint(f'{basename}-detail', reverse(f'{basename}-detail', args=[pk])))
+        for field in getattr(viewset, 'filterset_fields', ()):
+            if sample and sample.get(field) is not None:
+                endpoints.append(Endpoint(f'{basename}-list?{field}',
+                                          f'{list_url}?{urlencode({field: sample[field]})}'))
+        search_fields = getattr(viewset, 'search_fields', ())
+        if search_fields and sample and sample.get(search_fields[0]):
+            term = str(sample[search_fields[0]]).split()[0]
+            endpoints.append(Endpoint(f'{basename}-list?search', f'{list_url}?{urlencode({"search": term})}'))
+        for field in getattr(viewset, 'ordering_fields', ()):
+            endpoints.append(Endpoint(f'{basename}-list?ordering=-{field}',
+                                      f'{list_url}?{urlencode({"ordering": f"-{field}"})}'))
+        for action in viewset.get_extra_actions():
+            if 'get' not in action.mapping:
+                continue
+            name = f'{basename}-{action.url_name}'
+            if action.detail:
+                if pk is not None:
+                    endpoints.append(Endpoint(name, reverse(name, args=[pk])))
+            else:
+                endpoints.append(Endpoint(name, reverse(name)))
+    return endpoints
+
+
+def _get(client, path):
+    start = time.perf_counter()
+    response = client.get(path)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return (time.perf_counter() - start) * 1000, response.status_code
+
+
+def _profile(path):
+    """MongoDB command count and peak allocated KiB of a single request."""
+    client = Client(raise_request_exception=False)
+    _get(client, path)  # warm up lazy imports and caches
+    with count_commands() as commands:
+        _get(client, path)
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        _elapsed, status = _get(client, path)
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return commands.count, peak / 1024, status
+
+
+def run_endpoint(endpoint, requests=100, concurrency=4):
+    """Benchmark one endpoint and return its result dict."""
+    queries, peak_kib, status = _profile(endpoint.path)
+    latencies, statuses = [], set()
+    lock = threading.Lock()
+    shares = [requests // concurrency + (1 if index < requests % concurrency else 0)
+              for index in range(concurrency)]
+
+    def worker(count):
+        client = Client(raise_request_exception=False)
+        timings, codes = [], set()
+        try:
+            for _ in range(count):
+                elapsed, code = _get(client, endpoint.path)
+                timings.append(elapsed)
+                codes.add(code)
+        finally:
+            connections.close_all()
+        with lock:
+            latencies.extend(timings)
+            statuses.update(codes)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, [share for share in shares if share]))
+    wall = time.perf_counter() - started
+    return OrderedDict([
+        ('path', endpoint.path),
+        ('status', sorted(statuses | {status})),
+        ('requests', len(latencies)),
+        ('concurrency', concurrency),
+        ('p50_ms', round(percentile(latencies, 0.50), 3)),
+        ('p95_ms', round(percentile(latencies, 0.95), 3)),
+        ('p99_ms', round(percentile(latencies, 0.99), 3)),
+        ('throughput_rps', round(len(latencies) / wall, 1) if wall else None),
+        ('queries', queries),
+        ('peak_kib', round(peak_kib, 1)),
+    ])
+
+
+def run(endpoints, requests=100, concurrency=4, progress=None):
+    results = OrderedDict()
+    for endpoint in endpoints:
+        results[endpoint.name] = run_endpoint(endpoint, requests, concurrency)
+        if progress:
+            progress(endpoint.name, results[endpoint.name])
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    ``[(endpoint, metric, baseline, current), ...]`` for every metric that
+    got worse than ``baseline`` by more than ``threshold`` (a fraction).
+
+    Latency and memory are compared relatively, query counts exactly.
+    Endpoints missing from either side are ignored.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            limit = max(previous[metric] * (1 + threshold), previous[metric] + LATENCY_FLOOR_MS)
+            if current[metric] > limit:
+                regressions.append((name, metric, previous[metric], current[metric]))
+        if current['peak_kib'] > previous['peak_kib'] * (1 + threshold):
+            regressions.append((name, 'peak_kib', previous['peak_kib'], current['peak_kib']))
+        if current['queries'] > previous['queries']:
+            regressions.append((name, 'queries', previous['queries'], current['queries']))
+    return regressions
+
+
+def load_baseline(path):
+    with open(path) as handle:
+        return json.load(handle)['endpoints']
+
+
+def save_baseline(path, results, meta):
+    with open(path, 'w') as handle:
+        json.dump({'meta': meta, 'endpoints': results}, handle, indent=2)
+        handle.write('\n')
@@ -0,0 +1,240 @@
+"""
+Response cache for the read-heavy endpoints.
+
+Cached responses live in the ``responses`` alias of ``settings.CACHES``
+(LocMemCache by default, which gives TTL expiry and LRU culling per
+process; ``RedisProtocolCache`` below shares it between workers).
+
+Invalidation is version based: the counters (``versions.py``) of the
+collections a view reads are part of its cache key. A write therefore
+makes exactly the affected entries unreachable, and they age out through
+the TTL/LRU instead of being deleted one by one. Responses read from a
+secondary that may not have the latest writes are not stored
+(``replicas.may_be_stale``).
+"""
+import hashlib
+import pickle
+import socket
+import threading
+from functools import wraps
+from urllib.parse import urlparse
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from rest_framework.response import Response
+
+from .replicas import may_be_stale
+from .resolve import expand_reads
+from .versions import current, reads
+
+RESPONSE_CACHE_ALIAS = 'responses'
+
+
+def response_cache():
+    return caches[RESPONSE_CACHE_ALIAS]
+
+
+def response_key(view_name, request, collections, view_kwargs=None):
+    """Cache key from the view, its full query string and collection versions."""
+    params = sorted(request.query_params.lists())
+    versions = [version for version, _ in current(collections)]
+    raw = repr((request.build_absolute_uri(request.path), sorted((view_kwargs or {}).items()),
+                params, versions))
+    return f'response:{view_name}:{hashlib.sha1(raw.encode("utf-8")).hexdigest()}'
+
+
+def cache_response(*collections, timeout=DEFAULT_TIMEOUT):
+    """
+    Cache the ``Response.data`` of a ViewSet action.
+
+    ``collections`` are the ``db_table`` names the action reads (plus those
+    of ``?expand=``); a write to any of them invalidates the entry.
+    Streamed and non-200 responses are never cached.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            cache = response_cache()
+            read = collections + expand_reads(request)
+            key = response_key(f'{self.basename}.{method.__name__}', request, read, kwargs)
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+            response = method(self, request, *args, **kwargs)
+            if isinstance(response, Response) and response.status_code == 200 and not may_be_stale(read):
+                cache.set(key, response.data, timeout)
+            return response
+        return reads(*collections)(wrapper)
+    return decorator
+
+
+class RedisError(Exception):
+    pass
+
+
+def parse_redis_url(url):
+    """``(host, port, db, password)`` of a ``redis://[:password@]host:port/db`` URL."""
+    url = urlparse(url if '://' in url else f'redis://{url}')
+    return url.hostname or 'localhost', url.port or 6379, int((url.path or '/0').lstrip('/') or 0), url.password
+
+
+class _RespConnection:
+    """A single blocking connection speaking the Redis (RESP2) protocol."""
+
+    def __init__(self, host, port, db, password, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile('rb')
+        if password:
+            self.execute('AUTH', password)
+        if db:
+            self.execute('SELECT', db)
+
+    def execute(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self.sock.sendall(b''.join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            raise RedisError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            count = int(rest)
+            return None if count < 0 else [self._read() for _ in range(count)]
+        raise RedisError(f'Unexpected reply {line!r}')
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisProtocolCache(BaseCache):
+    """
+    Django cache backend for any server speaking the Redis protocol.
+
+    ``LOCATION`` is a ``redis://[:password@]host:port/db`` URL. Connections
+    are kept per thread. Integers are stored as plain numbers so ``INCRBY``
+    works on them; everything else is pickled. Configure the server with an
+    ``allkeys-lru`` maxmemory policy to get LRU eviction.
+    """
+
+    def __init__(self, server, params):
+        super().__init__(params)
+        self._host, self._port, self._db, self._password = parse_redis_url(server)
+        self._socket_timeout = params.get('OPTIONS', {}).get('SOCKET_TIMEOUT', 1.0)
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = _RespConnection(self._host, self._port, self._db, self._password, self._socket_timeout)
+            self._local.conn = conn
+        return conn
+
+    def _execute(self, *args):
+        try:
+            return self._connection().execute(*args)
+        except (OSError, ConnectionError):
+            # One reconnect attempt for connections dropped by the server.
+            conn = getattr(self._local, 'conn', None)
+            if conn is not None:
+                conn.close()
+            self._local.conn = None
+            return self._connection().execute(*args)
+
+    def _dump(self, value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return str(value).encode('ascii')
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def _load(self, data):
+        if data is None:
+            return None
+        try:
+            return int(data)
+        except ValueError:
+            return pickle.loads(data)
+
+    def get_backend_timeout(self, timeout=DEFAULT_TIMEOUT):
+        # Redis takes relative expiries, not BaseCache's absolute timestamps.
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return None if timeout is None else max(0, timeout)
+
+    def _expiry_args(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return []
+        return ['PX', max(1, int(timeout * 1000))]
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        reply = self._execute('SET', key, self._dump(value), *self._expiry_args(timeout), 'NX')
+        return reply == 'OK'
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        value = self._load(self._execute('GET', key))
+        return default if value is None else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        if self.get_backend_timeout(timeout) == 0:
+            self._execute('DEL', key)
+            return
+        self._execute('SET', key, self._dump(value), *self._expiry_args(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return bool(self._execute('PERSIST', key)) or self.has_key(key)
+        return bool(self._execute('PEXPIRE', key, max(1, int(timeout * 1000))))
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return bool(self._execute('DEL', key))
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return bool(self._execute('EXISTS', key))
+
+    def get_many(self, keys, version=None):
+        if not keys:
+            return {}
+        mapped = {self.make_and_validate_key(key, version=version): key for key in keys}
+        values = self._execute('MGET', *mapped)
+        return {mapped[k]: self._load(v) for k, v in zip(mapped, values) if v is not None}
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        if not self._execute('EXISTS', key):
+            raise ValueError(f"Key '{key}' not found.")
+        return self._execute('INCRBY', key, delta)
+
+    def clear(self):
+        self._execute('FLUSHDB')
+
+    def close(self, **kwargs):
+        # Connections are long-lived per thread; nothing to do per request.
+        pass
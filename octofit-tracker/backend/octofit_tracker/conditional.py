@@ -0,0 +1,101 @@
+"""
+Conditional GET (ETag / Last-Modified) for the API ViewSets.
+
+The validators are derived from the version counters of the collections an
+action reads (``versions.py``), so a matching ``If-None-Match`` or
+``If-Modified-Since`` is answered with ``304 Not Modified`` before the
+handler runs, without any database access. Validators are only sent when
+the counters are shared between workers (``versions.shared()``): a
+worker that did not see a write would otherwise keep confirming the old
+ETag. The module-level helpers are
+shared with the async views (``async_views.py``). Responses read from a
+secondary that may not have the latest writes get no validators
+(``replicas.may_be_stale``).
+"""
+import hashlib
+import math
+import time
+
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import replicas, versions
+from .resolve import expand_reads
+
+
+class _NotModified(Exception):
+    pass
+
+
+def validators(key, state):
+    """``(etag, modified)`` for a response identified by ``key`` over ``state``."""
+    raw = repr((key, [version for version, _ in state]))
+    etag = quote_etag(hashlib.sha1(raw.encode('utf-8')).hexdigest())
+    return etag, max(modified for _, modified in state)
+
+
+def not_modified(request, etag, modified):
+    """Whether the request's ``If-None-Match``/``If-Modified-Since`` still match."""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = parse_etags(if_none_match)
+        return '*' in tags or etag in tags
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return since is not None and modified < since
+
+
+def set_validators(response, etag, modified):
+    response['ETag'] = etag
+    # Last-Modified has a resolution of one second: a second is only
+    # advertised once it is over, so any later write is strictly after it.
+    last_modified = math.ceil(modified)
+    if last_modified <= time.time():
+        response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'no-cache'
+
+
+class ConditionalGetMixin:
+    """
+    Adds strong ``ETag`` and ``Last-Modified`` headers to GET/HEAD responses.
+
+    Actions declare what they read with ``versions.reads()`` (or
+    ``cache.cache_response()``); anything undeclared is assumed to read only
+    the ViewSet model's collection. Collections read for ``?expand=`` are
+    added.
+    """
+
+    def get_read_collections(self):
+        handler = getattr(self, self.action or '', None)
+        declared = getattr(handler, 'reads', None)
+        return tuple(declared or (self.queryset.model._meta.db_table,)) + expand_reads(self.request)
+
+    def _validators(self, request):
+        collections = self.get_read_collections()
+        if not versions.shared() or replicas.may_be_stale(collections):
+            return None
+        key = (
+            self.basename, self.action, sorted(self.kwargs.items()),
+            request.get_full_path(), request.accepted_renderer.format,
+        )
+        return validators(key, versions.current(collections))
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._conditional = None
+        if request.method in ('GET', 'HEAD'):
+            self._conditional = self._validators(request)
+            if self._conditional and not_modified(request, *self._conditional):
+                raise _NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, _NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        conditional = getattr(self, '_conditional', None)
+        if conditional and response.status_code in (200, 304):
+            set_validators(response, *conditional)
+        return response
@@ -0,0 +1,333 @@
+"""
+Write-behind counters for the users' ``total_points`` and
+``activities_completed``.
+
+Applying every activity with its own ``$inc`` makes the documents of the
+most active users (and everyone during a group challenge) the hottest in
+the database. ``counter_buffer`` accumulates the increments in memory
+instead and writes them as one coalesced ``$inc`` per document:
+
+* Entities are spread over ``COUNTER_SHARDS`` shards, each with its own
+  lock, so concurrent requests rarely wait on each other.
+* A shard is flushed with an unordered ``bulk_write`` when it holds
+  ``COUNTER_FLUSH_SIZE`` documents, and every shard at least every
+  ``COUNTER_FLUSH_INTERVAL`` seconds (and at exit).
+* Every increment is first appended to the shard's journal segment under
+  ``COUNTER_JOURNAL_DIR``; a segment is deleted once its batch is written.
+  Segments left by a process that died are replayed the first time the
+  database is used again. Each update records its batch id in the
+  document (``_counter_batches``) and skips documents that already have
+  it, so a replayed or retried batch is never applied twice.
+* ``merge()`` adds the deltas not yet written to documents that are read,
+  so this process serves exact totals (``UserViewSet``, team dashboards,
+  ``LeaderboardViewSet.live``). Raw documents carry their applied batch
+  ids and are always exact; ORM rows may count a batch twice while it is
+  being written. Other workers see the deltas after the next flush.
+
+Writing a batch (or replaying a journal) bumps the ``users`` and
+``leaderboard`` versions, so responses cached or validated before it are
+not served afterwards.
+
+The leaderboard rows stay write-through: the ranking engine ``$inc``s
+each row's own total and shifts ranks with range updates over the stored
+totals, so concurrent workers never overwrite each other's points.
+
+With ``COUNTER_WRITE_BEHIND = False`` increments are written immediately.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+from pymongo import UpdateOne
+
+from .versions import bump
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no segment locking on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+APPLIED_FIELD = '_counter_batches'
+APPLIED_KEEP = 32
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _lock_file(handle, blocking=True):
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except OSError:
+        return False
+    return True
+
+
+def _journal_dir(db):
+    return os.path.join(str(_setting('COUNTER_JOURNAL_DIR', 'var/counters')), db.name)
+
+
+def _apply_increments(db, batch, increments):
+    """``$inc`` each ``{(collection, _id): {field: delta}}`` at most once per ``batch``."""
+    requests = defaultdict(list)
+    for (collection, entity_id), inc in increments.items():
+        requests[collection].append(UpdateOne(
+            {'_id': entity_id, APPLIED_FIELD: {'$ne': batch}},
+            {'$inc': inc, '$push': {APPLIED_FIELD: {'$each': [batch], '$slice': -APPLIED_KEEP}}},
+        ))
+    for collection, updates in requests.items():
+        db[collection].bulk_write(updates, ordered=False)
+    # Responses (and ETags) rendered before the write were merged with this
+    # process's deltas only; other workers must not keep serving theirs.
+    bump(*requests, 'leaderboard')
+
+
+def _add_into(target, increments):
+    for field, delta in increments.items():
+        target[field] = target.get(field, 0) + delta
+
+
+class _Batch:
+    """Increments journaled to one segment and written with one batch id."""
+
+    def __init__(self, db, shard):
+        self.db = db
+        self.id = uuid.uuid4().hex
+        self.increments = {}
+        directory = _journal_dir(db)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{os.getpid()}-{shard}-{self.id}.log')
+        self.journal = open(self.path, 'a', encoding='utf-8')
+        _lock_file(self.journal)
+
+    def append(self, collection, entity_id, increments):
+        self.journal.write(json.dumps([collection, entity_id, increments]) + '\n')
+        self.journal.flush()
+        if _setting('COUNTER_JOURNAL_FSYNC', False):
+            os.fsync(self.journal.fileno())
+        _add_into(self.increments.setdefault((collection, entity_id), {}), increments)
+
+    def close(self):
+        if not self.journal.closed:
+            self.journal.close()
+
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class _Shard:
+    def __init__(self, number):
+        self.number = number
+        self.lock = threading.Lock()
+        self.current = None
+        self.written = []  # closed batches being (or waiting to be) written
+
+
+class CounterBuffer:
+    """Sharded, journaled write-behind ``$inc`` buffer."""
+
+    def __init__(self):
+        self._shards = None
+        self._setup_lock = threading.Lock()
+        self._recovered = set()
+        self._flusher = None
+
+    @property
+    def enabled(self):
+        return _setting('COUNTER_WRITE_BEHIND', True)
+
+    def _get_shards(self):
+        if self._shards is None:
+            with self._setup_lock:
+                if self._shards is None:
+                    self._shards = [_Shard(number) for number in range(_setting('COUNTER_SHARDS', 16))]
+        return self._shards
+
+    def _shard(self, collection, entity_id):
+        shards = self._get_shards()
+        return shards[zlib.crc32(f'{collection}:{entity_id}'.encode('utf-8')) % len(shards)]
+
+    def add(self, db, collection, entity_id, increments):
+        """Add ``{field: delta}`` to the document ``entity_id`` of ``collection``."""
+        if not self.enabled:
+            db[collection].update_one({'_id': entity_id}, {'$inc': increments})
+            return
+        self._recover_once(db)
+        shard = self._shard(collection, entity_id)
+        if shard.current is not None and shard.current.db is not db:
+            self.flush_shard(shard)
+        with shard.lock:
+            if shard.current is None:
+                shard.current = _Batch(db, shard.number)
+            shard.current.append(collection, entity_id, increments)
+            full = len(shard.current.increments) >= _setting('COUNTER_FLUSH_SIZE', 500)
+        self._start_flusher()
+        if full:
+            self.flush_shard(shard)
+
+    def _batches(self, shard):
+        return shard.written + ([shard.current] if shard.current else [])
+
+    def pending(self, collection, entity_id, applied=()):
+        """The ``{field: delta}`` not yet written, leaving out batches in ``applied``."""
+        shard = self._shard(collection, entity_id)
+        total = {}
+        with shard.lock:
+            for batch in self._batches(shard):
+                if batch.id not in applied:
+                    _add_into(total, batch.increments.get((collection, entity_id), {}))
+        return total
+
+    def pending_all(self, collection):
+        """``{_id: {field: delta}}`` of every document of ``collection`` with unwritten deltas."""
+        totals = defaultdict(dict)
+        for shard in self._shards or ():
+            with shard.lock:
+                for batch in self._batches(shard):
+                    for (name, entity_id), increments in batch.increments.items():
+                        if name == collection:
+                            _add_into(totals[entity_id], increments)
+        return totals
+
+    def merge(self, collection, documents, key='_id', fields=None):
+        """
+        Add the pending deltas to ``documents`` in place: raw documents (which
+        carry the applied batch ids) or serialized dicts. ``fields`` maps a
+        counter field to the key it is found under in the documents.
+        """
+        if not self._shards:
+            return documents
+        for document in documents:
+            if not isinstance(document, dict) or key not in document:
+                continue
+            delta = self.pending(collection, document[key], document.get(APPLIED_FIELD) or ())
+            for field, value in delta.items():
+                name = (fields or {}).get(field, field)
+                document[name] = (document.get(name) or 0) + value
+        return documents
+
+    def flush_shard(self, shard):
+        with shard.lock:
+            if shard.current is not None:
+                shard.current.close()
+                shard.written.append(shard.current)
+                shard.current = None
+            batches = list(shard.written)
+        for batch in batches:
+            try:
+                _apply_increments(batch.db, batch.id, batch.increments)
+            except Exception:
+                # Kept (journal and all) and retried with the same batch id.
+                logger.exception('Writing counter batch %s failed', batch.id)
+                return
+            with shard.lock:
+                if batch in shard.written:
+                    shard.written.remove(batch)
+            batch.discard()
+
+    def flush(self):
+        """Write every pending increment now."""
+        for shard in self._shards or ():
+            self.flush_shard(shard)
+
+    def _recover_once(self, db):
+        if db.name in self._recovered:
+            return
+        with self._setup_lock:
+            if db.name not in self._recovered:
+                self.recover(db)
+                self._recovered.add(db.name)
+
+    def recover(self, db):
+        """Replay the journal segments of ``db`` that no running process owns."""
+        directory = _journal_dir(db)
+        for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else ():
+            path = os.path.join(directory, name)
+            with open(path, encoding='utf-8') as handle:
+                if not _lock_file(handle, blocking=False):
+                    continue
+                increments = {}
+                for line in handle:
+                    try:
+                        collection, entity_id, delta = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line of a crashed write
+                    _add_into(increments.setdefault((collection, entity_id), {}), delta)
+                _apply_increments(db, name[:-len('.log')].rsplit('-', 1)[-1], increments)
+            os.remove(path)
+            logger.info('Replayed counter journal %s', path)
+
+    def reset(self):
+        """Drop everything pending without writing it (tests)."""
+        for shard in self._shards or ():
+            with shard.lock:
+                batches = self._batches(shard)
+                shard.written, shard.current = [], None
+            for batch in batches:
+                batch.discard()
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._setup_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, name='counter-flusher',
+                                                 daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(_setting('COUNTER_FLUSH_INTERVAL', 1.0))
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing counters failed')
+
+
+counter_buffer = CounterBuffer()
+
+
+USER_COUNTERS = ('total_points', 'activities_completed')
+_LEADERBOARD_FIELDS = {'activities_completed': 'activities_count'}
+
+
+def merge_serialized_users(data):
+    """Merge pending user deltas into a serialized user, list or page of users."""
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        counter_buffer.merge('users', data['results'])
+    elif isinstance(data, list):
+        counter_buffer.merge('users', data)
+    elif isinstance(data, dict):
+        counter_buffer.merge('users', [data])
+    return data
+
+
+def merge_leaderboard(board_type, rows):
+    """
+    Merge pending user deltas into computed leaderboard rows
+    (``aggregations.live_leaderboard``) and re-rank them. Team rows are
+    summed from the activities themselves, which are never buffered.
+    """
+    if board_type == 'individual':
+        counter_buffer.merge('users', rows, key='entity_id', fields=_LEADERBOARD_FIELDS)
+    rows = sorted(rows, key=lambda row: -(row.get('total_points') or 0))
+    for position, row in enumerate(rows):
+        previous = rows[position - 1] if position else None
+        row['rank'] = previous['rank'] if previous and previous['total_points'] == row['total_points'] else position + 1
+    return rows
@@ -0,0 +1,215 @@
+"""
+Propagation of the User and Workout fields that activities copy.
+
+Every activity stores ``user_name`` and ``user_alias`` of its user and
+``workout_name``, ``workout_icon`` and ``unit`` of its workout
+(``COPIES``). When a user or workout is saved, ``signals.py`` queues a
+propagation job once the transaction commits:
+
+* The job selects the activities of that user/workout whose copies differ
+  from the new values, in the hot and the cold tier (``tiering.py``),
+  ``BATCH_SIZE`` ids at a time, and rewrites each
+  batch with one ``update_many``. Batches keep every write short, and
+  since fixed documents no longer match the selector a job can stop and
+  restart anywhere.
+* While it runs, the job is recorded in the ``denormalization_jobs``
+  collection (its checkpoint: source, id, values and progress). A job
+  that did not finish, because the process died or the write failed, is
+  resumed by ``resume()``, which ``verify_denormalization`` runs first.
+* Jobs run on ``propagation_queue``, a small thread pool
+  (``DENORMALIZATION_WORKERS``). Saves of the same user or workout that
+  arrive while its job is queued or running are coalesced: only the
+  latest values are propagated.
+* The team summaries (``team_summaries.py``) of every team whose
+  activities changed are rebuilt, since their ``recent`` lists and
+  workout names are copies too.
+
+An activity's ``team_id`` is not a copy: it is the team the user was on
+when the activity was logged, and stays so when the user changes team.
+Team leaderboard totals, rollups and summaries all credit that team, and
+so does the ranking engine when the activity is later updated or
+deleted.
+
+``verify()`` scans for drift that slipped through (writes made with a
+lookup another worker still had cached, raw imports): the source ids are
+split into chunks that are checked in parallel, each with one
+``$group`` over the activities of that chunk in both tiers, and stale entities are
+repaired with the same propagation.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import team_summaries
+from .mongo import get_db
+from .tiering import COLD, HOT, both_tiers
+from .versions import bump
+
+logger = logging.getLogger(__name__)
+
+JOBS = 'denormalization_jobs'
+BATCH_SIZE = 1000
+CHUNK_SIZE = 500
+
+# {source collection: (activity reference field, {activity field: source field})}
+COPIES = OrderedDict([
+    ('users', ('user_id', OrderedDict([('user_name', 'name'), ('user_alias', 'alias')]))),
+    ('workouts', ('workout_id', OrderedDict([('workout_name', 'name'), ('workout_icon', 'icon'),
+                                             ('unit', 'unit')]))),
+])
+
+
+def copied_values(source, document):
+    """``{activity field: value}`` for a source model instance or raw document."""
+    _reference, copies = COPIES[source]
+    if isinstance(document, dict):
+        return {copy: document.get(field) for copy, field in copies.items()}
+    return {copy: getattr(document, field) for copy, field in copies.items()}
+
+
+def _stale(source, source_id, values):
+    reference, _copies = COPIES[source]
+    return {reference: source_id, '$or': [{copy: {'$ne': value}} for copy, value in values.items()]}
+
+
+def propagate(source, source_id, values, db=None, batch_size=BATCH_SIZE):
+    """
+    Rewrite the copies of ``source_id``'s fields in its activities to
+    ``values``. Returns the number of activities updated.
+    """
+    db = db if db is not None else get_db()
+    job_id = f'{source}:{source_id}'
+    now = timezone.now()
+    db[JOBS].update_one({'_id': job_id}, {
+        '$set': {'source': source, 'source_id': source_id, 'values': values, 'updated_at': now},
+        '$setOnInsert': {'started_at': now, 'updated': 0},
+    }, upsert=True)
+    stale = _stale(source, source_id, values)
+    updated = 0
+    teams = set()
+    for collection in (HOT, COLD):
+        while True:
+            batch = list(db[collection].find(stale, {'_id': 1, 'team_id': 1}).limit(batch_size))
+            if not batch:
+                break
+            result = db[collection].update_many(
+                dict(stale, _id={'$in': [document['_id'] for document in batch]}), {'$set': values})
+            updated += result.modified_count
+            teams.update(document.get('team_id') for document in batch)
+            db[JOBS].update_one({'_id': job_id}, {'$inc': {'updated': result.modified_count},
+                                                  '$set': {'updated_at': timezone.now()}})
+            bump(collection)
+    if updated:
+        team_summaries.rebuild(db, teams=teams)
+    db[JOBS].delete_one({'_id': job_id})
+    return updated
+
+
+def resume(db=None):
+    """Finish the jobs left unfinished by a previous run. Returns ``[(job id, updated), ...]``."""
+    db = db if db is not None else get_db()
+    finished = []
+    for job in list(db[JOBS].find()):
+        finished.append((job['_id'], propagate(job['source'], job['source_id'], job['values'], db)))
+    return finished
+
+
+class PropagationQueue:
+    """
+    Run propagation jobs on a bounded thread pool, coalescing jobs for the
+    same user or workout.
+    """
+
+    def __init__(self, workers=None):
+        self._workers = workers
+        self._executor = None
+        self._pending = OrderedDict()
+        self._running = set()
+        self._idle = threading.Condition()
+
+    def _get_executor(self):
+        if self._executor is None:
+            workers = self._workers or getattr(settings, 'DENORMALIZATION_WORKERS', 2)
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='denormalization')
+        return self._executor
+
+    def submit(self, source, source_id, values, db=None):
+        """Queue propagation of ``values``; replaces values still waiting for the same entity."""
+        key = (source, source_id)
+        with self._idle:
+            self._pending[key] = (values, db)
+            if key in self._running:
+                return
+            self._running.add(key)
+            self._get_executor().submit(self._drain, key)
+
+    def _drain(self, key):
+        while True:
+            with self._idle:
+                item = self._pending.pop(key, None)
+                if item is None:
+                    self._running.discard(key)
+                    self._idle.notify_all()
+                    return
+            values, db = item
+            try:
+                propagate(key[0], key[1], values, db)
+            except Exception:
+                # The checkpoint stays behind for resume().
+                logger.exception('Propagating %s %s failed', *key)
+
+    def join(self, timeout=None):
+        """Wait until no job is queued or running. Returns ``False`` on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._running, timeout)
+
+
+propagation_queue = PropagationQueue()
+
+
+def _scan_chunk(db, source, expected, repair):
+    reference, copies = COPIES[source]
+    group = {'source_id': f'${reference}'}
+    group.update((copy, f'${copy}') for copy in copies)
+    drift = OrderedDict()
+    rows = db.activities.aggregate(both_tiers({reference: {'$in': list(expected)}}) + [
+        {'$group': {'_id': group, 'count': {'$sum': 1}}},
+    ], allowDiskUse=True)
+    for row in rows:
+        source_id = row['_id']['source_id']
+        if any(row['_id'].get(copy) != value for copy, value in expected[source_id].items()):
+            drift[source_id] = drift.get(source_id, 0) + row['count']
+    report = []
+    for source_id, stale in drift.items():
+        repaired = propagate(source, source_id, expected[source_id], db) if repair else 0
+        report.append({'source': source, 'source_id': source_id, 'stale': stale, 'repaired': repaired})
+    return report
+
+
+def verify(db=None, workers=4, chunk_size=CHUNK_SIZE, repair=True, progress=None):
+    """
+    Find activities whose copies differ from their user or workout, and
+    repair them unless ``repair`` is false. Returns one
+    ``{source, source_id, stale, repaired}`` dict per drifted entity.
+    """
+    db = db if db is not None else get_db()
+    report = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for source, (_reference, copies) in COPIES.items():
+            fields = {field: 1 for field in copies.values()}
+            expected = OrderedDict((document['_id'], copied_values(source, document))
+                                   for document in db[source].find({}, fields))
+            ids = list(expected)
+            chunks = [ids[start:start + chunk_size] for start in range(0, len(ids), chunk_size)]
+            futures = [pool.submit(_scan_chunk, db, source, {source_id: expected[source_id] for source_id in chunk},
+                                   repair) for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                found = future.result()
+                report.extend(found)
+                if progress:
+                    progress(source, len(chunk), found)
+    return report
@@ -0,0 +1,130 @@
+"""
+Compiled, read-only serialization for flat list responses.
+
+``ModelSerializer`` builds a model instance per row and then dispatches
+through ``get_attribute``/``to_representation`` for every field. For the
+flat OctoFit documents that is almost all of a list request's CPU time.
+``compile_serializer()`` instead turns a serializer class into one
+generated function that maps a ``values()`` row straight to the output
+dict, applying a precomputed converter per field (``str``/``int``, or an
+inlined ISO 8601 formatter for datetimes) with the same ``None`` handling
+and field order as the serializer, so responses stay byte-identical.
+
+Serializers with anything that is not a plain concrete model field
+(method fields, nested serializers, dotted or ``*`` sources) are not
+compiled; ``compile_serializer()`` returns ``None`` and callers fall back
+to the serializer.
+"""
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import fields as drf_fields
+from rest_framework.settings import api_settings
+
+from .instrumentation import timer
+
+_compiled = {}
+
+
+def _iso_utc(value):
+    """``DateTimeField.to_representation`` for ISO 8601 output in UTC."""
+    if isinstance(value, str):
+        return value
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    else:
+        value = value.astimezone(dt_timezone.utc)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _converter(field):
+    """A fast converter equivalent to ``field.to_representation``."""
+    if isinstance(field, drf_fields.CharField):
+        return str
+    if isinstance(field, drf_fields.IntegerField):
+        return int
+    if type(field) is drf_fields.DateTimeField:
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if (output_format and output_format.lower() == drf_fields.ISO_8601 and not hasattr(field, 'timezone')
+                and settings.USE_TZ and settings.TIME_ZONE == 'UTC'):
+            return _iso_utc
+    return field.to_representation
+
+
+class CompiledSerializer:
+    """
+    ``values()`` row -> output dict, for one serializer class.
+
+    ``fields`` are the names to pass to ``QuerySet.values()``. Documents
+    read with pymongo/motor are converted with ``convert_document()``.
+    """
+
+    def __init__(self, serializer_class):
+        serializer = serializer_class()
+        model = serializer.Meta.model
+        namespace = {}
+        items = []
+        self.fields = []
+        for index, field in enumerate(serializer._readable_fields):
+            source = field.source
+            try:
+                model_field = model._meta.get_field(source)
+            except FieldDoesNotExist:
+                raise ValueError(f'{serializer_class.__name__}.{field.field_name} is not a model field')
+            if not model_field.concrete or model_field.is_relation:
+                raise ValueError(f'{serializer_class.__name__}.{field.field_name} is not a plain column')
+            convert = _converter(field)
+            namespace[f'_c{index}'] = convert
+            self.fields.append(model_field.attname)
+            items.append((field.field_name, model_field.column, index))
+        # ``convert`` reads values() rows (keyed by attname), ``convert_document``
+        # raw MongoDB documents (keyed by column, where fields may be missing).
+        source = ''
+        for name, lookup, keys in (('convert', 'row[{!r}]', self.fields),
+                                   ('convert_document', 'row.get({!r})', [column for _, column, _ in items])):
+            entries = [f'{field_name!r}: (None if (_v{index} := {lookup.format(key)}) is None '
+                       f'else _c{index}(_v{index}))'
+                       for (field_name, _, index), key in zip(items, keys)]
+            source += f'def {name}(row):\n    return {{' + ', '.join(entries) + '}\n'
+        exec(compile(source, f'<compiled {serializer_class.__name__}>', 'exec'), namespace)
+        self.convert = namespace['convert']
+        self.convert_document = namespace['convert_document']
+        self.serializer_class = serializer_class
+
+    def __call__(self, row):
+        with timer('serialize'):
+            return self.convert(row)
+
+    def many(self, rows):
+        convert = self.convert
+        with timer('serialize'):
+            return [convert(row) for row in rows]
+
+    def many_documents(self, documents):
+        convert = self.convert_document
+        with timer('serialize'):
+            return [convert(document) for document in documents]
+
+    def rows(self, queryset, *extra):
+        """``queryset`` as ``values()`` rows with the serialized fields plus ``extra``."""
+        names = list(self.fields)
+        names += [name for name in extra if name not in names]
+        return queryset.values(*names)
+
+
+def compile_serializer(serializer_class):
+    """The (cached) ``CompiledSerializer`` for ``serializer_class``, or ``None``."""
+    try:
+        return _compiled[serializer_class]
+    except KeyError:
+        pass
+    try:
+        compiled = CompiledSerializer(serializer_class)
+    except (ValueError, AttributeError):
+        compiled = None
+    _compiled[serializer_class] = compiled
+    return compiled
@@ -0,0 +1,167 @@
+"""
+Secondary index planning derived from the ViewSet declarations.
+
+Every ``filterset_fields`` entry becomes a compound index led by the filter
+field and followed by the ViewSet's default ordering, so a filtered list is
+an index range scan that is already sorted. Every ``ordering_fields`` entry
+gets its own index for unfiltered sorted lists. The primary key is appended
+to both so keyset pagination (``pagination.KeysetPagination``) can seek on
+the cursor. ViewSets can declare ``extra_indexes`` for query shapes used
+outside the filter backends (e.g. by the leaderboard engine).
+"""
+from collections import OrderedDict
+
+from pymongo import ASCENDING, DESCENDING
+
+
+def _column(model, name):
+    return model._meta.get_field(name).column
+
+
+def _ordering_keys(model, ordering):
+    keys = []
+    for field in ordering or ():
+        direction = DESCENDING if field.startswith('-') else ASCENDING
+        keys.append((_column(model, field.lstrip('-')), direction))
+    return keys
+
+
+def _with_pk(model, keys):
+    pk = model._meta.pk.column
+    if all(field != pk for field, _ in keys):
+        keys = keys + [(pk, ASCENDING)]
+    return keys
+
+
+def index_name(keys):
+    """The name MongoDB gives an index by default, e.g. ``type_1_rank_1``."""
+    return '_'.join(f'{field}_{direction}' for field, direction in keys)
+
+
+def plan_for_viewset(viewset):
+    """Return the ordered list of index key specs wanted by one ViewSet."""
+    model = viewset.queryset.model
+    default = _ordering_keys(model, getattr(viewset, 'ordering', None))
+    default_fields = {field for field, _ in default}
+    plans = []
+    for name in getattr(viewset, 'filterset_fields', None) or ():
+        column = _column(model, name)
+        tail = [key for key in default if key[0] != column]
+        plans.append(_with_pk(model, [(column, ASCENDING)] + tail))
+    for name in getattr(viewset, 'ordering_fields', None) or ():
+        column = _column(model, name)
+        if column in default_fields:
+            keys = [key for key in default if key[0] == column]
+        else:
+            keys = [(column, ASCENDING)]
+        plans.append(_with_pk(model, keys))
+    for keys in getattr(viewset, 'extra_indexes', None) or ():
+        plans.append(list(keys))
+    return plans
+
+
+def _is_prefix(shorter, longer):
+    return len(shorter) < len(longer) and longer[:len(shorter)] == shorter
+
+
+def plan_indexes(registry):
+    """
+    Build ``{collection: [keys, ...]}`` from a router's ``registry``.
+
+    Duplicates, and indexes that are a strict prefix of another planned
+    index on the same collection, are dropped.
+    """
+    plans = OrderedDict()
+    for _prefix, viewset, _basename in registry:
+        collection = viewset.queryset.model._meta.db_table
+        plans.setdefault(collection, [])
+        for keys in plan_for_viewset(viewset):
+            if keys not in plans[collection]:
+                plans[collection].append(keys)
+    for collection, wanted in plans.items():
+        plans[collection] = [keys for keys in wanted
+                             if not any(_is_prefix(keys, other) for other in wanted)]
+    return plans
+
+
+def existing_indexes(collection):
+    """``{name: keys}`` of the indexes currently on ``collection``."""
+    return {name: [tuple(key) for key in info['key']]
+            for name, info in collection.index_information().items()}
+
+
+def ensure_indexes(db, plans, dry_run=False):
+    """
+    Create every planned index that does not exist yet.
+
+    Returns ``(created, existing)`` lists of ``(collection, name)``. An index
+    counts as existing when one with the same key pattern is present under
+    any name, so re-running is a no-op.
+    """
+    created, existing = [], []
+    for collection, wanted in plans.items():
+        present = existing_indexes(db[collection]).values()
+        for keys in wanted:
+            name = index_name(keys)
+            if [tuple(key) for key in keys] in present:
+                existing.append((collection, name))
+                continue
+            if not dry_run:
+                db[collection].create_index(keys, name=name, background=True)
+            created.append((collection, name))
+    return created, existing
+
+
+def missing_indexes(db, plans):
+    """Planned indexes not present on the server, as ``(collection, name)``."""
+    return ensure_indexes(db, plans, dry_run=True)[0]
+
+
+def unused_indexes(db, collections):
+    """
+    Indexes with no recorded accesses since the server started, from
+    ``$indexStats``. The mandatory ``_id_`` index is never reported.
+    """
+    unused = []
+    for collection in collections:
+        for stats in db[collection].aggregate([{'$indexStats': {}}]):
+            if stats['name'] != '_id_' and not stats.get('accesses', {}).get('ops'):
+                unused.append((collection, stats['name']))
+    return unused
+
+
+def _winning_stages(plan):
+    stages = []
+    while plan:
+        stages.append(plan.get('stage'))
+        inputs = plan.get('inputStages') or []
+        plan = plan.get('inputStage') or (inputs[0] if inputs else None)
+    return stages
+
+
+def explain_filters(db, registry):
+    """
+    Explain the query each ViewSet filter field produces and report the
+    winning plan's stages, e.g. ``['FETCH', 'IXSCAN']`` or ``['SORT', 'COLLSCAN']``.
+
+    A real value for the filter is sampled from the collection so the
+    planner sees a realistic predicate.
+    """
+    results = []
+    for _prefix, viewset, _basename in registry:
+        model = viewset.queryset.model
+        collection = model._meta.db_table
+        sort = OrderedDict(_with_pk(model, _ordering_keys(model, getattr(viewset, 'ordering', None))))
+        for name in getattr(viewset, 'filterset_fields', None) or ():
+            column = _column(model, name)
+            sample = db[collection].find_one({column: {'$exists': True}}, {column: 1})
+            if sample is None:
+                continue
+            explained = db.command('explain', {
+                'find': collection,
+                'filter': {column: sample[column]},
+                'sort': sort,
+            }, verbosity='queryPlanner')
+            stages = _winning_stages(explained['queryPlanner']['winningPlan'])
+            results.append((collection, column, stages))
+    return results
@@ -0,0 +1,125 @@
+"""
+Bulk activity ingestion for wearable sync uploads.
+
+A batch is validated item by item, the referenced users and workouts are
+fetched with one ``$in`` query each, the denormalized fields and points are
+filled in on the server, and the documents are written with unordered
+``insert_many`` calls. The new activities are published to the push
+channel (``push.py``), user and team totals are then applied once per
+distinct user/team through the leaderboard engine, and the time-bucketed
+rollups (``rollups.py``) and team summaries (``team_summaries.py``) are
+incremented.
+"""
+from pymongo.errors import BulkWriteError
+from rest_framework.exceptions import ValidationError
+
+from . import push, rollups, team_summaries
+from .fast_serializers import compile_serializer
+from .mongo import get_db
+from .ranking import leaderboard_engine
+from .serializers import ActivityBulkSerializer, ActivitySerializer, new_activity_id
+from .versions import bump
+
+BULK_MAX_ITEMS = 5000
+BULK_CHUNK_SIZE = 1000
+
+DUPLICATE_KEY = 11000
+
+
+def _by_id(collection, ids, fields):
+    if not ids:
+        return {}
+    return {doc['_id']: doc for doc in collection.find({'_id': {'$in': list(ids)}}, fields)}
+
+
+def build_documents(items):
+    """
+    Validate ``items`` and resolve them into activity documents.
+
+    Returns ``(documents, errors)`` where ``documents`` is a list of
+    ``(index, document)`` and ``errors`` a list of
+    ``{'index': ..., 'errors': ...}`` for the items that were rejected.
+    """
+    child = ActivityBulkSerializer(many=True).child
+    valid, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, child.run_validation(item)))
+        except ValidationError as exc:
+            errors.append({'index': index, 'errors': exc.detail})
+
+    db = get_db()
+    users = _by_id(db.users, {data['user_id'] for _, data in valid},
+                   {'name': 1, 'alias': 1, 'team_id': 1})
+    workouts = _by_id(db.workouts, {data['workout_id'] for _, data in valid},
+                      {'name': 1, 'icon': 1, 'unit': 1, 'points_per_unit': 1})
+
+    documents = []
+    for index, data in valid:
+        user = users.get(data['user_id'])
+        workout = workouts.get(data['workout_id'])
+        problems = {}
+        if user is None:
+            problems['user_id'] = ['Unknown user.']
+        if workout is None:
+            problems['workout_id'] = ['Unknown workout.']
+        if problems:
+            errors.append({'index': index, 'errors': problems})
+            continue
+        documents.append((index, {
+            '_id': data.get('_id') or new_activity_id(),
+            'user_id': user['_id'],
+            'user_name': user['name'],
+            'user_alias': user['alias'],
+            'workout_id': workout['_id'],
+            'workout_name': workout['name'],
+            'workout_icon': workout['icon'],
+            'description': data['description'],
+            'quantity': data['quantity'],
+            'unit': workout['unit'],
+            'points_earned': data['quantity'] * workout['points_per_unit'],
+            'completed_at': data['completed_at'],
+            'team_id': user['team_id'],
+        }))
+    return documents, errors
+
+
+def insert_documents(documents, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Insert ``(index, document)`` pairs with unordered ``insert_many``.
+
+    Returns ``(inserted, errors)``; a duplicate ``_id`` only rejects that
+    item, never the rest of its chunk.
+    """
+    db = get_db()
+    inserted, errors = [], []
+    for start in range(0, len(documents), chunk_size):
+        chunk = documents[start:start + chunk_size]
+        try:
+            db.activities.insert_many([document for _, document in chunk], ordered=False)
+        except BulkWriteError as exc:
+            failed = set()
+            for error in exc.details.get('writeErrors', []):
+                failed.add(error['index'])
+                message = ('An activity with this _id already exists.'
+                           if error.get('code') == DUPLICATE_KEY else error.get('errmsg'))
+                errors.append({'index': chunk[error['index']][0], 'errors': {'_id': [message]}})
+            inserted.extend(pair for position, pair in enumerate(chunk) if position not in failed)
+        else:
+            inserted.extend(chunk)
+    return inserted, errors
+
+
+def ingest_activities(items):
+    """Validate, resolve and store a batch. Returns ``(inserted_ids, errors)``."""
+    documents, errors = build_documents(items)
+    inserted, write_errors = insert_documents(documents)
+    if inserted:
+        bump('activities')
+        convert = compile_serializer(ActivitySerializer).convert_document
+        push.publish_many(push.activity_messages('created', (convert(document) for _, document in inserted)))
+        leaderboard_engine.activities_bulk_created([document for _, document in inserted])
+        rollups.apply(document for _, document in inserted)
+        team_summaries.apply(added=[document for _, document in inserted])
+    errors = sorted(errors + write_errors, key=lambda error: error['index'])
+    return [document['_id'] for _, document in inserted], errors
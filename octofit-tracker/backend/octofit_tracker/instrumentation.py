@@ -0,0 +1,454 @@
+"""
+Per-request timing and query instrumentation.
+
+``InstrumentationMiddleware`` measures, for every request:
+
+* ``db``: ORM queries on every database alias (including the replica,
+  ``replicas.py``), timed around Django's cursor (djongo's SQL
+  translation plus the MongoDB round trips it issues);
+* ``mongo``: every MongoDB command, via ``command_timer``, a pymongo
+  command listener that every client of ``mongo.py`` and
+  ``async_mongo.py`` is created with, so the raw ``get_db()`` code paths
+  and the replica alias are covered too;
+* ``serialize`` and ``render``: time spent in serializers
+  (``TimedSerializerMixin``) and renderers (``renderers.py``);
+* ``total``: the whole request.
+
+They are returned in a ``Server-Timing`` header, logged as one JSON line
+for a sampled fraction of requests (and for every slow request, with its
+query list), and aggregated per view for ``/api/_metrics`` in the
+Prometheus text format. Aggregates are per process. ``/api/_metrics`` is
+only served to staff users and to the addresses in
+``INSTRUMENTATION_METRICS_IPS`` (the scraper).
+
+``pool_metrics`` listens to the connection pools of the Mongo clients
+(``mongo.py``) and adds their state to ``/api/_metrics``: connections open
+and checked out, checkouts, failed checkouts by reason, and how long
+checkouts waited for a connection.
+"""
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from pymongo import monitoring
+
+logger = logging.getLogger('octofit_tracker.requests')
+
+_current = ContextVar('octofit_request_metrics', default=None)
+_command_counters = ContextVar('octofit_command_counters', default=())
+
+# Upper bounds, in seconds, of the request duration histogram buckets.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('db', 'mongo', 'serialize', 'render')
+# Upper bounds, in seconds, of the connection pool checkout wait histogram.
+WAIT_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+MAX_CAPTURED_OPERATIONS = 200
+
+
+class RequestMetrics:
+    """Timings (ms) and operation counts of one request."""
+
+    def __init__(self, capture=False):
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.active = set()
+        self.operations = [] if capture else None
+        self.pending = {}
+
+    def add(self, phase, duration_ms, detail=None):
+        self.durations[phase] += duration_ms
+        self.counts[phase] += 1
+        if self.operations is not None and detail is not None \
+                and len(self.operations) < MAX_CAPTURED_OPERATIONS:
+            self.operations.append({'phase': phase, 'ms': round(duration_ms, 3), 'detail': detail})
+
+
+def current():
+    """The ``RequestMetrics`` of the request being handled, or ``None``."""
+    return _current.get()
+
+
+class timer:
+    """
+    Context manager adding the time spent inside it to ``phase``.
+
+    Nested timers of the same phase (e.g. a list serializer calling its
+    child per item) only count the outermost one.
+    """
+    __slots__ = ('phase', 'metrics', 'start')
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        metrics = _current.get()
+        if metrics is None or self.phase in metrics.active:
+            self.metrics = None
+        else:
+            self.metrics = metrics
+            metrics.active.add(self.phase)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.metrics is not None:
+            self.metrics.active.discard(self.phase)
+            self.metrics.add(self.phase, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+class TimedSerializerMixin:
+    """Counts ``to_representation`` towards the ``serialize`` phase."""
+
+    def to_representation(self, instance):
+        with timer('serialize'):
+            return super().to_representation(instance)
+
+
+class TimedRendererMixin:
+    """Counts ``render`` towards the ``render`` phase."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timer('render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class count_commands:
+    """
+    Context manager counting the MongoDB commands ``command_timer`` sees
+    inside it (``count``), from every client and alias, including those of
+    requests handled inside it (``benchmark.py``).
+    """
+    __slots__ = ('count', 'token')
+
+    def __enter__(self):
+        self.count = 0
+        self.token = _command_counters.set(_command_counters.get() + (self,))
+        return self
+
+    def __exit__(self, *exc_info):
+        _command_counters.reset(self.token)
+        return False
+
+
+class CommandTimer(monitoring.CommandListener):
+    """pymongo listener adding each command's duration to the current request."""
+
+    def started(self, event):
+        for counter in _command_counters.get():
+            counter.count += 1
+        metrics = _current.get()
+        if metrics is not None and metrics.operations is not None:
+            metrics.pending[event.request_id] = f'{event.command_name} {event.command.get(event.command_name)}'
+
+    def _finished(self, event):
+        metrics = _current.get()
+        if metrics is not None:
+            detail = None
+            if metrics.operations is not None:
+                detail = metrics.pending.pop(event.request_id, event.command_name)
+            metrics.add('mongo', event.duration_micros / 1000, detail)
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+
+command_timer = CommandTimer()
+
+
+class MetricsRegistry:
+    """Thread-safe per-view aggregates, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._requests = defaultdict(int)
+            self._buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+            self._duration = defaultdict(float)
+            self._count = defaultdict(int)
+            self._phase_seconds = defaultdict(float)
+            self._phase_ops = defaultdict(int)
+
+    def observe(self, view, method, status, total_ms, metrics):
+        seconds = total_ms / 1000
+        with self._lock:
+            self._requests[(view, method, str(status))] += 1
+            buckets = self._buckets[view]
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+            self._duration[view] += seconds
+            self._count[view] += 1
+            for phase in PHASES:
+                if metrics.counts.get(phase):
+                    self._phase_seconds[(view, phase)] += metrics.durations[phase] / 1000
+                    self._phase_ops[(view, phase)] += metrics.counts[phase]
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += [
+                '# HELP octofit_requests_total HTTP requests handled.',
+                '# TYPE octofit_requests_total counter',
+            ]
+            for (view, method, status), value in sorted(self._requests.items()):
+                lines.append(f'octofit_requests_total{{view="{view}",method="{method}",status="{status}"}} {value}')
+            lines += [
+                '# HELP octofit_request_duration_seconds Request duration.',
+                '# TYPE octofit_request_duration_seconds histogram',
+            ]
+            for view in sorted(self._count):
+                for bound, value in zip(DURATION_BUCKETS, self._buckets[view]):
+                    lines.append(f'octofit_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {value}')
+                lines.append(f'octofit_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {self._count[view]}')
+                lines.append(f'octofit_request_duration_seconds_sum{{view="{view}"}} {self._duration[view]:.6f}')
+                lines.append(f'octofit_request_duration_seconds_count{{view="{view}"}} {self._count[view]}')
+            lines += [
+                '# HELP octofit_phase_seconds_total Time spent per phase (db, mongo, serialize, render).',
+                '# TYPE octofit_phase_seconds_total counter',
+            ]
+            for (view, phase), value in sorted(self._phase_seconds.items()):
+                lines.append(f'octofit_phase_seconds_total{{view="{view}",phase="{phase}"}} {value:.6f}')
+            lines += [
+                '# HELP octofit_phase_operations_total Queries, commands or calls per phase.',
+                '# TYPE octofit_phase_operations_total counter',
+            ]
+            for (view, phase), value in sorted(self._phase_ops.items()):
+                lines.append(f'octofit_phase_operations_total{{view="{view}",phase="{phase}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool gauges and checkout wait times, per server address."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = threading.local()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._open = defaultdict(int)
+            self._checked_out = defaultdict(int)
+            self._checkouts = defaultdict(int)
+            self._failed = defaultdict(int)
+            self._cleared = defaultdict(int)
+            self._wait_buckets = defaultdict(lambda: [0] * len(WAIT_BUCKETS))
+            self._wait_seconds = defaultdict(float)
+
+    @staticmethod
+    def _address(event):
+        host, port = event.address
+        return f'{host}:{port}'
+
+    def _waited(self, event):
+        started = getattr(self._started, 'value', None)
+        self._started.value = None
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def connection_check_out_started(self, event):
+        # Checkouts happen on the requesting thread, between these two events.
+        self._started.value = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = self._waited(event)
+        address = self._address(event)
+        with self._lock:
+            self._checked_out[address] += 1
+            self._checkouts[address] += 1
+            self._wait_seconds[address] += waited
+            buckets = self._wait_buckets[address]
+            for index, bound in enumerate(WAIT_BUCKETS):
+                if waited <= bound:
+                    buckets[index] += 1
+
+    def connection_check_out_failed(self, event):
+        self._waited(event)
+        with self._lock:
+            self._failed[(self._address(event), str(event.reason))] += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._checked_out[self._address(event)] -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self._open[self._address(event)] += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._open[self._address(event)] -= 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._cleared[self._address(event)] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, kind, help_text, values in (
+                    ('octofit_mongo_pool_connections', 'gauge', 'Open pooled connections.', self._open),
+                    ('octofit_mongo_pool_checked_out', 'gauge', 'Connections checked out.', self._checked_out),
+                    ('octofit_mongo_pool_checkouts_total', 'counter', 'Successful checkouts.', self._checkouts),
+                    ('octofit_mongo_pool_cleared_total', 'counter', 'Pool clears (server errors).', self._cleared)):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                for address, value in sorted(values.items()):
+                    lines.append(f'{name}{{address="{address}"}} {value}')
+            lines += [
+                '# HELP octofit_mongo_pool_checkout_failures_total Failed checkouts, by reason.',
+                '# TYPE octofit_mongo_pool_checkout_failures_total counter',
+            ]
+            for (address, reason), value in sorted(self._failed.items()):
+                lines.append(
+                    f'octofit_mongo_pool_checkout_failures_total{{address="{address}",reason="{reason}"}} {value}')
+            lines += [
+                '# HELP octofit_mongo_pool_wait_seconds Time a checkout waited for a connection.',
+                '# TYPE octofit_mongo_pool_wait_seconds histogram',
+            ]
+            for address in sorted(self._checkouts):
+                for bound, value in zip(WAIT_BUCKETS, self._wait_buckets[address]):
+                    lines.append(f'octofit_mongo_pool_wait_seconds_bucket{{address="{address}",le="{bound}"}} {value}')
+                count = self._checkouts[address]
+                lines.append(f'octofit_mongo_pool_wait_seconds_bucket{{address="{address}",le="+Inf"}} {count}')
+                lines.append(f'octofit_mongo_pool_wait_seconds_sum{{address="{address}"}} '
+                             f'{self._wait_seconds[address]:.6f}')
+                lines.append(f'octofit_mongo_pool_wait_seconds_count{{address="{address}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+pool_metrics = PoolMetrics()
+
+
+def metrics_view(request):
+    """Aggregated request and connection pool metrics of this process, in Prometheus text format."""
+    user = getattr(request, 'user', None)
+    if not (user is not None and user.is_staff
+            or request.META.get('REMOTE_ADDR') in getattr(settings, 'INSTRUMENTATION_METRICS_IPS', ())):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render() + pool_metrics.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def server_timing(metrics, total_ms):
+    parts = []
+    descriptions = {'db': 'queries', 'mongo': 'commands'}
+    for phase in PHASES:
+        if metrics.counts.get(phase):
+            part = f'{phase};dur={metrics.durations[phase]:.1f}'
+            if phase in descriptions:
+                part += f';desc="{metrics.counts[phase]} {descriptions[phase]}"'
+            parts.append(part)
+    parts.append(f'total;dur={total_ms:.1f}')
+    return ', '.join(parts)
+
+
+class InstrumentationMiddleware:
+    """
+    See the module docstring; configured by the ``INSTRUMENTATION_*`` settings.
+
+    Works in both sync and async mode, so async views (``async_views.py``)
+    are not pushed onto a thread by this middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'INSTRUMENTATION_SERVER_TIMING', True)
+        self.sample_rate = getattr(settings, 'INSTRUMENTATION_LOG_SAMPLE_RATE', 0.0)
+        self.slow_ms = getattr(settings, 'INSTRUMENTATION_SLOW_REQUEST_MS', None)
+        if asyncio.iscoroutinefunction(get_response):
+            # Same switch as django.utils.deprecation.MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def _wrap_queries(self):
+        stack = ExitStack()
+        for alias in settings.DATABASES:
+            stack.enter_context(connections[alias].execute_wrapper(self._time_query))
+        return stack
+
+    def _time_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            metrics = _current.get()
+            if metrics is not None:
+                metrics.add('db', (time.perf_counter() - start) * 1000, sql)
+
+    def __call__(self, request):
+        if getattr(self, '_is_coroutine', None):
+            return self.__acall__(request)
+        metrics = RequestMetrics(capture=self.slow_ms is not None)
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with self._wrap_queries():
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, metrics, (time.perf_counter() - start) * 1000)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics(capture=self.slow_ms is not None)
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with self._wrap_queries():
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, metrics, (time.perf_counter() - start) * 1000)
+
+    def _finish(self, request, response, metrics, total_ms):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        registry.observe(view, request.method, response.status_code, total_ms, metrics)
+        if self.server_timing:
+            response['Server-Timing'] = server_timing(metrics, total_ms)
+
+        slow = self.slow_ms is not None and total_ms >= self.slow_ms
+        if slow or (self.sample_rate and random.random() < self.sample_rate):
+            record = {
+                'method': request.method,
+                'path': request.get_full_path(),
+                'view': view,
+                'status': response.status_code,
+                'total_ms': round(total_ms, 3),
+            }
+            for phase in PHASES:
+                record[f'{phase}_ms'] = round(metrics.durations.get(phase, 0.0), 3)
+                record[f'{phase}_count'] = metrics.counts.get(phase, 0)
+            if slow:
+                record['operations'] = metrics.operations
+                logger.warning(json.dumps(record, default=str))
+            else:
+                logger.info(json.dumps(record, default=str))
+        return response
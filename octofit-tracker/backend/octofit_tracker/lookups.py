@@ -0,0 +1,108 @@
+"""
+In-process, TTL-bounded lookups of the rows Activity writes denormalize.
+
+The whole ``workouts`` table is small and rarely written, so it is cached
+as one dict; users are cached individually in a bounded LRU. A workout id
+missing from the table reloads it once (the workout may be new), and is
+then remembered as unknown for ``MISSING_TTL`` seconds so repeated bad ids
+do not reload the table on every request. Local writes evict entries
+through model signals (``signals.py``); the TTLs bound how long another
+worker's write can go unnoticed.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from .models import User, Workout
+
+WORKOUT_TTL = 300
+USER_TTL = 30
+USER_MAX_ENTRIES = 10000
+MISSING_TTL = 5
+MISSING_MAX_ENTRIES = 1000
+
+WORKOUT_FIELDS = ('_id', 'name', 'icon', 'unit', 'points_per_unit')
+USER_FIELDS = ('_id', 'name', 'alias', 'team_id')
+
+
+class TTLCache:
+    """A thread-safe LRU mapping whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_workouts = TTLCache(WORKOUT_TTL, max_entries=1)
+_users = TTLCache(USER_TTL, USER_MAX_ENTRIES)
+_missing_workouts = TTLCache(MISSING_TTL, MISSING_MAX_ENTRIES)
+
+
+def get_workout(workout_id):
+    """The workout as a dict of ``WORKOUT_FIELDS``, or ``None``."""
+    table = _workouts.get('all')
+    if table is None or (workout_id not in table and not _missing_workouts.get(workout_id)):
+        # A miss may be a workout created by another worker since the
+        # table was cached, so reload before answering "unknown".
+        table = {row['_id']: row for row in Workout.objects.values(*WORKOUT_FIELDS)}
+        _workouts.set('all', table)
+        if workout_id not in table:
+            _missing_workouts.set(workout_id, True)
+    return table.get(workout_id)
+
+
+def get_user(user_id):
+    """The user as a dict of ``USER_FIELDS``, or ``None``."""
+    user = _users.get(user_id)
+    if user is None:
+        user = User.objects.filter(pk=user_id).values(*USER_FIELDS).first()
+        if user is not None:
+            _users.set(user_id, user)
+    return user
+
+
+def forget_workouts():
+    _workouts.clear()
+    _missing_workouts.clear()
+
+
+def forget_user(user_id):
+    _users.delete(user_id)
+
+
+def clear():
+    _workouts.clear()
+    _missing_workouts.clear()
+    _users.clear()
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker import archive_analytics
+
+
+class Command(BaseCommand):
+    help = 'Rank users, teams or workouts by points over the archived activities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by', choices=sorted(archive_analytics.GROUP_COLUMNS), default='user')
+        parser.add_argument('--dir', help='Archive directory (default: ARCHIVE_DIR)')
+        parser.add_argument('--since', help='Only count activities completed at or after this ISO date/time')
+        parser.add_argument('--until', help='Only count activities completed before this ISO date/time')
+        parser.add_argument('--limit', type=int, default=20, help='Rows to print')
+
+    def _date(self, options, name):
+        if not options[name]:
+            return None
+        try:
+            return datetime.fromisoformat(options[name])
+        except ValueError:
+            raise CommandError(f'Invalid --{name}: {options[name]}')
+
+    def handle(self, *args, **options):
+        rows = archive_analytics.totals(
+            by=options['by'],
+            directory=options['dir'],
+            since=self._date(options, 'since'),
+            until=self._date(options, 'until'),
+        )
+        for row in rows[:options['limit']]:
+            self.stdout.write(f"{row['rank']:>4}  {row['entity_id']:<24} {row['total_points']:>10} points  "
+                              f"{row['activities_count']:>8} activities")
+        self.stdout.write(self.style.SUCCESS(f'✓ {len(rows)} {options["by"]}(s) ranked'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import rollups
+from octofit_tracker.indexes import ensure_indexes
+from octofit_tracker.mongo import get_db
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the hourly/daily/weekly activity rollups from the activities collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of time ranges processed in parallel')
+        parser.add_argument('--weeks-per-chunk', type=int, default=4,
+                            help='Width of each time range, in weeks')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Cursor batch size and rollup rows per bulk write')
+
+    def handle(self, *args, **options):
+        db = get_db()
+        created, _existing = ensure_indexes(db, rollups.index_plans())
+        for collection, name in created:
+            self.stdout.write(self.style.SUCCESS(f'✓ Created {collection}.{name}'))
+
+        def progress(since, until, count):
+            self.stdout.write(f'  {since:%Y-%m-%d} .. {until:%Y-%m-%d}: {count} activities')
+
+        total = rollups.backfill(
+            db,
+            workers=options['workers'],
+            weeks_per_chunk=options['weeks_per_chunk'],
+            batch_size=options['batch_size'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f'✓ Rolled up {total} activities'))
@@ -0,0 +1,86 @@
+import os
+import platform
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from octofit_tracker import benchmark
+from octofit_tracker.urls import router
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every GET API route in-process and compare against a JSON baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100,
+                            help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Client threads issuing requests at once')
+        parser.add_argument('--only', action='append', default=[],
+                            help='Only endpoints whose name contains this text (repeatable)')
+        parser.add_argument('--baseline', default='benchmarks/baseline.json',
+                            help='Baseline JSON file to compare against')
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='Write this run to --baseline instead of comparing')
+        parser.add_argument('--threshold', type=float, default=benchmark.DEFAULT_THRESHOLD,
+                            help='Allowed relative slowdown / memory growth (0.25 = 25%%)')
+        parser.add_argument('--output', help='Also write this run to a JSON file')
+        parser.add_argument('--populate', action='store_true',
+                            help='Replace the database contents with a synthetic data set first')
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Users to generate with --populate')
+        parser.add_argument('--teams', type=int, default=20,
+                            help='Teams to generate with --populate')
+        parser.add_argument('--activities', type=int, default=50000,
+                            help='Activities to generate with --populate')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Random seed for --populate')
+
+    def handle(self, *args, **options):
+        if options['populate']:
+            call_command('populate_db', users=options['users'], teams=options['teams'],
+                         activities=options['activities'], seed=options['seed'], stdout=self.stdout)
+
+        endpoints = benchmark.plan_endpoints(router.registry, benchmark.sample_rows(router.registry))
+        if options['only']:
+            endpoints = [endpoint for endpoint in endpoints
+                         if any(text in endpoint.name for text in options['only'])]
+        if not endpoints:
+            raise CommandError('No endpoints to benchmark')
+
+        self.stdout.write(f"{'endpoint':<44} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8} {'queries':>7} {'KiB':>8}")
+
+        def progress(name, result):
+            line = (f"{name:<44} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                    f"{result['throughput_rps']:>8.1f} {result['queries']:>7} {result['peak_kib']:>8.1f}")
+            if any(status >= 400 for status in result['status']):
+                line = self.style.ERROR(f"{line}  HTTP {result['status']}")
+            self.stdout.write(line)
+
+        results = benchmark.run(endpoints, options['requests'], options['concurrency'], progress)
+        meta = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+        }
+        if options['output']:
+            benchmark.save_baseline(options['output'], results, meta)
+
+        path = options['baseline']
+        if options['update_baseline']:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            benchmark.save_baseline(path, results, meta)
+            self.stdout.write(self.style.SUCCESS(f'✓ Baseline written to {path}'))
+            return
+        if not os.path.exists(path):
+            self.stdout.write(self.style.WARNING(f'No baseline at {path}; run with --update-baseline to create one'))
+            return
+
+        regressions = benchmark.compare(results, benchmark.load_baseline(path), options['threshold'])
+        for name, metric, before, after in regressions:
+            self.stdout.write(self.style.ERROR(f'✗ {name}: {metric} {before} -> {after}'))
+        if regressions:
+            raise CommandError(f'{len(regressions)} regression(s) against {path}')
+        self.stdout.write(self.style.SUCCESS(f'✓ No regressions against {path}'))
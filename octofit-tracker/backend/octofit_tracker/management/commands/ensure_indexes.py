@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import periods, rollups, search, tiering
+from octofit_tracker.indexes import (
+    ensure_indexes, explain_filters, index_name, plan_indexes, unused_indexes
+)
+from octofit_tracker.mongo import get_db
+from octofit_tracker.urls import router
+
+
+class Command(BaseCommand):
+    help = 'Create the secondary indexes implied by the API ViewSet filters and orderings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only print the indexes that would be created')
+        parser.add_argument('--report', action='store_true',
+                            help='Report unused indexes ($indexStats) and explain each filtered query')
+
+    def handle(self, *args, **options):
+        db = get_db()
+        plans = plan_indexes(router.registry)
+        plans.update(rollups.index_plans())
+        plans.update(periods.index_plans())
+        plans.update(tiering.index_plans(plans))
+
+        self.stdout.write('Planned indexes:')
+        for collection, wanted in plans.items():
+            for keys in wanted:
+                self.stdout.write(f'  - {collection}: {index_name(keys)}')
+
+        created, existing = ensure_indexes(db, plans, dry_run=options['dry_run'])
+        for collection, weights in search.TEXT_INDEXES.items():
+            self.stdout.write(f'  - {collection}: {search.text_index_name(weights)} (text)')
+        text_created, text_existing = search.ensure_text_indexes(db, dry_run=options['dry_run'])
+        created += text_created
+        existing += text_existing
+        verb = 'Would create' if options['dry_run'] else 'Created'
+        for collection, name in created:
+            self.stdout.write(self.style.SUCCESS(f'✓ {verb} {collection}.{name}'))
+        self.stdout.write(f'{len(existing)} index(es) already present, {len(created)} {verb.lower()}')
+
+        if options['report']:
+            self._report(db, plans)
+
+    def _report(self, db, plans):
+        self.stdout.write('\nUnused indexes (no accesses since server start):')
+        unused = unused_indexes(db, plans.keys())
+        for collection, name in unused:
+            self.stdout.write(self.style.WARNING(f'  - {collection}.{name}'))
+        if not unused:
+            self.stdout.write('  (none)')
+
+        self.stdout.write('\nQuery plans for filtered lists:')
+        for collection, field, stages in explain_filters(db, router.registry):
+            line = f'  - {collection} by {field}: {" <- ".join(stages)}'
+            if 'COLLSCAN' in stages:
+                self.stdout.write(self.style.ERROR(line + '  (collection scan)'))
+            elif 'SORT' in stages:
+                self.stdout.write(self.style.WARNING(line + '  (in-memory sort)'))
+            else:
+                self.stdout.write(line)
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker import archive
+from octofit_tracker.mongo import get_db
+
+
+class Command(BaseCommand):
+    help = 'Append the activities completed since the last export to the columnar archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Archive directory (default: ARCHIVE_DIR)')
+        parser.add_argument('--until', help='Only export activities completed before this ISO date/time')
+        parser.add_argument('--lag-minutes', type=int, default=int(archive.DEFAULT_LAG.total_seconds() // 60),
+                            help='Without --until, leave out activities completed in the last N minutes')
+        parser.add_argument('--rows-per-part', type=int, default=archive.ROWS_PER_PART,
+                            help='Maximum rows per part file')
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE,
+                            help='Cursor batch size')
+        parser.add_argument('--verify', action='store_true',
+                            help='Report the archived months that no longer match the database, and export nothing')
+        parser.add_argument('--rebuild', metavar='YYYY-MM', action='append', default=[],
+                            help='Re-export an archived month from the database (repeatable)')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self._verify(options)
+        if options['rebuild']:
+            return self._rebuild(options)
+        until = None
+        if options['until']:
+            try:
+                until = datetime.fromisoformat(options['until'])
+            except ValueError:
+                raise CommandError(f"Invalid --until: {options['until']}")
+
+        def progress(partition, rows):
+            self.stdout.write(f'  {partition}: {rows} activities')
+
+        result = archive.export(
+            get_db(),
+            directory=options['dir'],
+            until=until,
+            lag=timedelta(minutes=options['lag_minutes']),
+            rows_per_part=options['rows_per_part'],
+            batch_size=options['batch_size'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Exported {result['rows']} activities in {len(result['parts'])} part(s)"))
+
+    def _verify(self, options):
+        stale = archive.verify(get_db(), directory=options['dir'])
+        for month in stale:
+            self.stdout.write(self.style.WARNING(
+                f"  {month['partition']}: archived {month['archived'][0]} activities / {month['archived'][1]} points, "
+                f"database {month['live'][0]} / {month['live'][1]}"))
+        if stale:
+            months = ' '.join(f"--rebuild {month['partition'][len('month='):]}" for month in stale)
+            self.stdout.write(f'Re-export them with: manage.py export_activities {months}')
+        else:
+            self.stdout.write(self.style.SUCCESS('✓ The archive matches the database'))
+
+    def _rebuild(self, options):
+        for month in options['rebuild']:
+            try:
+                datetime.strptime(month, '%Y-%m')
+            except ValueError:
+                raise CommandError(f'Invalid --rebuild: {month}')
+            result = archive.rebuild(f'month={month}', get_db(), directory=options['dir'],
+                                     rows_per_part=options['rows_per_part'])
+            self.stdout.write(self.style.SUCCESS(
+                f"✓ Rebuilt {month}: {result['rows']} activities in {len(result['parts'])} part(s)"))
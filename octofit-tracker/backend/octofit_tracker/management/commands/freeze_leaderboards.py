@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import periods
+from octofit_tracker.aggregations import PERIODS
+
+
+class Command(BaseCommand):
+    help = 'Freeze the leaderboards of recently settled days, weeks and months into snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', choices=PERIODS, action='append',
+                            help='Only freeze this kind of period (repeatable; default: all)')
+        parser.add_argument('--count', type=int, default=1,
+                            help='How many settled periods of each kind to check')
+
+    def handle(self, *args, **options):
+        written = periods.freeze_closed(options['period'] or PERIODS, count=options['count'])
+        for header in written:
+            self.stdout.write(self.style.SUCCESS(
+                f"✓ Froze {header['_id']} ({header['entries']} entries)"))
+        self.stdout.write(f'{len(written)} snapshot(s) written')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import team_summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-team dashboard summaries from the activities collection'
+
+    def handle(self, *args, **options):
+        teams = team_summaries.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'✓ Rebuilt {teams} team summaries'))
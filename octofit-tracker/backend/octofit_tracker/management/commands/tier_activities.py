@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import tiering
+from octofit_tracker.indexes import ensure_indexes, plan_indexes
+from octofit_tracker.mongo import get_db
+from octofit_tracker.urls import router
+
+
+class Command(BaseCommand):
+    help = 'Move activities older than ACTIVITY_HOT_DAYS from the activities collection to the cold tier'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Keep activities completed in the last N days hot (default: ACTIVITY_HOT_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=tiering.BATCH_SIZE,
+                            help='Activities moved per batch')
+        parser.add_argument('--pause-ms', type=int, default=0,
+                            help='Pause between batches, to spread the load')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the activities that would be moved')
+
+    def handle(self, *args, **options):
+        db = get_db()
+        if options['dry_run']:
+            count = tiering.pending(db, options['days'])
+            self.stdout.write(self.style.SUCCESS(f'✓ {count} activities would be moved'))
+            return
+        if tiering.ensure_cold_collection(db):
+            self.stdout.write(self.style.SUCCESS(f'✓ Created {tiering.COLD} (compressed)'))
+        created, _existing = ensure_indexes(db, tiering.index_plans(plan_indexes(router.registry)))
+        for collection, name in created:
+            self.stdout.write(self.style.SUCCESS(f'✓ Created {collection}.{name}'))
+
+        def progress(completed_at, moved):
+            self.stdout.write(f'  up to {completed_at:%Y-%m-%d %H:%M}: {moved} activities moved')
+
+        moved = tiering.move(
+            db,
+            days=options['days'],
+            batch_size=options['batch_size'],
+            pause=options['pause_ms'] / 1000,
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f'✓ Moved {moved} activities to {tiering.COLD}'))
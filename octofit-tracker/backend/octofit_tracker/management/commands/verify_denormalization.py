@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import denormalization
+from octofit_tracker.mongo import get_db
+
+
+class Command(BaseCommand):
+    help = 'Find and repair activities whose copied user/workout fields are out of date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report drift, do not repair it or resume unfinished jobs')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of chunks scanned in parallel')
+        parser.add_argument('--chunk-size', type=int, default=denormalization.CHUNK_SIZE,
+                            help='Users or workouts checked per chunk')
+
+    def handle(self, *args, **options):
+        db = get_db()
+        repair = not options['dry_run']
+        if repair:
+            for job_id, updated in denormalization.resume(db):
+                self.stdout.write(self.style.SUCCESS(f'✓ Resumed {job_id}: {updated} activities updated'))
+
+        def progress(source, count, found):
+            for entry in found:
+                line = f"  - {entry['source']} {entry['source_id']}: {entry['stale']} stale"
+                if repair:
+                    line += f", {entry['repaired']} repaired"
+                self.stdout.write(self.style.WARNING(line))
+
+        report = denormalization.verify(
+            db,
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            repair=repair,
+            progress=progress,
+        )
+        stale = sum(entry['stale'] for entry in report)
+        verb = 'repaired' if repair else 'found'
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ {len(report)} user(s)/workout(s) with drift, {stale} stale activities {verb}'))
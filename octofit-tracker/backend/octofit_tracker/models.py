@@ -49,7 +49,7 @@ class Workout(models.Model):
         return f"{self.icon} {self.name}"
 
 
-class Activity(models.Model):
+class BaseActivity(models.Model):
     _id = models.CharField(max_length=100, primary_key=True, db_column='_id')
     user_id = models.CharField(max_length=100)
     user_name = models.CharField(max_length=200)
@@ -65,13 +65,25 @@ class Activity(models.Model):
     team_id = models.CharField(max_length=100)
 
     class Meta:
-        db_table = 'activities'
+        abstract = True
         ordering = ['-completed_at']
 
     def __str__(self):
         return f"{self.user_alias}: {self.workout_name} - {self.quantity} {self.unit}"
 
 
+class Activity(BaseActivity):
+    class Meta(BaseActivity.Meta):
+        db_table = 'activities'
+
+
+class ArchivedActivity(BaseActivity):
+    """An activity moved to the cold tier (``tiering.py``)."""
+
+    class Meta(BaseActivity.Meta):
+        db_table = 'activities_archive'
+
+
 class Leaderboard(models.Model):
     _id = models.CharField(max_length=100, primary_key=True, db_column='_id')
     type = models.CharField(max_length=50)  # 'individual' or 'team'
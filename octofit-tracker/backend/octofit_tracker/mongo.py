@@ -0,0 +1,117 @@
+"""
+The MongoDB client of the process, shared by the ORM, the raw pymongo
+code paths and the management commands.
+
+``get_client()`` builds one ``MongoClient`` per database alias from its
+``DATABASES[alias]['CLIENT']`` entry (``client_options()``): pool sizes,
+timeouts, wire compression, read preference and write concern are all
+configured there (the ``OCTOFIT_MONGO_*`` variables in settings.py). The
+database backend (``mongo_backend``) hands djongo a database of that
+client, instead of djongo opening a client per connection and closing it,
+pool and all, at the end of every request.
+
+Clients are not fork-safe. One created before a fork (gunicorn
+``--preload``, multiprocessing) is dropped in the child, which creates
+its own on first use. Pool activity is reported to
+``instrumentation.pool_metrics`` and command durations to
+``instrumentation.command_timer``.
+"""
+import importlib.util
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from pymongo import MongoClient
+
+from .instrumentation import command_timer, pool_metrics
+from .replicas import read_alias
+
+# {compressor: the module pymongo needs for it}
+COMPRESSOR_MODULES = OrderedDict([('zstd', 'zstandard'), ('snappy', 'snappy'), ('zlib', 'zlib')])
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def available_compressors(names):
+    """The wire compressors among ``names`` that can be used here, in order of preference."""
+    if isinstance(names, str):
+        names = names.split(',')
+    available = []
+    for name in (name.strip() for name in names):
+        module = COMPRESSOR_MODULES.get(name)
+        if module is not None and importlib.util.find_spec(module) is not None:
+            available.append(name)
+    return available
+
+
+def _configured(alias):
+    # Django's no-database wrapper ('__no_db__', used by the test runner and
+    # migrations) is a copy of the default connection without an entry of its own.
+    return alias if alias in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+def client_options(alias=DEFAULT_DB_ALIAS):
+    """``MongoClient`` arguments from ``DATABASES[alias]['CLIENT']``."""
+    alias = _configured(alias)
+    options = {key: value for key, value in settings.DATABASES[alias].get('CLIENT', {}).items()
+               if value is not None and key != 'name'}
+    if 'compressors' in options:
+        compressors = available_compressors(options.pop('compressors'))
+        if compressors:
+            options['compressors'] = ','.join(compressors)
+    if isinstance(options.get('w'), str) and options['w'].isdigit():
+        options['w'] = int(options['w'])
+    return options
+
+
+def get_client(alias=DEFAULT_DB_ALIAS):
+    """The ``MongoClient`` of ``alias`` for this process."""
+    alias = _configured(alias)
+    pid = os.getpid()
+    entry = _clients.get(alias)
+    if entry is None or entry[0] != pid:
+        with _lock:
+            entry = _clients.get(alias)
+            if entry is None or entry[0] != pid:
+                # document_class is what djongo expects its documents as.
+                client = MongoClient(document_class=OrderedDict, event_listeners=[pool_metrics, command_timer],
+                                     connect=False, **client_options(alias))
+                entry = _clients[alias] = (pid, client)
+    return entry[1]
+
+
+def close_clients():
+    """Close every client of this process (tests, shutdown)."""
+    with _lock:
+        for pid, client in _clients.values():
+            if pid == os.getpid():
+                client.close()
+        _clients.clear()
+
+
+def _after_fork():
+    global _lock
+    # The parent's clients (and a lock another thread may have held) are unusable here.
+    _lock = threading.Lock()
+    _clients.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def get_db():
+    """Return the pymongo database behind the djongo connection.
+
+    Used for operations djongo cannot express (atomic ``$inc`` updates,
+    range updates, aggregation pipelines) while sharing the same client
+    and test database as the ORM. Within a request served from
+    secondaries (``replicas.py``) it is the replica alias's database,
+    whose writes still go to the primary.
+    """
+    connection = connections[read_alias()]
+    connection.ensure_connection()
+    return connection.connection
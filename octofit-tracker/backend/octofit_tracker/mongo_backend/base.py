@@ -0,0 +1,36 @@
+"""
+djongo on the shared clients of ``mongo.get_client()``.
+
+djongo opens a ``MongoClient`` for each new connection and closes it
+when the connection is closed, which with ``CONN_MAX_AGE = 0`` is the
+end of every request: each request paid for new sockets and handshakes,
+and bursts of requests queued behind them. Here a connection borrows the
+client of its alias and closing it leaves the pool open.
+"""
+import os
+
+from djongo import base
+
+from octofit_tracker.mongo import get_client
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, connection_params):
+        name = connection_params.pop('name')
+        enforce_schema = connection_params.pop('enforce_schema')
+        self.client_connection = get_client(self.alias)
+        self.connection_pid = os.getpid()
+        database = self.client_connection[name]
+        self.djongo_connection = base.DjongoClient(database, enforce_schema)
+        return database
+
+    def ensure_connection(self):
+        if self.connection is not None and getattr(self, 'connection_pid', None) != os.getpid():
+            # Inherited across a fork: the parent's client must not be used here.
+            self.connection = None
+        super().ensure_connection()
+
+    def _close(self):
+        # The client (and its pool) is shared by the whole process.
+        pass
@@ -0,0 +1,248 @@
+"""
+Keyset (cursor) pagination and streaming JSON list responses.
+
+Pages are addressed by the sort key of the last row returned rather than by
+an offset, so every page is an index range scan on e.g.
+``(completed_at, _id)`` or ``(total_points, _id)`` no matter how deep the
+client has paged. The primary key is always appended as a tie-breaker so
+rows with equal sort values are never skipped or repeated.
+
+A ranked search (``search.RankedSearchFilter``) is returned in rank order
+instead, unless ``?ordering=`` was given. The ranked set is bounded, so
+its pages are addressed by position.
+
+When the serializer can be compiled (``fast_serializers.py``), rows are
+fetched with ``values()`` and converted without building model instances
+or going through ``ModelSerializer``.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+from rest_framework.utils.urls import replace_query_param
+
+from .fast_serializers import compile_serializer
+from .resolve import expand, expand_names
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only keyset pagination.
+
+    The ordering is taken from the queryset itself (as set by
+    ``OrderingFilter`` or an explicit ``order_by``), falling back to the
+    model's ``Meta.ordering``.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE or 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.model = queryset.model
+        self.offset = None
+
+        ranking = getattr(request, 'search_ranking', None)
+        if ranking is not None and not request.query_params.get(api_settings.ORDERING_PARAM):
+            return self.paginate_ranked(queryset, ranking)
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self._after(position))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def paginate_ranked(self, queryset, ranking):
+        """Page through ``queryset`` in the order of ``ranking`` (``{pk: position}``)."""
+        self.offset = self.decode_offset(self.request)
+        pk = self.model._meta.pk.attname
+
+        def position(row):
+            return ranking.get(row[pk] if isinstance(row, dict) else row.pk, len(ranking))
+
+        rows = sorted(queryset, key=position)[self.offset:self.offset + self.page_size + 1]
+        self.has_next = len(rows) > self.page_size
+        return rows[:self.page_size]
+
+    def decode_offset(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return 0
+        try:
+            offset = json.loads(urlsafe_b64decode(encoded.encode('ascii')))['offset']
+            if not isinstance(offset, int) or offset < 0:
+                raise ValueError
+            return offset
+        except (TypeError, KeyError, ValueError, BinasciiError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        pk = queryset.model._meta.pk.name
+        if not any(field.lstrip('-') in (pk, 'pk') for field in ordering):
+            ordering.append(pk)
+        return ordering
+
+    def _after(self, position):
+        """Build ``(k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...`` for the cursor."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            values = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, BinasciiError, UnicodeEncodeError,
+                FieldDoesNotExist, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance):
+        if isinstance(instance, dict):
+            values = [instance[field.lstrip('-')] for field in self.ordering]
+        else:
+            values = [getattr(instance, field.lstrip('-')) for field in self.ordering]
+        payload = json.dumps(values, cls=encoders.JSONEncoder).encode('utf-8')
+        return urlsafe_b64encode(payload).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.offset is not None:
+            payload = json.dumps({'offset': self.offset + self.page_size}).encode('utf-8')
+            return replace_query_param(url, self.cursor_query_param, urlsafe_b64encode(payload).decode('ascii'))
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+def stream_json(queryset, serializer_class, context=None, chunk_size=500):
+    """
+    Stream ``queryset`` as a JSON array without materialising it.
+
+    Rows are pulled from the database ``chunk_size`` at a time and each one
+    is serialized and written as soon as it is read.
+    """
+    compiled = compile_serializer(serializer_class)
+
+    def generate():
+        yield '['
+        separator = ''
+        if compiled is not None:
+            rows = (compiled.convert(row) for row in compiled.rows(queryset).iterator(chunk_size=chunk_size))
+        else:
+            rows = (serializer_class(instance, context=context).data
+                    for instance in queryset.iterator(chunk_size=chunk_size))
+        for data in rows:
+            yield separator + json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False)
+            separator = ','
+        yield ']'
+
+    return StreamingHttpResponse(generate(), content_type='application/json')
+
+
+class KeysetListMixin:
+    """
+    List handling shared by the ViewSets and their list-style actions.
+
+    ``?stream=true`` switches from a keyset page to a streamed JSON array of
+    the full (filtered) result. ``?expand=`` embeds the users, teams or
+    workouts the rows of a page refer to (``resolve.expand``); streams are
+    not expanded.
+    """
+    stream_query_param = 'stream'
+
+    def list(self, request, *args, **kwargs):
+        return self.list_response(self.filter_queryset(self.get_queryset()))
+
+    def wants_stream(self):
+        value = self.request.query_params.get(self.stream_query_param, '')
+        return value.lower() in ('1', 'true', 'yes')
+
+    def list_response(self, queryset, serializer_class=None):
+        serializer_class = serializer_class or self.get_serializer_class()
+        context = self.get_serializer_context()
+        if self.wants_stream():
+            return stream_json(queryset, serializer_class, context)
+        compiled = compile_serializer(serializer_class)
+        if compiled is not None:
+            get_ordering = getattr(self.paginator, 'get_ordering', None)
+            ordering = [field.lstrip('-') for field in get_ordering(queryset)] if get_ordering else []
+            queryset = compiled.rows(queryset, *ordering)
+        page = self.paginate_queryset(queryset)
+        rows = queryset if page is None else page
+        if compiled is not None:
+            data = compiled.many(rows)
+        else:
+            data = serializer_class(rows, many=True, context=context).data
+        data = self.expand(data, serializer_class)
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def serialize_many(self, queryset, serializer_class=None, limit=None):
+        """
+        The first ``limit`` rows of ``queryset`` serialized (a plain list),
+        through the compiled path when possible.
+        """
+        serializer_class = serializer_class or self.get_serializer_class()
+        compiled = compile_serializer(serializer_class)
+        if compiled is not None:
+            return self.expand(compiled.many(compiled.rows(queryset)[:limit]), serializer_class)
+        data = serializer_class(queryset[:limit], many=True, context=self.get_serializer_context()).data
+        return self.expand(data, serializer_class)
+
+    def expand(self, data, serializer_class):
+        names = expand_names(self.request)
+        return expand(data, serializer_class, names) if names else data
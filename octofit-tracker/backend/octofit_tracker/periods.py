@@ -0,0 +1,197 @@
+"""
+Period-scoped leaderboards (day, week, month) with frozen snapshots.
+
+The current period is ranked from the incrementally maintained rollups
+(``rollups.py``): a day or week is a single indexed read of one bucket, a
+month sums its daily rows. A period that has ended is still ranked live
+for ``PERIOD_FREEZE_DELAY_HOURS``, so late uploads (wearables syncing in
+bulk) and rollup backfills still count. Once settled, the
+``freeze_leaderboards`` command freezes its standings into
+``leaderboard_snapshots`` (one document per entry) and
+``leaderboard_periods`` (one header per snapshot, written last), and every
+later read of that period comes from the snapshot. Reads never freeze: a
+period without a snapshot is ranked from the rollups however old it is.
+Snapshots are never recomputed: an activity back-dated into a frozen
+period does not change it.
+
+Ranks use the same competition ranking as ``ranking.py``.
+"""
+from datetime import timedelta
+
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import rollups
+from .aggregations import PERIODS, period_bounds
+from .mongo import get_db
+
+SNAPSHOTS = 'leaderboard_snapshots'
+SNAPSHOT_HEADERS = 'leaderboard_periods'
+SNAPSHOT_CHUNK_SIZE = 1000
+SNAPSHOT_INDEX = [('snapshot', 1), ('rank', 1), ('entity_id', 1)]
+
+
+def snapshot_key(board_type, period, start):
+    return f'{board_type}:{period}:{rollups.to_utc_naive(start):%Y-%m-%d}'
+
+
+def settle_delay():
+    return timedelta(hours=getattr(settings, 'PERIOD_FREEZE_DELAY_HOURS', 24))
+
+
+def settled(end, now=None):
+    """Whether a period ending at ``end`` is past its settle delay and may be frozen."""
+    return end + settle_delay() <= (now or timezone.now())
+
+
+def _entity_type(board_type):
+    return 'team' if board_type == 'team' else 'user'
+
+
+def _standings(db, board_type, period, start, end, limit=None):
+    """``[(entity_id, points, activities), ...]``, best first."""
+    match = {'entity_type': _entity_type(board_type)}
+    if period == 'month':
+        match['start'] = {'$gte': rollups.to_utc_naive(start), '$lt': rollups.to_utc_naive(end)}
+        pipeline = [
+            {'$match': match},
+            {'$group': {'_id': '$entity_id',
+                        'points': {'$sum': '$points'},
+                        'activities': {'$sum': '$activities'}}},
+            {'$match': {'activities': {'$gt': 0}}},
+            {'$sort': {'points': -1, '_id': 1}},
+        ]
+        if limit:
+            pipeline.append({'$limit': limit})
+        rows = db[rollups.BUCKETS['day']].aggregate(pipeline)
+        return [(row['_id'], row['points'], row['activities']) for row in rows]
+    match['start'] = rollups.to_utc_naive(start)
+    match['activities'] = {'$gt': 0}
+    cursor = db[rollups.BUCKETS[period]].find(
+        match, {'_id': 0, 'entity_id': 1, 'points': 1, 'activities': 1},
+    ).sort([('points', -1), ('entity_id', 1)])
+    if limit:
+        cursor = cursor.limit(limit)
+    return [(row['entity_id'], row['points'], row['activities']) for row in cursor]
+
+
+def _entries(db, board_type, standings):
+    """Competition-ranked entries with names, in the ``Leaderboard`` field layout."""
+    ids = [entity_id for entity_id, _, _ in standings]
+    if board_type == 'team':
+        names = {doc['_id']: doc for doc in db.teams.find({'_id': {'$in': ids}}, {'name': 1})}
+    else:
+        names = {doc['_id']: doc for doc in
+                 db.users.find({'_id': {'$in': ids}}, {'name': 1, 'alias': 1, 'team_id': 1})}
+    entries = []
+    for position, (entity_id, points, activities) in enumerate(standings, start=1):
+        rank = entries[-1]['rank'] if entries and entries[-1]['total_points'] == points else position
+        named = names.get(entity_id, {})
+        entry = {
+            'type': board_type,
+            'rank': rank,
+            'entity_id': entity_id,
+            'entity_name': named.get('name'),
+            'total_points': points,
+            'activities_count': activities,
+        }
+        if board_type != 'team':
+            entry['entity_alias'] = named.get('alias')
+            entry['team_id'] = named.get('team_id')
+        entries.append(entry)
+    return entries
+
+
+def freeze(board_type, period, start, db=None):
+    """
+    Snapshot the standings of the settled period starting at ``start``.
+
+    Entries are upserted by ``(snapshot, entity_id)`` and the header is
+    inserted last, so an interrupted or concurrent freeze converges on the
+    same snapshot. Returns the header.
+    """
+    db = db if db is not None else get_db()
+    key = snapshot_key(board_type, period, start)
+    header = db[SNAPSHOT_HEADERS].find_one({'_id': key})
+    if header is not None:
+        return header
+    start, end = period_bounds(period, start)
+    if not settled(end):
+        raise ValueError(f'The {period} starting {start:%Y-%m-%d} has not settled yet')
+    entries = _entries(db, board_type, _standings(db, board_type, period, start, end))
+    requests = []
+    for entry in entries:
+        entry.update(_id=f"{key}:{entry['entity_id']}", snapshot=key)
+        requests.append(ReplaceOne({'_id': entry['_id']}, entry, upsert=True))
+    for offset in range(0, len(requests), SNAPSHOT_CHUNK_SIZE):
+        db[SNAPSHOTS].bulk_write(requests[offset:offset + SNAPSHOT_CHUNK_SIZE], ordered=False)
+    header = {
+        '_id': key,
+        'type': board_type,
+        'period': period,
+        'start': rollups.to_utc_naive(start),
+        'end': rollups.to_utc_naive(end),
+        'entries': len(entries),
+        'frozen_at': rollups.to_utc_naive(timezone.now()),
+    }
+    try:
+        db[SNAPSHOT_HEADERS].insert_one(header)
+    except DuplicateKeyError:
+        header = db[SNAPSHOT_HEADERS].find_one({'_id': key})
+    return header
+
+
+def leaderboard(board_type='individual', period='week', at=None, limit=100, db=None):
+    """
+    The leaderboard of the ``period`` containing ``at`` (default: now).
+
+    Frozen periods are read from their snapshot; any other period is
+    ranked from the rollups without writing anything.
+    """
+    if period not in PERIODS:
+        raise ValueError(f'Unknown period {period!r}; expected one of {", ".join(PERIODS)}')
+    db = db if db is not None else get_db()
+    start, end = period_bounds(period, at)
+    key = snapshot_key(board_type, period, start)
+    frozen = db[SNAPSHOT_HEADERS].find_one({'_id': key}, {'_id': 1}) is not None
+    if frozen:
+        cursor = db[SNAPSHOTS].find({'snapshot': key}, {'_id': 0, 'snapshot': 0}).sort(
+            [('rank', 1), ('entity_id', 1)])
+        results = list(cursor.limit(limit) if limit else cursor)
+    else:
+        results = _entries(db, board_type, _standings(db, board_type, period, start, end, limit))
+    return {
+        'type': board_type,
+        'period': period,
+        'start': start,
+        'end': end,
+        'frozen': frozen,
+        'results': results,
+    }
+
+
+def freeze_closed(periods=PERIODS, board_types=('individual', 'team'), count=1, at=None, db=None):
+    """
+    Freeze the last ``count`` settled periods of each kind that are not
+    frozen yet. Returns the headers of the snapshots that were written.
+    """
+    db = db if db is not None else get_db()
+    # Every period that ended before this has settled.
+    at = (at or timezone.now()) - settle_delay()
+    written = []
+    for period in periods:
+        start, _ = period_bounds(period, at)
+        for _ in range(count):
+            start, _ = period_bounds(period, start - timedelta(seconds=1))
+            for board_type in board_types:
+                if db[SNAPSHOT_HEADERS].find_one({'_id': snapshot_key(board_type, period, start)}) is None:
+                    written.append(freeze(board_type, period, start, db))
+    return written
+
+
+def index_plans():
+    """``{collection: [keys]}`` for ``indexes.ensure_indexes``."""
+    return {SNAPSHOTS: [SNAPSHOT_INDEX]}
@@ -0,0 +1,392 @@
+"""
+Real-time push of activity and leaderboard changes.
+
+Writes publish compact events to topics:
+
+* ``activities``: ``activity.created`` / ``activity.updated`` (the
+  serialized activity) and ``activity.deleted`` (its ids);
+* ``team:<id>``: the same activity events for the team's activities, plus
+  ``rank`` events for the team;
+* ``leaderboard:individual`` and ``leaderboard:team``: ``rank`` events,
+  ``{"entity_id", "rank", "total_points"}`` for the entity that moved and
+  ``shift`` = ``{"from", "to", "by"}``: every other entry with
+  ``from <= total_points < to`` moved ``by`` ranks (``from`` is null for a
+  new entry, which also carries ``entity_name``).
+
+Events go through a broker (``PUSH_BROKER``): ``LocalBroker`` hands them
+straight to this process's ``Hub``; ``RedisBroker`` publishes them on a
+Redis channel that every worker subscribes to, so subscribers receive
+events from writes handled by any worker. The hub fans events out to
+per-subscriber bounded queues; a subscriber that falls ``PUSH_QUEUE_SIZE``
+events behind is dropped (it gets a ``dropped`` event and is expected to
+re-read and reconnect) so one slow client never holds events back.
+
+Clients connect to ``/api/stream/?topic=...&topic=...`` on the ASGI
+application (``asgi.py``), with Server-Sent Events or a WebSocket.
+"""
+import asyncio
+import json
+import logging
+import re
+import socket
+import threading
+import time
+from itertools import count
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .cache import RedisError, _RespConnection, parse_redis_url
+
+logger = logging.getLogger(__name__)
+
+STREAM_PATH = '/api/stream/'
+TOPIC_PATTERN = re.compile(r'^(activities|leaderboard:(individual|team)|team:[\w.-]{1,100})$')
+MAX_TOPICS = 20
+DROPPED = {'type': 'dropped'}
+
+
+class Subscription:
+    """One client's bounded event queue, owned by the event loop it was created on."""
+
+    def __init__(self, hub, topics, maxsize):
+        self.hub = hub
+        self.topics = frozenset(topics)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = False
+
+    def _deliver(self, events):
+        # Runs on self.loop.
+        if self.dropped:
+            return
+        for event in events:
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped = True
+                self.hub.unsubscribe(self, dropped=True)
+                while not self.queue.empty():
+                    self.queue.get_nowait()
+                self.queue.put_nowait(DROPPED)
+                return
+
+    async def get(self, timeout=None):
+        """The next event, ``DROPPED`` once dropped, or ``None`` after ``timeout`` seconds."""
+        if not self.queue.empty():
+            return self.queue.get_nowait()
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class Hub:
+    """In-process topic -> subscriptions fan-out; ``dispatch()`` is thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}
+        self._sequence = count(1)
+        self.dropped = 0
+
+    def subscribe(self, topics, maxsize=None):
+        subscription = Subscription(self, topics, maxsize or getattr(settings, 'PUSH_QUEUE_SIZE', 256))
+        with self._lock:
+            for topic in subscription.topics:
+                self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription, dropped=False):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._topics.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._topics[topic]
+            if dropped:
+                self.dropped += 1
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(set().union(*self._topics.values())) if self._topics else 0
+
+    def dispatch(self, messages):
+        """Deliver ``[(topic, event), ...]`` to the subscribers of each topic."""
+        batches = {}
+        with self._lock:
+            for topic, event in messages:
+                event = dict(event, topic=topic, id=next(self._sequence))
+                for subscription in self._topics.get(topic, ()):
+                    batches.setdefault(subscription, []).append(event)
+        for subscription, events in batches.items():
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._deliver, events)
+            except RuntimeError:  # the subscriber's loop is closed
+                self.unsubscribe(subscription)
+
+
+hub = Hub()
+
+
+class LocalBroker:
+    """Single-process broker: events only reach this process's subscribers."""
+
+    def __init__(self, hub, **options):
+        self.hub = hub
+
+    def publish(self, messages):
+        self.hub.dispatch(messages)
+
+    def close(self):
+        pass
+
+
+class RedisBroker:
+    """
+    Broker over Redis pub/sub (``url`` is a ``redis://`` URL).
+
+    Each process publishes batches to ``channel`` and keeps one subscriber
+    connection on a daemon thread that dispatches every batch, including
+    its own, to the local hub, so all workers see the same event order.
+    """
+
+    def __init__(self, hub, url, channel='octofit:push', socket_timeout=1.0):
+        self.hub = hub
+        self.channel = channel
+        self._address = parse_redis_url(url)
+        self._socket_timeout = socket_timeout
+        self._local = threading.local()
+        self._closed = threading.Event()
+        self._subscribed = threading.Event()
+        self._listener = None
+        self._thread = threading.Thread(target=self._listen, name='octofit-push', daemon=True)
+        self._thread.start()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _RespConnection(*self._address, self._socket_timeout)
+        return conn
+
+    def publish(self, messages):
+        payload = json.dumps(messages, separators=(',', ':'), default=str)
+        try:
+            self._connection().execute('PUBLISH', self.channel, payload)
+        except (OSError, ConnectionError):
+            # One reconnect attempt, as in cache.RedisProtocolCache.
+            conn = getattr(self._local, 'conn', None)
+            if conn is not None:
+                conn.close()
+            self._local.conn = None
+            self._connection().execute('PUBLISH', self.channel, payload)
+
+    def wait_subscribed(self, timeout=None):
+        return self._subscribed.wait(timeout)
+
+    def _listen(self):
+        backoff = 0.1
+        while not self._closed.is_set():
+            try:
+                self._listener = _RespConnection(*self._address, None)
+                self._listener.execute('SUBSCRIBE', self.channel)
+                self._subscribed.set()
+                backoff = 0.1
+                while True:
+                    kind, _channel, data = self._listener._read()
+                    if kind == b'message':
+                        self.hub.dispatch(json.loads(data))
+            except (OSError, ConnectionError, RedisError, ValueError) as exc:
+                self._subscribed.clear()
+                if self._listener is not None:
+                    self._listener.close()
+                if self._closed.is_set():
+                    return
+                logger.warning('Push subscriber connection lost (%s); reconnecting', exc)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+
+    def close(self, timeout=5.0):
+        self._closed.set()
+        listener = self._listener
+        if listener is not None:
+            # Wakes the listener thread blocked in a read; it then exits.
+            try:
+                listener.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._thread.join(timeout)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_class = import_string(getattr(settings, 'PUSH_BROKER', 'octofit_tracker.push.LocalBroker'))
+                _broker = broker_class(hub, **getattr(settings, 'PUSH_BROKER_OPTIONS', {}))
+    return _broker
+
+
+def set_broker(broker):
+    """Replace the process broker (tests, or wiring done outside settings)."""
+    global _broker
+    with _broker_lock:
+        previous, _broker = _broker, broker
+    return previous
+
+
+def publish_many(messages):
+    """Publish ``[(topic, event), ...]``; failures are logged, never raised into the write path."""
+    if not messages:
+        return
+    try:
+        get_broker().publish(list(messages))
+    except (OSError, ConnectionError, RedisError) as exc:
+        logger.warning('Dropping %d push events: %s', len(messages), exc)
+
+
+def activity_messages(kind, activities):
+    """``(topic, event)`` pairs for ``activity.<kind>`` of serialized ``activities``."""
+    messages = []
+    for activity in activities:
+        if kind == 'deleted':
+            activity = {key: activity.get(key) for key in ('_id', 'user_id', 'team_id')}
+        event = {'type': f'activity.{kind}', 'activity': activity}
+        messages.append(('activities', event))
+        if activity.get('team_id'):
+            messages.append((f"team:{activity['team_id']}", event))
+    return messages
+
+
+def rank_messages(board_type, delta):
+    """``(topic, event)`` pairs for one entity's move on ``board_type``."""
+    event = dict(delta, type='rank', board=board_type)
+    messages = [(f'leaderboard:{board_type}', event)]
+    if board_type == 'team':
+        messages.append((f"team:{delta['entity_id']}", event))
+    return messages
+
+
+# ASGI endpoint
+
+def _topics(scope):
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    topics = query.get('topic', [])
+    if not topics or len(topics) > MAX_TOPICS or not all(TOPIC_PATTERN.match(topic) for topic in topics):
+        return None
+    return topics
+
+
+def _cors_headers(scope):
+    origin = dict(scope.get('headers', ())).get(b'origin')
+    allowed = getattr(settings, 'CORS_ALLOWED_ORIGINS', ())
+    if origin and (getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False) or origin.decode('latin-1') in allowed):
+        return [(b'access-control-allow-origin', origin), (b'vary', b'Origin')]
+    return []
+
+
+def _sse(event):
+    data = json.dumps(event, separators=(',', ':'), ensure_ascii=False, default=str)
+    return f"id: {event.get('id', '')}\nevent: {event['type']}\ndata: {data}\n\n".encode('utf-8')
+
+
+async def _respond(send, status, detail, headers=()):
+    body = json.dumps({'detail': detail}).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _wait_disconnect(receive, kind):
+    while (await receive())['type'] != kind:
+        pass
+
+
+async def _pump(subscription, send_event, heartbeat, disconnected):
+    """Send events until the client goes away or the subscription is dropped."""
+    while not disconnected.done():
+        getter = asyncio.ensure_future(subscription.get(heartbeat))
+        await asyncio.wait([getter, disconnected], return_when=asyncio.FIRST_COMPLETED)
+        if not getter.done():
+            getter.cancel()
+            return
+        event = getter.result()
+        await send_event(event)
+        if event is DROPPED:
+            return
+
+
+async def stream_events(scope, receive, send):
+    """Server-Sent Events (``http``) or WebSocket (``websocket``) subscription."""
+    heartbeat = getattr(settings, 'PUSH_HEARTBEAT_SECONDS', 15)
+    topics = _topics(scope)
+    if scope['type'] == 'http':
+        if scope['method'] not in ('GET', 'HEAD'):
+            return await _respond(send, 405, f'Method "{scope["method"]}" not allowed.', [(b'allow', b'GET')])
+        if topics is None:
+            return await _respond(send, 400, f'Pass 1 to {MAX_TOPICS} valid ?topic= parameters.')
+        subscription = hub.subscribe(topics)
+        disconnected = asyncio.ensure_future(_wait_disconnect(receive, 'http.disconnect'))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+                *_cors_headers(scope),
+            ]})
+            await send({'type': 'http.response.body', 'body': b'retry: 2000\n\n', 'more_body': True})
+
+            async def send_event(event):
+                chunk = b': ping\n\n' if event is None else _sse(event)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+            await _pump(subscription, send_event, heartbeat, disconnected)
+            if not disconnected.done():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            subscription.close()
+            disconnected.cancel()
+        return
+
+    # WebSocket
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    if topics is None:
+        return await send({'type': 'websocket.close', 'code': 4400})
+    await send({'type': 'websocket.accept'})
+    subscription = hub.subscribe(topics)
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive, 'websocket.disconnect'))
+    try:
+        async def send_event(event):
+            if event is not None:
+                text = json.dumps(event, separators=(',', ':'), ensure_ascii=False, default=str)
+                await send({'type': 'websocket.send', 'text': text})
+
+        await _pump(subscription, send_event, heartbeat, disconnected)
+        if not disconnected.done():
+            await send({'type': 'websocket.close', 'code': 1013 if subscription.dropped else 1000})
+    finally:
+        subscription.close()
+        disconnected.cancel()
+
+
+class PushRouter:
+    """ASGI app serving ``STREAM_PATH`` itself and everything else with ``application``."""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] in ('http', 'websocket') and scope['path'] == STREAM_PATH:
+            return await stream_events(scope, receive, send)
+        return await self.application(scope, receive, send)
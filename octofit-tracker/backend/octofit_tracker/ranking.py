@@ -0,0 +1,189 @@
+"""
+Incremental leaderboard engine.
+
+Every Activity write is turned into a points delta for one user and one
+team. The engine applies the delta with atomic ``$inc`` updates and keeps
+the ``rank`` column of the ``leaderboard`` collection correct without
+re-sorting: the moved entity's rank is counted from the collection after
+its ``$inc`` (a range count on the ``(type, total_points)`` index, so it
+reflects every worker's writes), and only the rows whose rank actually
+changes (those whose points lie between the old and new total) are
+shifted with a single range update.
+
+Ranks use standard competition ranking: ``rank = 1 + number of entries
+with strictly more points``, so ties share a rank.
+
+The user counters themselves (``total_points``, ``activities_completed``)
+go through the write-behind ``counters.counter_buffer``. The leaderboard
+row's total is ``$inc``ed on its own, so it stays exact however many
+workers move the same entity; the user's merged total, or the team's
+points summed over its activities in both tiers, only seeds a row that
+does not exist yet.
+
+Each move is also published as a compact ``rank`` event (``push.py``):
+the entity's new rank and total plus the points range whose ranks shifted.
+"""
+import threading
+
+from django.utils import timezone
+from pymongo import ReturnDocument
+
+from . import push
+from .counters import APPLIED_FIELD, counter_buffer
+from .tiering import both_tiers
+from .versions import bump
+from .mongo import get_db
+
+
+USER_FIELDS = {'name': 1, 'alias': 1, 'team_id': 1, 'total_points': 1, 'activities_completed': 1,
+               APPLIED_FIELD: 1}
+
+
+def team_total(db, team_id):
+    """The points of every activity logged for ``team_id``, in both tiers."""
+    rows = list(db.activities.aggregate(both_tiers({'team_id': team_id}) + [
+        {'$group': {'_id': None, 'points': {'$sum': '$points_earned'}}},
+    ]))
+    return rows[0]['points'] if rows else 0
+
+
+class LeaderboardEngine:
+    """
+    Applies Activity writes to users, teams and leaderboard rows.
+
+    The engine keeps no state of its own, so any number of workers can run
+    it against the same collection. The lock only serializes the moves of
+    this process, so that the push events for an entity are published in
+    the order its row changed; it is not what keeps ranks correct. Two
+    workers moving entities past each other at the same instant can leave
+    a passed row's rank off by one until either entity moves again or the
+    board is read through ``live``, which ranks from the totals.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def activity_created(self, activity):
+        self._apply(activity.user_id, activity.team_id, activity.points_earned, 1)
+
+    def activity_deleted(self, activity):
+        self._apply(activity.user_id, activity.team_id, -activity.points_earned, -1)
+
+    def activity_updated(self, previous, activity):
+        """``previous`` is a (user_id, team_id, points_earned) tuple."""
+        user_id, team_id, points = previous
+        if user_id == activity.user_id and team_id == activity.team_id:
+            self._apply(user_id, team_id, activity.points_earned - points, 0)
+        else:
+            self._apply(user_id, team_id, -points, -1)
+            self._apply(activity.user_id, activity.team_id, activity.points_earned, 1)
+
+    def activities_bulk_created(self, documents):
+        """
+        Apply a batch of inserted activity documents.
+
+        Increments are coalesced per user and per team before they reach
+        the counter buffer; ranks are then moved once per distinct entity
+        rather than once per activity.
+        """
+        user_deltas, team_deltas = {}, {}
+        for document in documents:
+            points, count = user_deltas.get(document['user_id'], (0, 0))
+            user_deltas[document['user_id']] = (points + document['points_earned'], count + 1)
+            if document.get('team_id'):
+                team_deltas[document['team_id']] = team_deltas.get(document['team_id'], 0) + document['points_earned']
+        if not user_deltas:
+            return
+        db = get_db()
+        now = timezone.now()
+        messages = []
+        with self._lock:
+            for user_id, (points, count) in user_deltas.items():
+                counter_buffer.add(db, 'users', user_id, {'total_points': points, 'activities_completed': count})
+            users = list(db.users.find({'_id': {'$in': list(user_deltas)}}, USER_FIELDS))
+            counter_buffer.merge('users', users)
+            for user in users:
+                messages += self._move(db, 'individual', user['_id'], user_deltas[user['_id']][0], now, {
+                    'entity_name': user.get('name'),
+                    'entity_alias': user.get('alias'),
+                    'team_id': user.get('team_id'),
+                    'activities_count': user.get('activities_completed', 0),
+                }, total=user['total_points'])
+            for team in db.teams.find({'_id': {'$in': list(team_deltas)}}, {'name': 1, 'member_count': 1}):
+                messages += self._move(db, 'team', team['_id'], team_deltas[team['_id']], now, {
+                    'entity_name': team.get('name'),
+                    'member_count': team.get('member_count', 0),
+                }, total=lambda team_id=team['_id']: team_total(db, team_id))
+            # Published under the lock so events for an entity stay in order.
+            push.publish_many(messages)
+        bump('users', 'leaderboard')
+
+    def _apply(self, user_id, team_id, points, activities):
+        db = get_db()
+        now = timezone.now()
+        messages = []
+        with self._lock:
+            user = db.users.find_one({'_id': user_id}, USER_FIELDS)
+            if user is not None:
+                counter_buffer.add(db, 'users', user_id, {'total_points': points, 'activities_completed': activities})
+                counter_buffer.merge('users', [user])
+                messages += self._move(db, 'individual', user_id, points, now, {
+                    'entity_name': user.get('name'),
+                    'entity_alias': user.get('alias'),
+                    'team_id': user.get('team_id'),
+                    'activities_count': user.get('activities_completed', 0),
+                }, total=user['total_points'])
+            team = db.teams.find_one({'_id': team_id}, {'name': 1, 'member_count': 1}) if team_id else None
+            if team is not None:
+                messages += self._move(db, 'team', team_id, points, now, {
+                    'entity_name': team.get('name'),
+                    'member_count': team.get('member_count', 0),
+                }, total=lambda: team_total(db, team_id))
+            push.publish_many(messages)
+        # These writes bypass the ORM, so no model signal announces them.
+        bump('users', 'leaderboard')
+
+    def _move(self, db, board_type, entity_id, points, now, fields, total=None):
+        """
+        Move one entity by ``points``, shifting only the ranks it passes.
+        ``total`` is the entity's total (or a function computing it) if it
+        has no row yet.
+
+        Returns the push messages describing the move.
+        """
+        row = db.leaderboard.find_one_and_update(
+            {'type': board_type, 'entity_id': entity_id}, {'$inc': {'total_points': points}},
+            projection={'total_points': 1}, return_document=ReturnDocument.BEFORE,
+        )
+        others = {'type': board_type, 'entity_id': {'$ne': entity_id}}
+        delta = {'entity_id': entity_id}
+        if row is None:
+            new = total() if callable(total) else total if total is not None else points
+            fields = dict(fields, total_points=new)
+            db.leaderboard.update_many(dict(others, total_points={'$lt': new}), {'$inc': {'rank': 1}})
+            delta['entity_name'] = fields.get('entity_name')
+            delta['shift'] = {'from': None, 'to': new, 'by': 1}
+        else:
+            old = row.get('total_points') or 0
+            new = old + points
+            if new > old:
+                db.leaderboard.update_many(
+                    dict(others, total_points={'$gte': old, '$lt': new}), {'$inc': {'rank': 1}})
+                delta['shift'] = {'from': old, 'to': new, 'by': 1}
+            elif new < old:
+                db.leaderboard.update_many(
+                    dict(others, total_points={'$gte': new, '$lt': old}), {'$inc': {'rank': -1}})
+                delta['shift'] = {'from': new, 'to': old, 'by': -1}
+        rank = db.leaderboard.count_documents(dict(others, total_points={'$gt': new})) + 1
+        db.leaderboard.update_one(
+            {'type': board_type, 'entity_id': entity_id},
+            {
+                '$set': dict(fields, rank=rank, updated_at=now),
+                '$setOnInsert': {'_id': f'leaderboard_{board_type}_{entity_id}'},
+            },
+            upsert=True,
+        )
+        return push.rank_messages(board_type, dict(delta, rank=rank, total_points=new))
+
+
+leaderboard_engine = LeaderboardEngine()
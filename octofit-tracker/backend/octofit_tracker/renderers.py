@@ -0,0 +1,48 @@
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+from .instrumentation import TimedRendererMixin
+
+
+class TimedBrowsableAPIRenderer(TimedRendererMixin, BrowsableAPIRenderer):
+    pass
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    ``JSONRenderer`` encoding with orjson when it is installed.
+
+    The output is byte-identical to ``JSONRenderer`` with the default
+    compact/unicode settings: types orjson does not know (``Decimal``, lazy
+    strings, ...) go through DRF's encoder, and U+2028/U+2029 are escaped
+    the same way. (Floats that need an exponent are spelled differently,
+    e.g. ``1e16`` rather than ``1e+16``; the API has no float fields.)
+    Indented output (the browsable API) and a missing orjson fall back to
+    ``JSONRenderer``.
+    """
+    _default = encoders.JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if (orjson is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context)):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self._default,
+                               option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class TimedORJSONRenderer(TimedRendererMixin, ORJSONRenderer):
+    pass
@@ -0,0 +1,118 @@
+"""
+Routing of read-only requests to MongoDB secondaries.
+
+The ViewSet actions named in ``replica_actions`` (``ReplicaReadMixin``)
+read through the ``READ_REPLICA_ALIAS`` database, whose client has a
+secondary read preference (settings.py): ORM queries through
+``ReplicaRouter``, raw pymongo ones through ``mongo.get_db()``. Writes,
+including those a GET makes, always reach the primary.
+
+Read-your-writes: a successful write answers with a ``STICKY_HEADER``
+holding the time ``REPLICA_STICKY_SECONDS`` ahead, which covers the
+replication lag, and the client's reads that echo it back stay on the
+primary until then. The frontend is served from another origin, where a
+cookie would not be sent, so the token travels as a header (exposed and
+allowed in the CORS settings). Causally consistent sessions would be
+exact, but djongo issues its queries without a session.
+
+A response read from a secondary soon after a write to a collection it
+reads may lack that write. Such responses are neither cached nor given
+ETags, so the staleness does not outlive the replication lag under the
+new version counters (``versions.py``).
+"""
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .versions import current
+
+STICKY_HEADER = 'X-Octofit-Primary-Until'
+
+_alias = ContextVar('octofit_read_alias', default=None)
+
+
+def replica_alias():
+    """The configured replica alias, or ``None`` when reads cannot be routed."""
+    alias = getattr(settings, 'READ_REPLICA_ALIAS', None)
+    return alias if alias and alias in connections else None
+
+
+def read_alias():
+    """The database alias reads of the current request go to."""
+    return _alias.get() or DEFAULT_DB_ALIAS
+
+
+def reading_replica():
+    return _alias.get() is not None
+
+
+def is_sticky(request):
+    """Whether the client wrote recently enough that it must read from the primary."""
+    try:
+        return float(request.headers.get(STICKY_HEADER, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def stick(response):
+    """Tell the client to read from the primary for ``REPLICA_STICKY_SECONDS``."""
+    window = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+    response[STICKY_HEADER] = f'{time.time() + window:.3f}'
+
+
+def may_be_stale(collections):
+    """Whether a secondary read of ``collections`` could miss a recent write."""
+    if not reading_replica():
+        return False
+    recent = time.time() - getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 10)
+    return any(modified > recent for _version, modified in current(collections))
+
+
+class ReplicaRouter:
+    """Sends ORM reads to the replica alias while a request reads from it."""
+
+    def db_for_read(self, model, **hints):
+        return _alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    """
+    Serves the ``replica_actions`` of a ViewSet from secondaries, and makes
+    the client stick to the primary after it writes.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        alias = replica_alias()
+        if (alias and request.method in ('GET', 'HEAD') and self.action in self.replica_actions
+                and not is_sticky(request)):
+            self._replica_token = _alias.set(alias)
+        super().initial(request, *args, **kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        # DRF skips finalize_response() when an exception is re-raised; the
+        # alias must not outlive the request on this thread either way.
+        self._replica_token = None
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self._replica_token is not None:
+                _alias.reset(self._replica_token)
+                self._replica_token = None
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and 200 <= response.status_code < 300:
+            stick(response)
+        return response
@@ -0,0 +1,173 @@
+"""
+Batched lookups of users, teams and workouts by id.
+
+Leaderboards and activity feeds reference other entities by id, and
+fetching them one ``/api/users/{id}/`` at a time costs a round trip per
+row. ``Loader`` collects every id a response needs first, then loads
+each kind with a single ``pk__in`` (``$in``) query, skipping ids held by
+an in-process LRU (``RESOLVE_TTL``/``RESOLVE_MAX_ENTRIES``). Entries are
+tagged with a version counter (``versions.py``) and only used while it
+is unchanged. Teams and workouts use their collection's counter. Users
+use ``user_search``, which only profile saves, deletes and reloads bump
+(``search.py``): the ``users`` counter moves with every activity write,
+through the ``$inc``s behind user totals, and would empty the cache all
+the time. A cached user's totals can therefore lag by up to
+``RESOLVE_TTL``, less this process's pending counter deltas
+(``counters.py``), which are merged in on the way out.
+
+It backs ``/api/resolve/?users=a,b&teams=x&workouts=y`` and the
+``?expand=user,team,workout`` parameter of the activity and leaderboard
+lists, which embeds the referenced entity next to each row.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from .counters import merge_serialized_users
+from .fast_serializers import compile_serializer
+from .lookups import TTLCache
+from .models import Team, User, Workout
+from .search import USER_SEARCH_VERSION
+from .serializers import TeamSerializer, UserSerializer, WorkoutSerializer
+from .versions import current
+
+MAX_IDS = 500
+EXPAND_PARAM = 'expand'
+
+# {kind (the collection): (model, serializer)}
+KINDS = {
+    'users': (User, UserSerializer),
+    'teams': (Team, TeamSerializer),
+    'workouts': (Workout, WorkoutSerializer),
+}
+# {?expand= name: kind}
+EXPANSIONS = {'user': 'users', 'team': 'teams', 'workout': 'workouts'}
+# {kind: the version counter its cache entries are tagged with}
+CACHE_VERSIONS = {'users': USER_SEARCH_VERSION, 'teams': 'teams', 'workouts': 'workouts'}
+
+_cache = TTLCache(getattr(settings, 'RESOLVE_TTL', 30), getattr(settings, 'RESOLVE_MAX_ENTRIES', 10000))
+
+
+def forget(kind, entity_id):
+    _cache.delete((kind, entity_id))
+
+
+def clear():
+    _cache.clear()
+
+
+def _serialize(kind, queryset):
+    serializer_class = KINDS[kind][1]
+    compiled = compile_serializer(serializer_class)
+    if compiled is not None:
+        return compiled.many(compiled.rows(queryset))
+    return serializer_class(queryset, many=True).data
+
+
+class Loader:
+    """Collects the ids one response needs, then loads each kind with one query."""
+
+    def __init__(self):
+        self._wanted = defaultdict(set)
+        self._loaded = defaultdict(dict)
+
+    def want(self, kind, entity_id):
+        if entity_id and entity_id not in self._loaded[kind]:
+            self._wanted[kind].add(entity_id)
+
+    def load(self):
+        kinds = list(self._wanted)
+        counters = current([CACHE_VERSIONS[kind] for kind in kinds])
+        versions = {kind: version for kind, (version, _modified) in zip(kinds, counters)}
+        for kind, ids in self._wanted.items():
+            loaded = self._loaded[kind]
+            missing = []
+            for entity_id in ids:
+                cached = _cache.get((kind, entity_id))
+                if cached is None or cached[0] != versions[kind]:
+                    missing.append(entity_id)
+                else:
+                    loaded[entity_id] = cached[1]
+            if missing:
+                model = KINDS[kind][0]
+                for data in _serialize(kind, model.objects.filter(pk__in=missing)):
+                    _cache.set((kind, data['_id']), (versions[kind], data))
+                    loaded[data['_id']] = data
+        self._wanted.clear()
+        return self
+
+    def get(self, kind, entity_id):
+        """The serialized entity (a fresh copy), or ``None`` if it does not exist."""
+        data = self._loaded[kind].get(entity_id)
+        if data is None:
+            return None
+        data = dict(data)
+        return merge_serialized_users(data) if kind == 'users' else data
+
+
+def resolve(wanted):
+    """``{kind: {id: entity or None}}`` for ``{kind: [ids]}``."""
+    loader = Loader()
+    for kind, ids in wanted.items():
+        for entity_id in ids:
+            loader.want(kind, entity_id)
+    loader.load()
+    return {kind: {entity_id: loader.get(kind, entity_id) for entity_id in ids} for kind, ids in wanted.items()}
+
+
+def parse_ids(request):
+    """``{kind: [ids]}`` from ``?users=a,b&teams=x&workouts=y``."""
+    wanted = {}
+    for kind in KINDS:
+        value = request.query_params.get(kind)
+        if value is None:
+            continue
+        ids = list(dict.fromkeys(entity_id for entity_id in value.split(',') if entity_id))
+        if len(ids) > MAX_IDS:
+            raise ValidationError({kind: f'At most {MAX_IDS} ids per request.'})
+        wanted[kind] = ids
+    return wanted
+
+
+def expand_names(request):
+    """The names in ``?expand=``, validated."""
+    value = request.query_params.get(EXPAND_PARAM, '')
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in EXPANSIONS]
+    if unknown:
+        raise ValidationError({EXPAND_PARAM: f"Unknown: {', '.join(unknown)}. Use {', '.join(EXPANSIONS)}."})
+    return list(dict.fromkeys(names))
+
+
+def expand_reads(request):
+    """The collections ``?expand=`` makes a response read (for ETags and the response cache)."""
+    if request is None or EXPAND_PARAM not in request.query_params:
+        return ()
+    return tuple(EXPANSIONS[name] for name in expand_names(request))
+
+
+def expand(rows, serializer_class, names):
+    """
+    Embed the entities ``names`` refer to into each serialized row, in
+    place: ``row['user'] = {...}`` (``None`` when unknown or not
+    applicable). The serializer declares what it refers to with
+    ``reference()`` (``serializers.ExpandableMixin``).
+    """
+    reference = getattr(serializer_class, 'reference', None)
+    unsupported = [name for name in names if reference is None or name not in serializer_class.expandable]
+    if unsupported:
+        raise ValidationError({EXPAND_PARAM: f"Not available here: {', '.join(unsupported)}."})
+    loader = Loader()
+    references = []
+    for row in rows:
+        refs = [(name, reference(name, row)) for name in names]
+        for _name, (kind, entity_id) in refs:
+            if kind is not None:
+                loader.want(kind, entity_id)
+        references.append(refs)
+    loader.load()
+    for row, refs in zip(rows, references):
+        for name, (kind, entity_id) in refs:
+            row[name] = loader.get(kind, entity_id) if kind is not None else None
+    return rows
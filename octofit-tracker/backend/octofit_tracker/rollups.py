@@ -0,0 +1,232 @@
+"""
+Time-bucketed activity rollups.
+
+For every activity written, the points, activity count and quantity are
+added to one document per (entity, bucket start) in ``rollups_hourly``,
+``rollups_daily`` and ``rollups_weekly``, for the user, the team and the
+workout. Range stats then read a handful of pre-aggregated rows instead of
+scanning activity history.
+
+Buckets are in UTC and weeks start on Monday. Bucket starts are stored as
+naive UTC datetimes, the way pymongo returns them.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta, timezone as dt_timezone
+
+from pymongo import ReplaceOne, UpdateOne
+
+from .mongo import get_db
+from .versions import bump
+
+BUCKETS = OrderedDict([
+    ('hour', 'rollups_hourly'),
+    ('day', 'rollups_daily'),
+    ('week', 'rollups_weekly'),
+])
+ENTITIES = OrderedDict([
+    ('user', 'user_id'),
+    ('team', 'team_id'),
+    ('workout', 'workout_id'),
+])
+STAT_FIELDS = ('points', 'activities', 'quantity')
+ROLLUP_INDEX = [('entity_type', 1), ('entity_id', 1), ('start', 1)]
+# Per-period standings read by periods.py
+STANDINGS_INDEX = [('entity_type', 1), ('start', 1), ('points', -1), ('entity_id', 1)]
+
+
+def to_utc_naive(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def bucket_start(value, bucket):
+    value = to_utc_naive(value)
+    if bucket == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    day = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    raise ValueError(f'Unknown bucket {bucket!r}; expected one of {", ".join(BUCKETS)}')
+
+
+def rollup_id(entity_type, entity_id, start):
+    return f'{entity_type}:{entity_id}:{start.isoformat()}'
+
+
+def activity_fields(activity):
+    """The fields rollups need, from a model instance or a raw document."""
+    if isinstance(activity, dict):
+        get = activity.get
+    else:
+        def get(name):
+            return getattr(activity, name, None)
+    return {name: get(name) for name in
+            ('user_id', 'team_id', 'workout_id', 'completed_at', 'points_earned', 'quantity')}
+
+
+def _accumulate(totals, activity, sign, buckets):
+    for bucket in buckets:
+        start = bucket_start(activity['completed_at'], bucket)
+        for entity_type, field in ENTITIES.items():
+            entity_id = activity[field]
+            if not entity_id:
+                continue
+            key = (bucket, entity_type, entity_id, start)
+            stats = totals.setdefault(key, {name: 0 for name in STAT_FIELDS})
+            stats['points'] += sign * (activity['points_earned'] or 0)
+            stats['activities'] += sign
+            stats['quantity'] += sign * (activity['quantity'] or 0)
+
+
+def apply(activities, sign=1, db=None):
+    """
+    Add (``sign=1``) or remove (``sign=-1``) activities from the rollups.
+
+    Increments for the same row are coalesced first, then written with one
+    unordered ``bulk_write`` of ``$inc`` upserts per bucket collection.
+    """
+    totals = OrderedDict()
+    for activity in activities:
+        _accumulate(totals, activity_fields(activity), sign, BUCKETS)
+    if not totals:
+        return
+    db = db if db is not None else get_db()
+    requests = {bucket: [] for bucket in BUCKETS}
+    for (bucket, entity_type, entity_id, start), stats in totals.items():
+        requests[bucket].append(UpdateOne(
+            {'_id': rollup_id(entity_type, entity_id, start)},
+            {
+                '$inc': stats,
+                '$setOnInsert': {'entity_type': entity_type, 'entity_id': entity_id, 'start': start},
+            },
+            upsert=True,
+        ))
+    for bucket, collection in BUCKETS.items():
+        if requests[bucket]:
+            db[collection].bulk_write(requests[bucket], ordered=False)
+    bump('rollups')
+
+
+def stats(entity_type, entity_id, bucket='day', since=None, until=None, limit=5000, db=None):
+    """Rollup rows for one entity, oldest first, within ``[since, until)``."""
+    if bucket not in BUCKETS:
+        raise ValueError(f'Unknown bucket {bucket!r}; expected one of {", ".join(BUCKETS)}')
+    db = db if db is not None else get_db()
+    query = {'entity_type': entity_type, 'entity_id': entity_id}
+    start = {}
+    if since is not None:
+        start['$gte'] = bucket_start(since, bucket)
+    if until is not None:
+        start['$lt'] = to_utc_naive(until)
+    if start:
+        query['start'] = start
+    projection = {'_id': 0, 'start': 1, 'points': 1, 'activities': 1, 'quantity': 1}
+    rows = db[BUCKETS[bucket]].find(query, projection).sort('start', 1).limit(limit)
+    return [
+        {
+            'start': row['start'].replace(tzinfo=dt_timezone.utc),
+            'points': row.get('points', 0),
+            'activities': row.get('activities', 0),
+            'quantity': row.get('quantity', 0),
+        }
+        for row in rows
+    ]
+
+
+def index_plans():
+    """``{collection: [keys]}`` for ``indexes.ensure_indexes``."""
+    return OrderedDict((collection, [ROLLUP_INDEX, STANDINGS_INDEX]) for collection in BUCKETS.values())
+
+
+def _starting(since=None, until=None):
+    """
+    Filter for rows starting in ``[since, until)``. Every entity type is
+    listed so ``STANDINGS_INDEX`` answers it instead of a collection scan.
+    """
+    start = {}
+    if since is not None:
+        start['$gte'] = since
+    if until is not None:
+        start['$lt'] = until
+    return {'entity_type': {'$in': list(ENTITIES)}, 'start': start}
+
+
+def _week_ranges(first, last, weeks_per_chunk):
+    start = bucket_start(first, 'week')
+    end = to_utc_naive(last)
+    step = timedelta(weeks=weeks_per_chunk)
+    while start <= end:
+        yield start, start + step
+        start += step
+
+
+def _backfill_range(db, collections, since, until, batch_size):
+    totals = OrderedDict()
+    seen = set()
+    for collection in collections:
+        cursor = db[collection].find(
+            {'completed_at': {'$gte': since, '$lt': until}},
+            {'user_id': 1, 'team_id': 1, 'workout_id': 1, 'completed_at': 1, 'points_earned': 1, 'quantity': 1},
+        ).batch_size(batch_size)
+        for activity in cursor:
+            if activity['_id'] in seen:
+                continue  # caught between the two steps of a tier move
+            seen.add(activity['_id'])
+            _accumulate(totals, activity_fields(activity), 1, BUCKETS)
+    count = len(seen)
+    # Buckets whose activities are all gone have no row to replace.
+    for collection in BUCKETS.values():
+        db[collection].delete_many(_starting(since, until))
+    requests = {bucket: [] for bucket in BUCKETS}
+    for (bucket, entity_type, entity_id, start), values in totals.items():
+        document = dict(values, _id=rollup_id(entity_type, entity_id, start),
+                        entity_type=entity_type, entity_id=entity_id, start=start)
+        requests[bucket].append(ReplaceOne({'_id': document['_id']}, document, upsert=True))
+    for bucket, collection in BUCKETS.items():
+        for offset in range(0, len(requests[bucket]), batch_size):
+            db[collection].bulk_write(requests[bucket][offset:offset + batch_size], ordered=False)
+    return count
+
+
+def backfill(db=None, workers=4, weeks_per_chunk=4, batch_size=1000, progress=None):
+    """
+    Rebuild every rollup row from the activities of both tiers.
+
+    History is split into week-aligned time ranges that are processed in
+    parallel; since every hour/day/week bucket falls inside exactly one
+    range, workers never write the same row. Each range's rows are
+    deleted and rewritten rather than incremented, so the backfill can be
+    re-run safely and leaves no rows for buckets that have since emptied;
+    rows outside the activities' time span are deleted too. A range's
+    rows are missing from reads between its delete and its writes.
+    Returns the number of activities read.
+    """
+    from .tiering import TIERS  # tiering imports this module
+    db = db if db is not None else get_db()
+    ends = []
+    for collection in TIERS:
+        for direction in (1, -1):
+            document = db[collection].find_one({}, {'completed_at': 1}, sort=[('completed_at', direction)])
+            if document is not None:
+                ends.append(document['completed_at'])
+    ranges = list(_week_ranges(min(ends), max(ends), weeks_per_chunk)) if ends else []
+    for collection in BUCKETS.values():
+        if ranges:
+            db[collection].delete_many(_starting(until=ranges[0][0]))
+            db[collection].delete_many(_starting(since=ranges[-1][1]))
+        else:
+            db[collection].delete_many({})
+    total = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_backfill_range, db, TIERS, since, until, batch_size) for since, until in ranges]
+        for (since, until), future in zip(ranges, futures):
+            count = future.result()
+            total += count
+            if progress:
+                progress(since, until, count)
+    bump('rollups')
+    return total
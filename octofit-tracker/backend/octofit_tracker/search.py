@@ -0,0 +1,332 @@
+"""
+Ranked full-text search for the list endpoints.
+
+``SearchFilter`` turns ``?search=`` into case-insensitive regexes over every
+search field, which MongoDB can only answer by scanning the collection.
+``RankedSearchFilter`` asks the ViewSet's ``search_backend`` for the ids of
+the best matches instead and narrows the queryset to them; the pagination
+(``pagination.KeysetPagination``) then returns them in rank order unless
+the client asked for an explicit ``?ordering=``. Every match is ranked, so
+paging through them returns them all.
+
+Two backends:
+
+* ``TextSearch`` runs a ``$text`` query against the collection's text index
+  (created by ``ensure_indexes`` from ``TEXT_INDEXES``) and ranks by
+  ``textScore``. ``$text`` matches documents with any of the words, so
+  the matches are post-filtered to those containing every word, as
+  ``SearchFilter`` requires. It only matches whole words (the index does
+  no stemming), so ``?search=run`` does not find "Running"; when it matches
+  nothing, and without the index, it falls back to ``SearchFilter``.
+  Used by activities.
+* ``UserIndex`` is an in-process inverted index over user names, aliases
+  and emails with prefix and trigram lookups, so ``?search=thu`` finds
+  "thunderbolt" while the user is still typing. It is loaded from the
+  ``users`` table on first use and updated in place by model signals
+  (``signals.py``); writes made by other workers bump the ``user_search``
+  version counter, which makes every other process reload. When the
+  counters are process-local (``versions.shared()`` is false) those bumps
+  never arrive, so the index is also reloaded ``USER_INDEX_TTL`` seconds
+  after it was loaded.
+"""
+import bisect
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+from pymongo.errors import OperationFailure
+from rest_framework import filters
+
+from . import versions
+from .mongo import get_db
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_LIMIT = 10
+USER_INDEX_TTL = 60
+INDEX_NOT_FOUND = 27
+USER_SEARCH_VERSION = 'user_search'
+
+# Field weights of the text indexes; ``ensure_text_indexes`` creates them.
+# Users are searched through ``UserIndex`` instead.
+TEXT_INDEXES = {
+    'activities': {'user_alias': 5, 'user_name': 5, 'workout_name': 3, 'description': 1},
+}
+
+USER_FIELDS = ('_id', 'name', 'alias', 'email', 'team_id')
+USER_WEIGHTS = {'alias': 3, 'name': 2, 'email': 1}
+# Score multipliers of a whole-token, prefix and infix (trigram) match.
+EXACT, PREFIX, INFIX = 4, 2, 1
+NGRAM = 3
+
+_WORD = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    """Lowercased ``text`` with accents stripped, so "Zoë" matches "zoe"."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def tokenize(text):
+    """The words of ``text`` (split on anything that is not a letter or digit)."""
+    return _WORD.findall(normalize(text))
+
+
+def ngrams(token, size=NGRAM):
+    return {token[start:start + size] for start in range(len(token) - size + 1)}
+
+
+class UserIndex:
+    """
+    Inverted index of users for type-ahead search.
+
+    ``postings`` maps each token to ``{user_id: field weight}``; a sorted
+    vocabulary answers prefix lookups with ``bisect`` and a trigram map
+    answers substrings of at least ``NGRAM`` characters. Every query term
+    has to match (exactly, as a prefix or as a substring) for a user to be
+    returned.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._loaded = False
+        self._loaded_at = 0
+        self._reset()
+
+    def _reset(self):
+        self._users = {}
+        self._tokens = {}
+        self._postings = defaultdict(dict)
+        self._grams = defaultdict(set)
+        self._vocabulary = []
+        self._vocabulary_stale = False
+
+    # Maintenance
+
+    def _add(self, user):
+        tokens = defaultdict(int)
+        for field, weight in USER_WEIGHTS.items():
+            value = user.get(field) or ''
+            words = tokenize(value)
+            # A multi-word alias ("thunder_bolt") is also indexed whole.
+            if field == 'alias' and len(words) > 1:
+                words.append(''.join(words))
+            for word in words:
+                tokens[word] = max(tokens[word], weight)
+        self._users[user['_id']] = {name: user.get(name) for name in USER_FIELDS if name != 'email'}
+        self._tokens[user['_id']] = tokens
+        for token, weight in tokens.items():
+            if token not in self._postings:
+                self._vocabulary_stale = True
+                for gram in ngrams(token):
+                    self._grams[gram].add(token)
+            self._postings[token][user['_id']] = weight
+
+    def _remove(self, user_id):
+        self._users.pop(user_id, None)
+        for token in self._tokens.pop(user_id, {}):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(user_id, None)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary_stale = True
+                for gram in ngrams(token):
+                    self._grams[gram].discard(token)
+
+    def _load(self):
+        self._reset()
+        for user in User.objects.values(*USER_FIELDS).iterator(chunk_size=2000):
+            self._add(user)
+        self._loaded = True
+        self._loaded_at = time.monotonic()
+
+    def _current_version(self):
+        return versions.current([USER_SEARCH_VERSION])[0][0]
+
+    def _expired(self):
+        return not versions.shared() and time.monotonic() - self._loaded_at > USER_INDEX_TTL
+
+    def _ensure_fresh(self):
+        version = self._current_version()
+        if not self._loaded or version != self._version or self._expired():
+            self._load()
+            self._version = version
+
+    def update(self, user):
+        """Re-index ``user`` (a model instance or a dict of ``USER_FIELDS``) after a local write."""
+        if not isinstance(user, dict):
+            user = {name: getattr(user, name) for name in USER_FIELDS}
+        self._write(lambda: (self._remove(user['_id']), self._add(user)))
+
+    def remove(self, user_id):
+        """Drop a deleted user."""
+        self._write(lambda: self._remove(user_id))
+
+    def _write(self, change):
+        with self._lock:
+            behind = self._loaded and self._current_version() != self._version
+            versions.bump(USER_SEARCH_VERSION)
+            if self._loaded and not behind:
+                change()
+                self._version = self._current_version()
+
+    def invalidate(self):
+        """Make every process reload, e.g. after users were written with raw pymongo."""
+        versions.bump(USER_SEARCH_VERSION)
+        with self._lock:
+            self._loaded = False
+
+    # Queries
+
+    def _matching_tokens(self, term):
+        """``{token: multiplier}`` of the vocabulary entries ``term`` matches."""
+        if self._vocabulary_stale:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_stale = False
+        found = {}
+        position = bisect.bisect_left(self._vocabulary, term)
+        while position < len(self._vocabulary) and self._vocabulary[position].startswith(term):
+            token = self._vocabulary[position]
+            found[token] = EXACT if token == term else PREFIX
+            position += 1
+        if len(term) >= NGRAM:
+            candidates = None
+            for gram in ngrams(term):
+                tokens = self._grams.get(gram, set())
+                candidates = set(tokens) if candidates is None else candidates & tokens
+                if not candidates:
+                    break
+            for token in candidates or ():
+                if token not in found and term in token:
+                    found[token] = INFIX
+        return found
+
+    def _scores(self, query):
+        terms = tokenize(query)
+        if not terms:
+            return {}
+        scores = None
+        for term in terms:
+            term_scores = {}
+            for token, multiplier in self._matching_tokens(term).items():
+                for user_id, weight in self._postings[token].items():
+                    term_scores[user_id] = max(term_scores.get(user_id, 0), weight * multiplier)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {user_id: score + term_scores[user_id]
+                          for user_id, score in scores.items() if user_id in term_scores}
+            if not scores:
+                break
+        return scores
+
+    def search(self, query, limit=None):
+        """Ids of the best matches, best first (ties by alias)."""
+        with self._lock:
+            self._ensure_fresh()
+            scores = self._scores(query)
+            ranked = sorted(scores, key=lambda user_id: (
+                -scores[user_id], normalize(self._users[user_id]['alias']), user_id))
+            return ranked[:limit]
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        """The best matches as ``{_id, name, alias, team_id}`` dicts, straight from the index."""
+        with self._lock:
+            return [dict(self._users[user_id]) for user_id in self.search(query, limit)]
+
+    def __len__(self):
+        return len(self._users)
+
+
+user_index = UserIndex()
+
+
+class TextSearch:
+    """Rank by MongoDB ``$text`` score using the collection's text index."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.fields = tuple(TEXT_INDEXES[collection])
+
+    def search(self, query, limit=None):
+        """
+        Ids of the documents containing every word of ``query``, best first,
+        or ``None`` if there is no text index or none matched (partial words
+        are left to the regex search).
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return None
+        score = {'$meta': 'textScore'}
+        projection = dict.fromkeys(self.fields, 1)
+        projection['score'] = score
+        try:
+            # Built from the words alone: quotes and "-word" would change the meaning.
+            cursor = (get_db()[self.collection]
+                      .find({'$text': {'$search': ' '.join(sorted(terms))}}, projection)
+                      .sort([('score', score)]))
+            ranked = [document['_id'] for document in cursor
+                      if terms <= {word for field in self.fields for word in tokenize(document.get(field))}]
+            return ranked[:limit] or None
+        except OperationFailure as exc:
+            if exc.code != INDEX_NOT_FOUND:
+                raise
+            logger.warning('No text index on %s; run ensure_indexes. Falling back to regex search.',
+                           self.collection)
+            return None
+
+
+def text_index_name(weights):
+    return '_'.join(f'{field}_text' for field in weights)
+
+
+def ensure_text_indexes(db, dry_run=False):
+    """
+    Create the ``TEXT_INDEXES`` that are missing. A collection can only have
+    one text index, so any existing one counts. Returns ``(created, existing)``
+    lists of ``(collection, name)`` like ``indexes.ensure_indexes``.
+    """
+    created, existing = [], []
+    for collection, weights in TEXT_INDEXES.items():
+        name = text_index_name(weights)
+        present = db[collection].index_information().values()
+        if any(any(direction == 'text' for _, direction in info['key']) for info in present):
+            existing.append((collection, name))
+            continue
+        if not dry_run:
+            db[collection].create_index([(field, 'text') for field in weights], name=name,
+                                        weights=weights, background=True,
+                                        # Names and aliases are not English words:
+                                        # no stemming, no stop words.
+                                        default_language='none')
+        created.append((collection, name))
+    return created, existing
+
+
+class RankedSearchFilter(filters.SearchFilter):
+    """
+    ``SearchFilter`` answered by the view's ``search_backend``.
+
+    The ranked ids are stored on the request as ``search_ranking`` for the
+    paginator. Views without a backend, or whose backend is unavailable,
+    get ``SearchFilter``'s regex behaviour.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = ' '.join(self.get_search_terms(request))
+        backend = getattr(view, 'search_backend', None)
+        if not query or backend is None:
+            return super().filter_queryset(request, queryset, view)
+        ranked = backend.search(query)
+        if ranked is None:
+            return super().filter_queryset(request, queryset, view)
+        request.search_ranking = {pk: position for position, pk in enumerate(ranked)}
+        return queryset.filter(pk__in=ranked)
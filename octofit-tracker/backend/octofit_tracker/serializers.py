@@ -1,14 +1,19 @@
+import uuid
+
 from rest_framework import serializers
+
+from . import lookups
+from .instrumentation import TimedSerializerMixin
 from .models import Team, User, Workout, Activity, Leaderboard
 
 
-class TeamSerializer(serializers.ModelSerializer):
+class TeamSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Team
         fields = ['_id', 'name', 'description', 'created_at', 'member_count']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     profile_image = serializers.URLField(required=False, allow_blank=True)
     
     class Meta:
@@ -18,22 +23,107 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['_id', 'total_points', 'activities_completed', 'joined_at']
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Workout
         fields = ['_id', 'name', 'icon', 'unit', 'points_per_unit', 'description', 'created_at']
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ExpandableMixin:
+    """
+    ``?expand=`` support (``resolve.expand``): ``expandable`` maps a name
+    to the kind and field of the entity a row refers to.
+    """
+    expandable = {}
+
+    @classmethod
+    def reference(cls, name, row):
+        """``(kind, id)`` of the entity ``name`` in a serialized ``row``."""
+        kind, field = cls.expandable[name]
+        return kind, row.get(field)
+
+
+def new_activity_id():
+    return f'activity_{uuid.uuid4().hex}'
+
+
+class ActivitySerializer(ExpandableMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Clients send ``user_id``, ``workout_id``, ``quantity`` and
+    ``completed_at``; the user/workout copies and ``points_earned`` are
+    resolved on the server from ``lookups`` and cannot be forged.
+    """
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    expandable = {'user': ('users', 'user_id'), 'team': ('teams', 'team_id'), 'workout': ('workouts', 'workout_id')}
+
     class Meta:
         model = Activity
         fields = ['_id', 'user_id', 'user_name', 'user_alias', 'workout_id', 
                   'workout_name', 'workout_icon', 'description', 'quantity', 
                   'unit', 'points_earned', 'completed_at', 'team_id']
+        read_only_fields = ['user_name', 'user_alias', 'workout_name', 'workout_icon',
+                            'unit', 'points_earned', 'team_id']
+        extra_kwargs = {'_id': {'required': False}, 'quantity': {'min_value': 1}}
 
+    def validate(self, attrs):
+        if not {'user_id', 'workout_id', 'quantity'} & attrs.keys():
+            return attrs
+        user_id = attrs.get('user_id', getattr(self.instance, 'user_id', None))
+        workout_id = attrs.get('workout_id', getattr(self.instance, 'workout_id', None))
+        quantity = attrs.get('quantity', getattr(self.instance, 'quantity', None))
+        user = lookups.get_user(user_id)
+        workout = lookups.get_workout(workout_id)
+        errors = {}
+        if user is None:
+            errors['user_id'] = 'Unknown user.'
+        if workout is None:
+            errors['workout_id'] = 'Unknown workout.'
+        if errors:
+            raise serializers.ValidationError(errors)
+        # An activity keeps the team it was logged for unless it moves to another user.
+        if self.instance is None or user_id != self.instance.user_id:
+            team_id = user['team_id']
+        else:
+            team_id = self.instance.team_id
+        attrs.update(
+            user_name=user['name'],
+            user_alias=user['alias'],
+            team_id=team_id,
+            workout_name=workout['name'],
+            workout_icon=workout['icon'],
+            unit=workout['unit'],
+            points_earned=quantity * workout['points_per_unit'],
+        )
+        return attrs
+
+    def create(self, validated_data):
+        validated_data.setdefault('_id', new_activity_id())
+        return super().create(validated_data)
+
+
+class ActivityBulkSerializer(ActivitySerializer):
+    """
+    One item of a bulk upload. The id is not checked for uniqueness here
+    (duplicates are reported by the insert) and users/workouts are resolved
+    for the whole batch at once by ``ingest.build_documents``.
+    """
+    _id = serializers.CharField(max_length=100, required=False)
+
+    def validate(self, attrs):
+        return attrs
+
+
+class LeaderboardSerializer(ExpandableMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    expandable = {'user': ('users', 'entity_id'), 'team': ('teams', 'team_id')}
 
-class LeaderboardSerializer(serializers.ModelSerializer):
     class Meta:
         model = Leaderboard
         fields = ['_id', 'type', 'rank', 'entity_id', 'entity_name', 'entity_alias',
                   'team_id', 'total_points', 'activities_count', 'member_count', 'updated_at']
+
+    @classmethod
+    def reference(cls, name, row):
+        # Team rows are about the team itself and have no user.
+        if row.get('type') == 'team':
+            return ('teams', row.get('entity_id')) if name == 'team' else (None, None)
+        return super().reference(name, row)
@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -81,17 +82,131 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# The client options are shared by the ORM and the raw pymongo code (mongo.py).
 DATABASES = {
     'default': {
-        'ENGINE': 'djongo',
+        'ENGINE': 'octofit_tracker.mongo_backend',
         'NAME': 'octofit_db',
         'ENFORCE_SCHEMA': False,
         'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
+            'host': os.environ.get('OCTOFIT_MONGO_HOST', 'localhost'),
+            'port': int(os.environ.get('OCTOFIT_MONGO_PORT', 27017)),
+            'appname': 'octofit-tracker',
+            'maxPoolSize': int(os.environ.get('OCTOFIT_MONGO_MAX_POOL_SIZE', 100)),
+            'minPoolSize': int(os.environ.get('OCTOFIT_MONGO_MIN_POOL_SIZE', 5)),
+            'maxIdleTimeMS': int(os.environ.get('OCTOFIT_MONGO_MAX_IDLE_MS', 300000)),
+            'waitQueueTimeoutMS': int(os.environ.get('OCTOFIT_MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+            'connectTimeoutMS': int(os.environ.get('OCTOFIT_MONGO_CONNECT_TIMEOUT_MS', 5000)),
+            'serverSelectionTimeoutMS': int(os.environ.get('OCTOFIT_MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+            'socketTimeoutMS': int(os.environ.get('OCTOFIT_MONGO_SOCKET_TIMEOUT_MS', 30000)),
+            # Only the compressors whose module is installed are offered.
+            'compressors': os.environ.get('OCTOFIT_MONGO_COMPRESSORS', 'zstd,snappy'),
+            'readPreference': os.environ.get('OCTOFIT_MONGO_READ_PREFERENCE', 'primary'),
+            'w': os.environ.get('OCTOFIT_MONGO_WRITE_CONCERN'),
+            'retryWrites': True,
         }
     }
 }
+# Read-only API actions are served from secondaries through this alias
+# (octofit_tracker/replicas.py). MongoDB requires maxStalenessSeconds >= 90.
+# The test runner (TEST_RUNNER below) turns routing off, since tests only
+# use the default database; the routing tests turn it on against fakes.
+READ_REPLICA_ALIAS = 'replica'
+DATABASES['replica'] = dict(
+    DATABASES['default'],
+    CLIENT=dict(
+        DATABASES['default']['CLIENT'],
+        readPreference=os.environ.get('OCTOFIT_MONGO_REPLICA_READ_PREFERENCE', 'secondaryPreferred'),
+        maxStalenessSeconds=int(os.environ.get('OCTOFIT_MONGO_MAX_STALENESS_SECONDS', 90)),
+    ),
+    TEST={'MIRROR': 'default'},
+)
+DATABASE_ROUTERS = ['octofit_tracker.replicas.ReplicaRouter']
+TEST_RUNNER = 'octofit_tracker.tests.runner.TestRunner'
+# After a write the client reads from the primary for this long (read-your-writes);
+# secondary reads of collections written this recently are not cached.
+REPLICA_STICKY_SECONDS = float(os.environ.get('OCTOFIT_REPLICA_STICKY_SECONDS', 10))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('OCTOFIT_REPLICA_MAX_LAG_SECONDS', 10))
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The 'responses' cache holds rendered data of read-heavy endpoints (see
+# octofit_tracker/cache.py); 'versions' holds the per-collection write
+# counters behind cache invalidation and ETags (octofit_tracker/versions.py).
+# Set OCTOFIT_REDIS_URL to share both between workers through any
+# Redis-protocol server.
+
+RESPONSE_CACHE_TIMEOUT = 30
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-responses',
+        'TIMEOUT': RESPONSE_CACHE_TIMEOUT,
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-versions',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# ETags need counters every worker agrees on. Unset, they are sent unless
+# 'versions' is process-local (LocMemCache); set True for a single-process
+# server to keep them with the default cache.
+VERSIONS_SHARED = None
+
+if os.environ.get('OCTOFIT_REDIS_URL'):
+    for alias, timeout in (('responses', RESPONSE_CACHE_TIMEOUT), ('versions', None)):
+        CACHES[alias] = {
+            'BACKEND': 'octofit_tracker.cache.RedisProtocolCache',
+            'LOCATION': os.environ['OCTOFIT_REDIS_URL'],
+            'TIMEOUT': timeout,
+            'KEY_PREFIX': alias,
+        }
+
+# Push channel (octofit_tracker/push.py, served at /api/stream/ under ASGI).
+# With several workers, set OCTOFIT_REDIS_URL so events published by one
+# worker reach the subscribers connected to the others.
+PUSH_BROKER = 'octofit_tracker.push.LocalBroker'
+PUSH_BROKER_OPTIONS = {}
+if os.environ.get('OCTOFIT_REDIS_URL'):
+    PUSH_BROKER = 'octofit_tracker.push.RedisBroker'
+    PUSH_BROKER_OPTIONS = {'url': os.environ['OCTOFIT_REDIS_URL']}
+# Events a subscriber may fall behind by before it is dropped.
+PUSH_QUEUE_SIZE = 256
+PUSH_HEARTBEAT_SECONDS = 15
+
+# Write-behind user counters (octofit_tracker/counters.py)
+COUNTER_WRITE_BEHIND = os.environ.get('OCTOFIT_COUNTER_WRITE_BEHIND', '1') == '1'
+COUNTER_SHARDS = 16
+COUNTER_FLUSH_SIZE = 500
+COUNTER_FLUSH_INTERVAL = 1.0
+COUNTER_JOURNAL_DIR = os.environ.get('OCTOFIT_COUNTER_JOURNAL_DIR', str(BASE_DIR / 'var' / 'counters'))
+COUNTER_JOURNAL_FSYNC = False
+
+# Threads rewriting activity copies of renamed users/workouts (denormalization.py)
+DENORMALIZATION_WORKERS = 2
+
+# Ended days/weeks/months are ranked live for this long before their
+# leaderboards are frozen (periods.py), so late uploads still count.
+PERIOD_FREEZE_DELAY_HOURS = int(os.environ.get('OCTOFIT_PERIOD_FREEZE_DELAY_HOURS', 24))
+
+# Activities older than this are moved to the cold tier (tiering.py)
+ACTIVITY_HOT_DAYS = int(os.environ.get('OCTOFIT_ACTIVITY_HOT_DAYS', 90))
+
+# In-process cache of /api/resolve/ and ?expand= entities (resolve.py)
+RESOLVE_TTL = 30
+RESOLVE_MAX_ENTRIES = 10000
+
+# Columnar archive of old activities (archive.py, archive_analytics.py)
+ARCHIVE_DIR = os.environ.get('OCTOFIT_ARCHIVE_DIR', str(BASE_DIR / 'var' / 'archive'))
 
 
 # Password validation
@@ -135,6 +250,42 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST Framework
+# Lists are paged by sort key (keyset) instead of returning whole collections;
+# pass ?stream=true to stream the full result as a JSON array instead.
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+    # Uses orjson when installed (pip install orjson), stdlib json otherwise.
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.TimedORJSONRenderer',
+        'octofit_tracker.renderers.TimedBrowsableAPIRenderer',
+    ],
+}
+
+# Request instrumentation (octofit_tracker/instrumentation.py): Server-Timing
+# headers, a JSON log line for a sampled fraction of requests, and the full
+# query list of requests slower than INSTRUMENTATION_SLOW_REQUEST_MS (unset
+# to disable). Aggregates are served at /api/_metrics, to staff users and to
+# the addresses in INSTRUMENTATION_METRICS_IPS (the Prometheus scraper).
+INSTRUMENTATION_SERVER_TIMING = True
+INSTRUMENTATION_LOG_SAMPLE_RATE = float(os.environ.get('OCTOFIT_LOG_SAMPLE_RATE', '0.01'))
+INSTRUMENTATION_SLOW_REQUEST_MS = (int(os.environ['OCTOFIT_SLOW_REQUEST_MS'])
+                                   if os.environ.get('OCTOFIT_SLOW_REQUEST_MS') else None)
+INSTRUMENTATION_METRICS_IPS = [address.strip() for address in
+                               os.environ.get('OCTOFIT_METRICS_IPS', '127.0.0.1,::1').split(',') if address.strip()]
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'octofit_tracker.requests': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # CORS Settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_METHODS = [
@@ -155,4 +306,7 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'x-octofit-primary-until',
 ]
+# The read-your-writes token (octofit_tracker/replicas.py)
+CORS_EXPOSE_HEADERS = ['x-octofit-primary-until']
@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import lookups, resolve
+from .denormalization import COPIES, copied_values, propagation_queue
+from .mongo import get_db
+from .search import user_index
+from .models import Activity, ArchivedActivity, Leaderboard, Team, User, Workout
+from .versions import bump
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_save, sender=ArchivedActivity)
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Team)
+@receiver(post_save, sender=Workout)
+@receiver(post_save, sender=Leaderboard)
+@receiver(post_delete, sender=Activity)
+@receiver(post_delete, sender=ArchivedActivity)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Team)
+@receiver(post_delete, sender=Workout)
+@receiver(post_delete, sender=Leaderboard)
+def bump_collection_version(sender, **kwargs):
+    """Record the write so cached responses and ETags for it are invalidated."""
+    bump(sender._meta.db_table)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    lookups.forget_user(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, **kwargs):
+    user_index.update(instance)
+
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    user_index.remove(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Team)
+@receiver(post_save, sender=Workout)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Team)
+@receiver(post_delete, sender=Workout)
+def forget_resolved(sender, instance, **kwargs):
+    resolve.forget(sender._meta.db_table, instance.pk)
+
+
+@receiver(post_save, sender=Workout)
+@receiver(post_delete, sender=Workout)
+def forget_cached_workouts(sender, **kwargs):
+    lookups.forget_workouts()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Workout)
+def propagate_copied_fields(sender, instance, created, update_fields=None, **kwargs):
+    """Queue rewriting the activities' copies of the saved user's or workout's fields."""
+    source = sender._meta.db_table
+    if created or (update_fields is not None and not set(update_fields) & set(COPIES[source][1].values())):
+        return
+    values = copied_values(source, instance)
+    transaction.on_commit(lambda: propagation_queue.submit(source, instance.pk, values, get_db()))
@@ -0,0 +1,282 @@
+"""
+Synthetic OctoFit data at configurable scale, for ``populate_db``.
+
+Activities are generated in fixed-size chunks, each from its own seeded
+RNG, by a pool of worker threads that insert them with unordered
+``insert_many`` calls; at most ``2 * workers`` chunks are in flight, so
+memory does not grow with the number of activities. Which user logs an
+activity follows a power law (a few very active users, a long tail), and
+the per-user totals are accumulated as chunks complete. Users, teams and
+both leaderboards are then written in one pass over those totals.
+
+The same ``seed`` always produces the same data, whatever the number of
+workers.
+"""
+import random
+from array import array
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+DEFAULT_EXPONENT = 1.1
+DEFAULT_CHUNK_SIZE = 10000
+
+TEAMS = [
+    {'_id': 'team_marvel', 'name': 'Team Marvel', 'description': 'Earth\'s Mightiest Heroes'},
+    {'_id': 'team_dc', 'name': 'Team DC', 'description': 'Justice League United'},
+]
+
+# (name, alias, email, index into TEAMS)
+HEROES = [
+    ('Tony Stark', 'Iron Man', 'ironman@marvel.com', 0),
+    ('Steve Rogers', 'Captain America', 'cap@marvel.com', 0),
+    ('Bruce Banner', 'Hulk', 'hulk@marvel.com', 0),
+    ('Natasha Romanoff', 'Black Widow', 'blackwidow@marvel.com', 0),
+    ('Thor Odinson', 'Thor', 'thor@marvel.com', 0),
+    ('Peter Parker', 'Spider-Man', 'spidey@marvel.com', 0),
+    ('Clark Kent', 'Superman', 'superman@dc.com', 1),
+    ('Bruce Wayne', 'Batman', 'batman@dc.com', 1),
+    ('Diana Prince', 'Wonder Woman', 'wonderwoman@dc.com', 1),
+    ('Barry Allen', 'Flash', 'flash@dc.com', 1),
+    ('Arthur Curry', 'Aquaman', 'aquaman@dc.com', 1),
+    ('Hal Jordan', 'Green Lantern', 'greenlantern@dc.com', 1),
+]
+
+WORKOUTS = [
+    {'name': 'Running', 'icon': '🏃', 'unit': 'km', 'points_per_unit': 10},
+    {'name': 'Cycling', 'icon': '🚴', 'unit': 'km', 'points_per_unit': 5},
+    {'name': 'Swimming', 'icon': '🏊', 'unit': 'laps', 'points_per_unit': 15},
+    {'name': 'Push-ups', 'icon': '💪', 'unit': 'reps', 'points_per_unit': 1},
+    {'name': 'Weightlifting', 'icon': '🏋️', 'unit': 'kg', 'points_per_unit': 2},
+    {'name': 'Yoga', 'icon': '🧘', 'unit': 'minutes', 'points_per_unit': 5},
+    {'name': 'Boxing', 'icon': '🥊', 'unit': 'rounds', 'points_per_unit': 20},
+]
+
+DESCRIPTIONS = {
+    'Running': ['Morning run in the park', 'Evening jog', 'Sprint training', 'Marathon prep'],
+    'Cycling': ['Bike to work', 'Mountain biking', 'Road cycling', 'City tour'],
+    'Swimming': ['Pool training', 'Open water swim', 'Lap practice', 'Endurance swim'],
+    'Push-ups': ['Daily routine', 'Chest workout', 'Upper body training', 'Challenge completed'],
+    'Weightlifting': ['Leg day', 'Arm workout', 'Back exercises', 'Full body workout'],
+    'Yoga': ['Morning stretch', 'Meditation session', 'Flexibility training', 'Relaxation'],
+    'Boxing': ['Training session', 'Sparring practice', 'Heavy bag workout', 'Speed training'],
+}
+
+
+def team_id(index):
+    return TEAMS[index]['_id'] if index < len(TEAMS) else f'team_{index + 1}'
+
+
+def team_doc(index, now):
+    if index < len(TEAMS):
+        team = dict(TEAMS[index])
+    else:
+        team = {'_id': team_id(index), 'name': f'Team {index + 1}', 'description': f'Squad #{index + 1}'}
+    team.update(created_at=now, member_count=0)
+    return team
+
+
+def user_profile(index, teams):
+    """``(user_id, name, alias, email, team_index)`` of the ``index``-th user."""
+    if index < len(HEROES):
+        name, alias, email, team = HEROES[index]
+        if team >= teams:
+            team = index % teams
+    else:
+        name, alias, email = f'Athlete {index + 1}', f'Recruit {index + 1}', f'user{index + 1}@octofit.example'
+        team = index % teams
+    return f'user_{index + 1}', name, alias, email, team
+
+
+def workout_docs(now):
+    workouts = []
+    for index, workout in enumerate(WORKOUTS, start=1):
+        workouts.append(dict(workout, _id=f'workout_{index}',
+                             description=f'{workout["name"]} exercise', created_at=now))
+    return workouts
+
+
+def user_weights(users, exponent=DEFAULT_EXPONENT):
+    """Cumulative Zipf weights: user ``i`` is picked in proportion to ``1 / (i + 1) ** exponent``."""
+    return array('d', accumulate(1.0 / (rank ** exponent) for rank in range(1, users + 1)))
+
+
+class ChunkGenerator:
+    """Builds activity chunk ``n`` from its own RNG, seeded by ``(seed, n)``."""
+
+    def __init__(self, seed, users, teams, workouts, cum_weights, now, days, chunk_size):
+        self.seed = seed
+        self.profiles = [user_profile(index, teams) for index in range(min(users, len(HEROES)))]
+        self.users = users
+        self.teams = teams
+        self.workouts = workouts
+        self.cum_weights = cum_weights
+        self.now = now
+        self.span = days * 86400
+        self.chunk_size = chunk_size
+
+    def _profile(self, index):
+        return self.profiles[index] if index < len(self.profiles) else user_profile(index, self.teams)
+
+    def __call__(self, number, count):
+        """``(documents, {user_index: (points, activities)})`` for chunk ``number``."""
+        # rng.random() with int() is several times faster than randrange()
+        # and choice(), which dominate the cost of a chunk otherwise.
+        uniform = random.Random(f'{self.seed}:{number}').random
+        total = self.cum_weights[-1]
+        hi = len(self.cum_weights) - 1
+        workouts = len(self.workouts)
+        documents, deltas = [], {}
+        first = number * self.chunk_size
+        for offset in range(count):
+            user = bisect(self.cum_weights, uniform() * total, 0, hi)
+            user_id, name, alias, _email, team = self._profile(user)
+            workout = self.workouts[int(uniform() * workouts)]
+            descriptions = DESCRIPTIONS.get(workout['name'], [workout['name']])
+            quantity = 1 + int(uniform() * 50)
+            points = quantity * workout['points_per_unit']
+            documents.append({
+                '_id': f'activity_{first + offset + 1}',
+                'user_id': user_id,
+                'user_name': name,
+                'user_alias': alias,
+                'workout_id': workout['_id'],
+                'workout_name': workout['name'],
+                'workout_icon': workout['icon'],
+                'description': descriptions[int(uniform() * len(descriptions))],
+                'quantity': quantity,
+                'unit': workout['unit'],
+                'points_earned': points,
+                'completed_at': self.now - timedelta(seconds=int(uniform() * self.span)),
+                'team_id': team_id(team),
+            })
+            user_points, user_count = deltas.get(user, (0, 0))
+            deltas[user] = (user_points + points, user_count + 1)
+        return documents, deltas
+
+
+def _competition_ranks(order, points):
+    """Yield ``(rank, index)`` for ``order`` (sorted by points, best first)."""
+    rank, previous = 0, None
+    for position, index in enumerate(order, start=1):
+        if points[index] != previous:
+            rank, previous = position, points[index]
+        yield rank, index
+
+
+def _insert_chunks(collection, documents, chunk_size):
+    chunk = []
+    for document in documents:
+        chunk.append(document)
+        if len(chunk) >= chunk_size:
+            collection.insert_many(chunk, ordered=False)
+            chunk = []
+    if chunk:
+        collection.insert_many(chunk, ordered=False)
+
+
+def populate(db, users=12, teams=2, activities=100, seed=None, days=30, workers=4,
+             chunk_size=DEFAULT_CHUNK_SIZE, exponent=DEFAULT_EXPONENT, progress=None):
+    """
+    Generate and insert a full dataset into ``db``, whose collections are
+    expected to be empty. Returns a dict of per-collection counts.
+    """
+    if users < 1 or teams < 1:
+        raise ValueError('At least one user and one team are required')
+    now = datetime.now()
+    workouts = workout_docs(now)
+    db.workouts.insert_many(workouts)
+
+    points = array('q', bytes(8 * users))
+    counts = array('q', bytes(8 * users))
+    generate = ChunkGenerator(seed, users, teams, workouts, user_weights(users, exponent),
+                              now, days, chunk_size)
+
+    def load(number):
+        count = min(chunk_size, activities - number * chunk_size)
+        documents, deltas = generate(number, count)
+        db.activities.insert_many(documents, ordered=False)
+        return deltas
+
+    chunks = (activities + chunk_size - 1) // chunk_size
+    inserted = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for number in range(chunks):
+            pending.append(pool.submit(load, number))
+            if len(pending) >= 2 * workers or number == chunks - 1:
+                for future in pending:
+                    for user, (user_points, user_count) in future.result().items():
+                        points[user] += user_points
+                        counts[user] += user_count
+                        inserted += user_count
+                    if progress:
+                        progress('activities', inserted)
+                pending = []
+
+    team_points = array('q', bytes(8 * teams))
+    team_members = array('q', bytes(8 * teams))
+    user_rng = random.Random(f'{seed}:users')
+
+    def user_documents():
+        for index in range(users):
+            user_id, name, alias, email, team = user_profile(index, teams)
+            team_points[team] += points[index]
+            team_members[team] += 1
+            yield {
+                '_id': user_id,
+                'name': name,
+                'alias': alias,
+                'email': email,
+                'team_id': team_id(team),
+                'total_points': points[index],
+                'activities_completed': counts[index],
+                'joined_at': now - timedelta(days=user_rng.randint(1, 90)),
+                'profile_image': f'https://api.dicebear.com/7.x/avataaars/svg?seed={alias}',
+            }
+
+    _insert_chunks(db.users, user_documents(), chunk_size)
+    if progress:
+        progress('users', users)
+    db.teams.insert_many([dict(team_doc(index, now), member_count=team_members[index])
+                          for index in range(teams)])
+
+    def leaderboard_documents():
+        order = sorted(range(users), key=lambda index: (-points[index], index))
+        for rank, index in _competition_ranks(order, points):
+            user_id, name, alias, _email, team = user_profile(index, teams)
+            yield {
+                '_id': f'leaderboard_individual_{user_id}',
+                'type': 'individual',
+                'rank': rank,
+                'entity_id': user_id,
+                'entity_name': name,
+                'entity_alias': alias,
+                'team_id': team_id(team),
+                'total_points': points[index],
+                'activities_count': counts[index],
+                'updated_at': now,
+            }
+        order = sorted(range(teams), key=lambda index: (-team_points[index], index))
+        for rank, index in _competition_ranks(order, team_points):
+            team = team_doc(index, now)
+            yield {
+                '_id': f'leaderboard_team_{team["_id"]}',
+                'type': 'team',
+                'rank': rank,
+                'entity_id': team['_id'],
+                'entity_name': team['name'],
+                'total_points': team_points[index],
+                'member_count': team_members[index],
+                'updated_at': now,
+            }
+
+    _insert_chunks(db.leaderboard, leaderboard_documents(), chunk_size)
+    return {
+        'teams': teams,
+        'users': users,
+        'workouts': len(workouts),
+        'activities': inserted,
+        'leaderboard': users + teams,
+    }
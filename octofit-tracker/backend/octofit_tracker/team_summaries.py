@@ -0,0 +1,180 @@
+"""
+Precomputed per-team summaries for the team dashboard.
+
+``team_summaries`` holds one document per team, maintained on every
+activity write::
+
+    {_id: team_id, points, activities, quantity,
+     workouts: {workout_id: {name, icon, unit, points, activities, quantity}},
+     recent: [the RECENT_SIZE most recent activities, newest first]}
+
+New activities are ``$push``-ed into ``recent`` with ``$sort``/``$slice``,
+so the list stays bounded without reading it. When activities are removed
+or changed, the affected teams' lists are re-read from the ``activities``
+index instead, which is a bounded query too.
+
+``dashboard()`` assembles the team page from the summary, the team's top
+members (users keep their own totals) and the team's leaderboard row: a
+handful of index lookups however many activities the team has logged.
+"""
+from collections import OrderedDict, defaultdict
+
+from django.utils import timezone
+from pymongo import ReplaceOne, UpdateOne
+
+from .counters import counter_buffer
+from .fast_serializers import compile_serializer
+from .mongo import get_db
+from .rollups import to_utc_naive
+from .serializers import ActivitySerializer, TeamSerializer, UserSerializer
+from .tiering import both_tiers
+from .versions import bump
+
+COLLECTION = 'team_summaries'
+RECENT_SIZE = 20
+DEFAULT_MEMBERS = 25
+MAX_MEMBERS = 200
+STAT_FIELDS = ('points', 'activities', 'quantity')
+ACTIVITY_FIELDS = ('_id', 'user_id', 'user_name', 'user_alias', 'workout_id', 'workout_name', 'workout_icon',
+                   'description', 'quantity', 'unit', 'points_earned', 'completed_at', 'team_id')
+RECENT_SORT = [('completed_at', -1), ('_id', 1)]
+MEMBER_SORT = [('total_points', -1), ('_id', 1)]
+
+
+def activity_document(activity):
+    """The stored fields of an activity, from a model instance or a raw document."""
+    if isinstance(activity, dict):
+        document = {name: activity.get(name) for name in ACTIVITY_FIELDS}
+    else:
+        document = {name: getattr(activity, name, None) for name in ACTIVITY_FIELDS}
+    if document['completed_at'] is not None:
+        document['completed_at'] = to_utc_naive(document['completed_at'])
+    return document
+
+
+def _recent(db, team_id):
+    return list(db.activities.find({'team_id': team_id}, {name: 1 for name in ACTIVITY_FIELDS})
+                .sort(RECENT_SORT).limit(RECENT_SIZE))
+
+
+def apply(added=(), removed=(), db=None):
+    """
+    Fold activity writes into the team summaries.
+
+    ``added`` activities are counted and pushed onto ``recent``;
+    ``removed`` ones (deletions, and the previous version of an update) are
+    subtracted, and the recent lists of every team touched are re-read,
+    since a removed entry has to be replaced by an older one.
+    """
+    increments = OrderedDict()
+    workouts = defaultdict(dict)
+    pushed = defaultdict(list)
+    for sign, activities in ((1, added), (-1, removed)):
+        for activity in activities:
+            document = activity_document(activity)
+            team_id = document['team_id']
+            if not team_id:
+                continue
+            inc = increments.setdefault(team_id, defaultdict(int))
+            prefix = f"workouts.{document['workout_id']}."
+            for name, value in (('points', document['points_earned']), ('activities', 1),
+                                ('quantity', document['quantity'])):
+                inc[name] += sign * (value or 0)
+                inc[prefix + name] += sign * (value or 0)
+            if sign > 0:
+                workouts[team_id].update({
+                    prefix + 'name': document['workout_name'],
+                    prefix + 'icon': document['workout_icon'],
+                    prefix + 'unit': document['unit'],
+                })
+                pushed[team_id].append(document)
+    if not increments:
+        return
+    db = db if db is not None else get_db()
+    now = timezone.now()
+    requests = []
+    for team_id, inc in increments.items():
+        update = {'$inc': dict(inc), '$set': dict(workouts[team_id], updated_at=now)}
+        if pushed[team_id] and not removed:
+            update['$push'] = {'recent': {'$each': pushed[team_id], '$sort': dict(RECENT_SORT),
+                                          '$slice': RECENT_SIZE}}
+        requests.append(UpdateOne({'_id': team_id}, update, upsert=True))
+    db[COLLECTION].bulk_write(requests, ordered=False)
+    if removed:
+        for team_id in increments:
+            db[COLLECTION].update_one({'_id': team_id}, {'$set': {'recent': _recent(db, team_id)}})
+    bump(COLLECTION)
+
+
+def rebuild(db=None, teams=None):
+    """
+    Recompute team summaries from the activities of both tiers: every
+    team's, or only those of the ``teams`` ids. Returns the number of teams.
+    """
+    db = db if db is not None else get_db()
+    scope = {'$nin': [None, '']} if teams is None else {'$in': [team for team in teams if team]}
+    summaries = OrderedDict()
+    rows = db.activities.aggregate(both_tiers({'team_id': scope}) + [
+        {'$group': {
+            '_id': {'team_id': '$team_id', 'workout_id': '$workout_id'},
+            'name': {'$first': '$workout_name'},
+            'icon': {'$first': '$workout_icon'},
+            'unit': {'$first': '$unit'},
+            'points': {'$sum': '$points_earned'},
+            'activities': {'$sum': 1},
+            'quantity': {'$sum': '$quantity'},
+        }},
+    ], allowDiskUse=True)
+    for row in rows:
+        team_id, workout_id = row['_id']['team_id'], row['_id']['workout_id']
+        summary = summaries.setdefault(team_id, dict({name: 0 for name in STAT_FIELDS}, workouts={}))
+        for name in STAT_FIELDS:
+            summary[name] += row[name]
+        summary['workouts'][workout_id] = {name: row[name] for name in ('name', 'icon', 'unit') + STAT_FIELDS}
+    now = timezone.now()
+    requests = [
+        ReplaceOne({'_id': team_id}, dict(summary, _id=team_id, recent=_recent(db, team_id), updated_at=now),
+                   upsert=True)
+        for team_id, summary in summaries.items()
+    ]
+    stale = {'$nin': list(summaries)}
+    db[COLLECTION].delete_many({'_id': stale if teams is None else dict(stale, **{'$in': scope['$in']})})
+    if requests:
+        db[COLLECTION].bulk_write(requests, ordered=False)
+    bump(COLLECTION)
+    return len(summaries)
+
+
+def build_dashboard(team, summary, members, standing):
+    """The dashboard payload from the raw team, summary, member and leaderboard documents."""
+    summary = summary or {}
+    workouts = [
+        dict(workout_id=workout_id, **{name: stats.get(name) for name in ('name', 'icon', 'unit') + STAT_FIELDS})
+        for workout_id, stats in (summary.get('workouts') or {}).items()
+        if stats.get('activities')
+    ]
+    workouts.sort(key=lambda workout: (-(workout['points'] or 0), workout['workout_id']))
+    members = counter_buffer.merge('users', list(members))
+    members.sort(key=lambda member: (-(member.get('total_points') or 0), member['_id']))
+    return OrderedDict([
+        ('team', compile_serializer(TeamSerializer).convert_document(team)),
+        ('rank', standing.get('rank') if standing else None),
+        ('totals', {name: summary.get(name, 0) for name in STAT_FIELDS}),
+        ('members', compile_serializer(UserSerializer).many_documents(members)),
+        ('workouts', workouts),
+        ('recent_activities', compile_serializer(ActivitySerializer).many_documents(summary.get('recent', []))),
+    ])
+
+
+def dashboard(team_id, members=DEFAULT_MEMBERS, db=None):
+    """The dashboard of ``team_id``, or ``None`` if there is no such team."""
+    db = db if db is not None else get_db()
+    team = db.teams.find_one({'_id': team_id})
+    if team is None:
+        return None
+    return build_dashboard(
+        team,
+        db[COLLECTION].find_one({'_id': team_id}),
+        list(db.users.find({'team_id': team_id}).sort(MEMBER_SORT).limit(members)),
+        db.leaderboard.find_one({'type': 'team', 'entity_id': team_id}, {'rank': 1}),
+    )
@@ -0,0 +1,18 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the suite with replica routing off: only the default test database
+    is set up. ``ReplicaRoutingTest`` turns routing back on against fakes.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._no_replica = override_settings(READ_REPLICA_ALIAS=None)
+        self._no_replica.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._no_replica.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,26 @@
+"""
+In-process fakes of MongoDB, motor and Redis, and the test base they share.
+"""
+from unittest import mock
+
+from .fake_mongo import FakeDatabase
+
+
+class FakeDatabaseMixin:
+    """
+    Gives each test a fresh ``FakeDatabase`` as ``self.db`` and patches it
+    over ``get_db`` in every module named in ``db_modules``.
+    """
+    db_modules = ()
+
+    def setUp(self):
+        super().setUp()
+        self.db = FakeDatabase()
+        for module in self.db_modules:
+            self.patch(f'octofit_tracker.{module}.get_db', return_value=self.db)
+
+    def patch(self, target, *args, **kwargs):
+        """``mock.patch`` ``target`` for the rest of the test."""
+        patcher = mock.patch(target, *args, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
@@ -0,0 +1,627 @@
+"""
+In-process stand-in for the parts of pymongo this project uses.
+
+``FakeDatabase`` mirrors ``pymongo.database.Database`` closely enough to run
+the aggregation pipelines, range updates and bulk writes in this package
+without a running ``mongod``. It is intentionally small: only the query
+operators, update operators, pipeline stages and expressions the app
+actually emits are implemented, and anything else raises
+``NotImplementedError`` so a test fails loudly instead of passing on a
+silently-wrong result.
+"""
+import copy
+import re
+import threading
+from collections import OrderedDict
+
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+
+_MISSING = object()
+
+
+def _get(document, path):
+    value = document
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list) and part.isdigit():
+            index = int(part)
+            value = value[index] if index < len(value) else _MISSING
+        elif isinstance(value, list):
+            value = [item[part] for item in value if isinstance(item, dict) and part in item]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _set(document, path, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _sort_key(value):
+    # Order across BSON types the way MongoDB does for the types we store:
+    # missing/None < numbers < strings < everything else.
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (4, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, value)
+
+
+def _compare(op, actual, expected):
+    if actual is _MISSING or actual is None or expected is None:
+        return False
+    try:
+        return op(actual, expected)
+    except TypeError:
+        return False
+
+
+_QUERY_OPERATORS = {
+    '$gt': lambda a, e: _compare(lambda x, y: x > y, a, e),
+    '$gte': lambda a, e: _compare(lambda x, y: x >= y, a, e),
+    '$lt': lambda a, e: _compare(lambda x, y: x < y, a, e),
+    '$lte': lambda a, e: _compare(lambda x, y: x <= y, a, e),
+    '$eq': lambda a, e: _equals(a, e),
+    '$ne': lambda a, e: not _equals(a, e),
+    '$in': lambda a, e: any(_equals(a, item) for item in e),
+    '$nin': lambda a, e: not any(_equals(a, item) for item in e),
+    '$exists': lambda a, e: (a is not _MISSING) == bool(e),
+}
+
+
+def _equals(actual, expected):
+    if actual is _MISSING:
+        return expected is None
+    if isinstance(actual, list) and not isinstance(expected, list):
+        return expected in actual
+    return actual == expected
+
+
+def matches(document, query):
+    """Evaluate a MongoDB query filter against ``document``."""
+    for key, condition in query.items():
+        if key == '$and':
+            if not all(matches(document, sub) for sub in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(document, sub) for sub in condition):
+                return False
+        elif key == '$nor':
+            if any(matches(document, sub) for sub in condition):
+                return False
+        elif key.startswith('$'):
+            raise NotImplementedError(f'Query operator {key}')
+        elif isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition):
+            actual = _get(document, key)
+            for op, expected in condition.items():
+                if op not in _QUERY_OPERATORS:
+                    raise NotImplementedError(f'Query operator {op}')
+                if not _QUERY_OPERATORS[op](actual, expected):
+                    return False
+        elif not _equals(_get(document, key), condition):
+            return False
+    return True
+
+
+def evaluate(expression, document):
+    """Evaluate an aggregation expression against ``document``."""
+    if isinstance(expression, str):
+        if expression.startswith('$$'):
+            raise NotImplementedError(f'Variable {expression}')
+        if expression.startswith('$'):
+            value = _get(document, expression[1:])
+            return None if value is _MISSING else value
+        return expression
+    if isinstance(expression, list):
+        return [evaluate(item, document) for item in expression]
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            op, args = next(iter(expression.items()))
+            if op.startswith('$'):
+                return _evaluate_operator(op, args, document)
+        return {key: evaluate(value, document) for key, value in expression.items()}
+    return expression
+
+
+def _evaluate_operator(op, args, document):
+    if op == '$literal':
+        return args
+    values = evaluate(args if isinstance(args, list) else [args], document)
+    if op == '$size':
+        return len(values[0] or [])
+    if op == '$first':
+        return values[0][0] if values[0] else None
+    if op == '$last':
+        return values[0][-1] if values[0] else None
+    if op == '$add':
+        return sum(value or 0 for value in values)
+    if op == '$subtract':
+        return values[0] - values[1]
+    if op == '$multiply':
+        result = 1
+        for value in values:
+            result *= value
+        return result
+    if op == '$ifNull':
+        return next((value for value in values if value is not None), None)
+    if op == '$max':
+        return max((value for value in values if value is not None), default=None)
+    if op == '$min':
+        return min((value for value in values if value is not None), default=None)
+    if op == '$eq':
+        return values[0] == values[1]
+    if op == '$cond':
+        condition, then, otherwise = values
+        return then if condition else otherwise
+    raise NotImplementedError(f'Expression operator {op}')
+
+
+def _project(document, spec):
+    inclusive = any(value not in (0, False) for key, value in spec.items() if key != '_id')
+    if not inclusive:
+        result = copy.deepcopy(document)
+        for key, value in spec.items():
+            if value in (0, False):
+                result.pop(key, None)
+        return result
+    result = OrderedDict()
+    if spec.get('_id', 1) not in (0, False) and '_id' in document:
+        result['_id'] = document['_id']
+    for key, value in spec.items():
+        if key == '_id' and value in (0, 1, True, False):
+            continue
+        if value in (1, True):
+            found = _get(document, key)
+            if found is not _MISSING:
+                _set(result, key, found)
+        else:
+            _set(result, key, evaluate(value, document))
+    return result
+
+
+def _sort(documents, spec):
+    for key, direction in reversed(list(spec.items())):
+        # {'$meta': 'textScore'} sorts best match first.
+        reverse = True if isinstance(direction, dict) else direction < 0
+        documents.sort(key=lambda doc: _sort_key(_get(doc, key)), reverse=reverse)
+    return documents
+
+
+_ACCUMULATORS = {
+    '$sum': (lambda: 0, lambda acc, value: acc + (value if isinstance(value, (int, float)) else 0)),
+    '$first': (lambda: _MISSING, lambda acc, value: value if acc is _MISSING else acc),
+    '$last': (lambda: None, lambda acc, value: value),
+    '$max': (lambda: None, lambda acc, value: value if acc is None or (value is not None and value > acc) else acc),
+    '$min': (lambda: None, lambda acc, value: value if acc is None or (value is not None and value < acc) else acc),
+    '$push': (list, lambda acc, value: acc + [value]),
+    '$addToSet': (list, lambda acc, value: acc if value in acc else acc + [value]),
+}
+
+
+def _group(documents, spec):
+    groups = OrderedDict()
+    for document in documents:
+        key = evaluate(spec['_id'], document)
+        hashable = repr(key)
+        if hashable not in groups:
+            state = OrderedDict([('_id', key)])
+            for field, accumulator in spec.items():
+                if field == '_id':
+                    continue
+                (op, _), = accumulator.items()
+                if op == '$avg':
+                    state[field] = [0, 0]
+                elif op in _ACCUMULATORS:
+                    state[field] = _ACCUMULATORS[op][0]()
+                else:
+                    raise NotImplementedError(f'Accumulator {op}')
+            groups[hashable] = state
+        state = groups[hashable]
+        for field, accumulator in spec.items():
+            if field == '_id':
+                continue
+            (op, argument), = accumulator.items()
+            value = evaluate(argument, document)
+            if op == '$avg':
+                if isinstance(value, (int, float)):
+                    state[field][0] += value
+                    state[field][1] += 1
+            else:
+                state[field] = _ACCUMULATORS[op][1](state[field], value)
+    results = []
+    for state in groups.values():
+        for field, accumulator in spec.items():
+            if field == '_id':
+                continue
+            op = next(iter(accumulator))
+            if op == '$avg':
+                total, count = state[field]
+                state[field] = total / count if count else None
+            elif state[field] is _MISSING:
+                state[field] = None
+        results.append(state)
+    return results
+
+
+def _set_window_fields(documents, spec):
+    partition_by = spec.get('partitionBy')
+    sort_by = spec.get('sortBy', {})
+    partitions = OrderedDict()
+    for document in documents:
+        key = repr(evaluate(partition_by, document)) if partition_by is not None else None
+        partitions.setdefault(key, []).append(document)
+    results = []
+    for members in partitions.values():
+        members = _sort(list(members), sort_by)
+        previous = _MISSING
+        rank = dense = 0
+        for position, document in enumerate(members, start=1):
+            current = tuple(repr(_get(document, key)) for key in sort_by)
+            if current != previous:
+                rank = position
+                dense += 1
+                previous = current
+            document = copy.deepcopy(document)
+            for field, window in spec['output'].items():
+                op = next(iter(window))
+                if op == '$rank':
+                    document[field] = rank
+                elif op == '$denseRank':
+                    document[field] = dense
+                elif op == '$documentNumber':
+                    document[field] = position
+                else:
+                    raise NotImplementedError(f'Window operator {op}')
+            results.append(document)
+    return results
+
+
+class FakeDatabase:
+    """A dict of ``FakeCollection`` objects with pymongo's attribute access."""
+
+    def __init__(self, name='fake_db'):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = FakeCollection(self, name)
+            return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_collection_names(self):
+        return [name for name, collection in self._collections.items()
+                if collection._documents or collection._created]
+
+    def create_collection(self, name, **kwargs):
+        with self._lock:
+            if name in self._collections and self[name]._created:
+                raise CollectionInvalid(f'collection {name} already exists')
+            self[name]._created = True
+            return self[name]
+
+    def drop_collection(self, name):
+        self._collections.pop(name, None)
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self._documents = documents
+
+    def sort(self, key, direction=1):
+        spec = OrderedDict(key) if isinstance(key, list) else OrderedDict([(key, direction)])
+        self._documents = _sort(self._documents, spec)
+        return self
+
+    def skip(self, count):
+        self._documents = self._documents[count:]
+        return self
+
+    def limit(self, count):
+        if count:
+            self._documents = self._documents[:count]
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __iter__(self):
+        return iter(self._documents)
+
+    def close(self):
+        pass
+
+
+class FakeCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._documents = OrderedDict()
+        self._indexes = OrderedDict([('_id_', {'key': [('_id', 1)]})])
+        self._lock = threading.RLock()
+        self._created = False
+
+    # Reads
+
+    def _text_scores(self, search):
+        """``{_id: score}`` of a ``$text`` search: weighted counts of the search words."""
+        weights = None
+        for info in self._indexes.values():
+            if any(direction == 'text' for _, direction in info['key']):
+                weights = info.get('weights') or {field: 1 for field, _ in info['key']}
+        if weights is None:
+            raise OperationFailure('text index required for $text query', code=27)
+        words = set(re.findall(r'[^\W_]+', search.lower()))
+        scores = {}
+        for doc in self._documents.values():
+            score = 0
+            for field, weight in weights.items():
+                value = _get(doc, field)
+                if isinstance(value, str):
+                    score += weight * sum(1 for word in re.findall(r'[^\W_]+', value.lower()) if word in words)
+            if score:
+                scores[doc['_id']] = score
+        return scores
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, skip=0):
+        filter = dict(filter or {})
+        text = filter.pop('$text', None)
+        with self._lock:
+            scores = self._text_scores(text['$search']) if text is not None else None
+            documents = [copy.deepcopy(doc) for doc in self._documents.values()
+                         if matches(doc, filter) and (scores is None or doc['_id'] in scores)]
+        if projection:
+            if isinstance(projection, list):
+                projection = {field: 1 for field in projection}
+            meta = [key for key, value in projection.items() if value == {'$meta': 'textScore'}]
+            projection = {key: value for key, value in projection.items() if key not in meta}
+            documents = [_project(doc, projection) if projection else doc for doc in documents]
+            for doc in documents:
+                for key in meta:
+                    doc[key] = scores[doc['_id']]
+        cursor = FakeCursor(documents)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def find_one(self, filter=None, projection=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+        return next(iter(self.find(filter, projection, limit=1, **kwargs)), None)
+
+    def count_documents(self, filter, limit=0, **kwargs):
+        count = sum(1 for doc in self._documents.values() if matches(doc, filter))
+        return min(count, limit) if limit else count
+
+    def estimated_document_count(self):
+        return len(self._documents)
+
+    def distinct(self, key, filter=None):
+        values = []
+        for doc in self._documents.values():
+            if matches(doc, filter or {}):
+                value = _get(doc, key)
+                if value is not _MISSING and value not in values:
+                    values.append(value)
+        return values
+
+    def aggregate(self, pipeline, **kwargs):
+        with self._lock:
+            documents = [copy.deepcopy(doc) for doc in self._documents.values()]
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == '$match':
+                documents = [doc for doc in documents if matches(doc, spec)]
+            elif name == '$project':
+                documents = [_project(doc, spec) for doc in documents]
+            elif name in ('$addFields', '$set'):
+                for doc in documents:
+                    for key, value in spec.items():
+                        _set(doc, key, evaluate(value, doc))
+            elif name == '$group':
+                documents = _group(documents, spec)
+            elif name == '$sort':
+                documents = _sort(documents, spec)
+            elif name == '$limit':
+                documents = documents[:spec]
+            elif name == '$skip':
+                documents = documents[spec:]
+            elif name == '$count':
+                documents = [{spec: len(documents)}] if documents else []
+            elif name == '$setWindowFields':
+                documents = _set_window_fields(documents, spec)
+            elif name == '$lookup':
+                foreign = self.database[spec['from']]
+                for doc in documents:
+                    local = _get(doc, spec['localField'])
+                    local = None if local is _MISSING else local
+                    doc[spec['as']] = list(foreign.find({spec['foreignField']: local}))
+            elif name == '$unionWith':
+                spec = {'coll': spec} if isinstance(spec, str) else spec
+                documents += list(self.database[spec['coll']].aggregate(spec.get('pipeline', [])))
+            elif name == '$unwind':
+                path = spec if isinstance(spec, str) else spec['path']
+                field = path[1:]
+                unwound = []
+                for doc in documents:
+                    for item in _get(doc, field) or []:
+                        copied = copy.deepcopy(doc)
+                        _set(copied, field, item)
+                        unwound.append(copied)
+                documents = unwound
+            else:
+                raise NotImplementedError(f'Pipeline stage {name}')
+        return FakeCursor(documents)
+
+    # Indexes (recorded only; they never change query results)
+
+    def create_index(self, keys, name=None, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        keys = [tuple(key) for key in keys]
+        name = name or '_'.join(f'{field}_{direction}' for field, direction in keys)
+        self._indexes[name] = dict(kwargs, key=keys)
+        return name
+
+    def index_information(self):
+        return copy.deepcopy(self._indexes)
+
+    def drop_index(self, name):
+        del self._indexes[name]
+
+    # Writes
+
+    def insert_one(self, document):
+        with self._lock:
+            if document.get('_id') in self._documents:
+                raise DuplicateKeyError(f'duplicate key: {document["_id"]}')
+            self._documents[document['_id']] = copy.deepcopy(document)
+
+    def insert_many(self, documents, ordered=True):
+        errors = []
+        inserted = 0
+        for index, document in enumerate(documents):
+            try:
+                self.insert_one(document)
+                inserted += 1
+            except DuplicateKeyError as exc:
+                errors.append({'index': index, 'code': 11000, 'errmsg': str(exc), 'op': document})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': inserted})
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            if isinstance(request, InsertOne):
+                self.insert_one(request._doc)
+            elif isinstance(request, (UpdateOne, UpdateMany)):
+                self._update(request._filter, request._doc, request._upsert, many=isinstance(request, UpdateMany))
+            elif isinstance(request, ReplaceOne):
+                self.replace_one(request._filter, request._doc, upsert=request._upsert)
+            elif isinstance(request, (DeleteOne, DeleteMany)):
+                self._delete(request._filter, many=isinstance(request, DeleteMany))
+            else:
+                raise NotImplementedError(type(request).__name__)
+
+    def _apply_update(self, document, update, inserting=False):
+        for op, fields in update.items():
+            for key, value in fields.items():
+                if op == '$set':
+                    _set(document, key, copy.deepcopy(value))
+                elif op == '$setOnInsert':
+                    if inserting:
+                        _set(document, key, copy.deepcopy(value))
+                elif op == '$inc':
+                    current = _get(document, key)
+                    _set(document, key, (0 if current is _MISSING else current) + value)
+                elif op == '$max':
+                    current = _get(document, key)
+                    if current is _MISSING or value > current:
+                        _set(document, key, value)
+                elif op == '$min':
+                    current = _get(document, key)
+                    if current is _MISSING or value < current:
+                        _set(document, key, value)
+                elif op == '$unset':
+                    document.pop(key, None)
+                elif op == '$push':
+                    current = _get(document, key)
+                    items = list(value['$each']) if isinstance(value, dict) and '$each' in value else [value]
+                    merged = ([] if current is _MISSING else current) + items
+                    if isinstance(value, dict) and '$sort' in value:
+                        merged = _sort(merged, OrderedDict(value['$sort']))
+                    if isinstance(value, dict) and '$slice' in value:
+                        limit = value['$slice']
+                        merged = merged[limit:] if limit < 0 else merged[:limit]
+                    _set(document, key, merged)
+                else:
+                    raise NotImplementedError(f'Update operator {op}')
+
+    def _update(self, filter, update, upsert, many):
+        with self._lock:
+            matched = [doc for doc in self._documents.values() if matches(doc, filter)]
+            if not many:
+                matched = matched[:1]
+            for doc in matched:
+                self._apply_update(doc, update)
+            if not matched and upsert:
+                document = {key: value for key, value in filter.items()
+                            if not key.startswith('$') and not isinstance(value, dict)}
+                self._apply_update(document, update, inserting=True)
+                document.setdefault('_id', f'fake_{id(document)}')
+                self._documents[document['_id']] = document
+            return len(matched)
+
+    def update_one(self, filter, update, upsert=False):
+        return _UpdateResult(self._update(filter, update, upsert, many=False))
+
+    def update_many(self, filter, update, upsert=False):
+        return _UpdateResult(self._update(filter, update, upsert, many=True))
+
+    def find_one_and_update(self, filter, update, projection=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE):
+        with self._lock:
+            before = self.find_one(filter)
+            self._update(filter, update, upsert, many=False)
+            if return_document == ReturnDocument.BEFORE:
+                return before
+            key = before['_id'] if before else filter.get('_id')
+            return self.find_one({'_id': key}, projection) if key is not None else self.find_one(filter, projection)
+
+    def replace_one(self, filter, replacement, upsert=False):
+        with self._lock:
+            existing = self.find_one(filter)
+            if existing is not None:
+                replacement = dict(replacement, _id=existing['_id'])
+                self._documents[existing['_id']] = copy.deepcopy(replacement)
+            elif upsert:
+                self.insert_one(replacement)
+            return _UpdateResult(0 if existing is None else 1)
+
+    def delete_one(self, filter):
+        return self._delete(filter, many=False)
+
+    def delete_many(self, filter):
+        return self._delete(filter, many=True)
+
+    def _delete(self, filter, many):
+        with self._lock:
+            keys = [key for key, doc in self._documents.items() if matches(doc, filter)]
+            if not many:
+                keys = keys[:1]
+            for key in keys:
+                del self._documents[key]
+            return _DeleteResult(len(keys))
+
+    def drop(self):
+        with self._lock:
+            self._documents.clear()
+
+
+class _UpdateResult:
+    def __init__(self, matched_count):
+        self.matched_count = matched_count
+        self.modified_count = matched_count
+
+
+class _DeleteResult:
+    def __init__(self, deleted_count):
+        self.deleted_count = deleted_count
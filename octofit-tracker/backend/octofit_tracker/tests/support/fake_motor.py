@@ -0,0 +1,105 @@
+"""
+In-process stand-in for the parts of motor the async views use.
+
+``FakeAsyncDatabase`` wraps a ``fake_mongo.FakeDatabase`` (so tests can
+seed it with the synchronous API) and exposes motor's coroutine methods
+and async cursors on top of it. Every operation yields to the event loop
+once before running, like a network round trip would, so concurrent
+queries interleave and ``in_flight``/``max_in_flight`` show how many were
+outstanding at once.
+"""
+import asyncio
+
+from .fake_mongo import FakeDatabase
+
+
+class FakeAsyncDatabase:
+    def __init__(self, database=None):
+        self.delegate = database if database is not None else FakeDatabase()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.operations = 0
+
+    def __getitem__(self, name):
+        return FakeAsyncCollection(self, self.delegate[name])
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    async def _run(self, function, *args, **kwargs):
+        self.in_flight += 1
+        self.operations += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0)
+            return function(*args, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+
+class FakeAsyncCursor:
+    def __init__(self, database, open_cursor):
+        self._database = database
+        self._open = open_cursor
+        self._modifiers = []
+        self._documents = None
+
+    def sort(self, key, direction=1):
+        self._modifiers.append(('sort', (key, direction)))
+        return self
+
+    def skip(self, count):
+        self._modifiers.append(('skip', (count,)))
+        return self
+
+    def limit(self, count):
+        self._modifiers.append(('limit', (count,)))
+        return self
+
+    def _fetch(self):
+        cursor = self._open()
+        for name, args in self._modifiers:
+            cursor = getattr(cursor, name)(*args)
+        return list(cursor)
+
+    async def to_list(self, length=None):
+        if self._documents is None:
+            self._documents = await self._database._run(self._fetch)
+        if not length:
+            documents, self._documents = self._documents, []
+        else:
+            documents, self._documents = self._documents[:length], self._documents[length:]
+        return documents
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._documents is None:
+            self._documents = await self._database._run(self._fetch)
+        if not self._documents:
+            raise StopAsyncIteration
+        return self._documents.pop(0)
+
+
+class FakeAsyncCollection:
+    def __init__(self, database, collection):
+        self.database = database
+        self.delegate = collection
+        self.name = collection.name
+
+    def find(self, *args, **kwargs):
+        return FakeAsyncCursor(self.database, lambda: self.delegate.find(*args, **kwargs))
+
+    def aggregate(self, pipeline, **kwargs):
+        return FakeAsyncCursor(self.database, lambda: self.delegate.aggregate(pipeline, **kwargs))
+
+    def __getattr__(self, name):
+        # find_one, count_documents, insert_one, update_one, bulk_write, ...
+        method = getattr(self.delegate, name)
+
+        async def call(*args, **kwargs):
+            return await self.database._run(method, *args, **kwargs)
+        return call
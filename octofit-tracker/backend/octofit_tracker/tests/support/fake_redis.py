@@ -0,0 +1,220 @@
+"""
+In-process stand-in for a Redis server.
+
+``FakeRedisServer`` listens on a localhost port and speaks the RESP2 wire
+protocol for the handful of commands the app sends, so the real client
+code in ``cache.RedisProtocolCache`` and ``push.RedisBroker`` is exercised
+end to end in tests without a running ``redis-server``. Pub/sub covers
+``SUBSCRIBE``/``PUBLISH`` only.
+"""
+import socketserver
+import threading
+import time
+from fnmatch import fnmatchcase
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+
+    def send(self, data):
+        # Published messages are written from the publisher's thread.
+        with self.write_lock:
+            self.wfile.write(data)
+
+    def handle(self):
+        try:
+            while True:
+                args = self._read_command()
+                if args is None:
+                    return
+                if args[0].upper() == b'SUBSCRIBE':
+                    for position, channel in enumerate(args[1:], 1):
+                        self.server.store.subscribe(self, channel)
+                        self.send(_encode([b'subscribe', channel, position]))
+                    continue
+                try:
+                    reply = self.server.store.execute(args)
+                except Exception as exc:  # reported to the client like Redis does
+                    self.send(b'-ERR %s\r\n' % str(exc).encode('utf-8'))
+                else:
+                    self.send(_encode(reply))
+        finally:
+            self.server.store.unsubscribe(self)
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+class _Ok:
+    pass
+
+
+OK = _Ok()
+
+
+def _encode(reply):
+    if reply is OK:
+        return b'+OK\r\n'
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, bool):
+        return b':%d\r\n' % int(reply)
+    if isinstance(reply, int):
+        return b':%d\r\n' % reply
+    if isinstance(reply, str):
+        reply = reply.encode('utf-8')
+    if isinstance(reply, bytes):
+        return b'$%d\r\n%s\r\n' % (len(reply), reply)
+    if isinstance(reply, list):
+        return b'*%d\r\n' % len(reply) + b''.join(_encode(item) for item in reply)
+    raise TypeError(type(reply))
+
+
+class FakeRedisStore:
+    """The keyspace of a single Redis database with millisecond expiry."""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+        self.channels = {}
+
+    def _alive(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def execute(self, args):
+        command = args[0].decode('ascii').upper()
+        handler = getattr(self, f'cmd_{command.lower()}', None)
+        if handler is None:
+            raise ValueError(f"unknown command '{command}'")
+        with self.lock:
+            return handler(*args[1:])
+
+    def subscribe(self, handler, channel):
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(handler)
+
+    def unsubscribe(self, handler):
+        with self.lock:
+            for subscribers in self.channels.values():
+                subscribers.discard(handler)
+
+    def cmd_publish(self, channel, message):
+        subscribers = list(self.channels.get(channel, ()))
+        for handler in subscribers:
+            try:
+                handler.send(_encode([b'message', channel, message]))
+            except OSError:
+                pass
+        return len(subscribers)
+
+    def cmd_ping(self, *args):
+        return OK
+
+    def cmd_select(self, db):
+        return OK
+
+    def cmd_auth(self, *args):
+        return OK
+
+    def cmd_get(self, key):
+        return self.data[key] if self._alive(key) else None
+
+    def cmd_mget(self, *keys):
+        return [self.cmd_get(key) for key in keys]
+
+    def cmd_set(self, key, value, *options):
+        options = [option.upper() if option.isalpha() else option for option in options]
+        exists = self._alive(key)
+        if b'NX' in options and exists:
+            return None
+        if b'XX' in options and not exists:
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        for unit, scale in ((b'PX', 1000.0), (b'EX', 1.0)):
+            if unit in options:
+                self.expires[key] = time.monotonic() + int(options[options.index(unit) + 1]) / scale
+        return OK
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                del self.data[key]
+                self.expires.pop(key, None)
+                removed += 1
+        return removed
+
+    def cmd_exists(self, *keys):
+        return sum(1 for key in keys if self._alive(key))
+
+    def cmd_incrby(self, key, delta):
+        value = int(self.data[key]) if self._alive(key) else 0
+        value += int(delta)
+        self.data[key] = str(value).encode('ascii')
+        return value
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, b'1')
+
+    def cmd_pexpire(self, key, milliseconds):
+        if not self._alive(key):
+            return 0
+        self.expires[key] = time.monotonic() + int(milliseconds) / 1000.0
+        return 1
+
+    def cmd_persist(self, key):
+        return 1 if self._alive(key) and self.expires.pop(key, None) is not None else 0
+
+    def cmd_keys(self, pattern):
+        pattern = pattern.decode('utf-8')
+        return [key for key in list(self.data) if self._alive(key) and fnmatchcase(key.decode('utf-8'), pattern)]
+
+    def cmd_flushdb(self, *args):
+        self.data.clear()
+        self.expires.clear()
+        return OK
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """
+    Usage::
+
+        with FakeRedisServer() as server:
+            url = server.url  # e.g. redis://127.0.0.1:53124/0
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.store = FakeRedisStore()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'redis://{host}:{port}/0'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,1745 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, SimpleTestCase, override_settings
+from rest_framework.test import APIClient, APITestCase
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from django.db import connection
+from django.db.backends.base.base import NO_DB_ALIAS, BaseDatabaseWrapper
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from pymongo import monitoring
+from .. import (aggregations, archive, archive_analytics, benchmark, denormalization, instrumentation, lookups, mongo,
+                periods, push, replicas, resolve, rollups, search, synthetic, team_summaries, tiering, versions)
+from ..fast_serializers import compile_serializer
+from ..ingest import ingest_activities
+from ..cache import RedisProtocolCache, response_cache
+from ..conditional import not_modified, set_validators
+from ..counters import counter_buffer
+from .support import FakeDatabase, FakeDatabaseMixin
+from .support.fake_motor import FakeAsyncDatabase
+from .support.fake_redis import FakeRedisServer
+from ..indexes import ensure_indexes, missing_indexes, plan_indexes
+from ..models import Team, User, Workout, Activity, ArchivedActivity, Leaderboard
+from ..renderers import ORJSONRenderer
+from ..serializers import ActivitySerializer, LeaderboardSerializer, TeamSerializer, UserSerializer, WorkoutSerializer
+from ..urls import router
+from datetime import datetime, timedelta
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+
+class TeamModelTest(TestCase):
+    """Test Team model"""
+    
+    def setUp(self):
+        self.team = Team.objects.create(
+            _id='test_team',
+            name='Test Team',
+            description='A test team',
+            created_at=datetime.now(),
+            member_count=0
+        )
+
+    def test_team_creation(self):
+        """Test that a team can be created"""
+        self.assertEqual(self.team.name, 'Test Team')
+        self.assertEqual(str(self.team), 'Test Team')
+
+
+class UserModelTest(TestCase):
+    """Test User model"""
+    
+    def setUp(self):
+        self.user = User.objects.create(
+            _id='test_user',
+            name='Test User',
+            alias='Test Hero',
+            email='test@test.com',
+            team_id='test_team',
+            total_points=100,
+            activities_completed=5,
+            joined_at=datetime.now()
+        )
+
+    def test_user_creation(self):
+        """Test that a user can be created"""
+        self.assertEqual(self.user.name, 'Test User')
+        self.assertEqual(self.user.alias, 'Test Hero')
+        self.assertEqual(str(self.user), 'Test User (Test Hero)')
+
+
+class WorkoutModelTest(TestCase):
+    """Test Workout model"""
+    
+    def setUp(self):
+        self.workout = Workout.objects.create(
+            _id='test_workout',
+            name='Test Workout',
+            icon='🏃',
+            unit='km',
+            points_per_unit=10,
+            description='A test workout',
+            created_at=datetime.now()
+        )
+
+    def test_workout_creation(self):
+        """Test that a workout can be created"""
+        self.assertEqual(self.workout.name, 'Test Workout')
+        self.assertEqual(str(self.workout), '🏃 Test Workout')
+
+
+class TeamAPITest(APITestCase):
+    """Test Team API endpoints"""
+    
+    def setUp(self):
+        self.team = Team.objects.create(
+            _id='api_test_team',
+            name='API Test Team',
+            description='API test team description',
+            created_at=datetime.now(),
+            member_count=0
+        )
+
+    def test_get_teams_list(self):
+        """Test retrieving the teams list"""
+        url = reverse('team-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_get_team_detail(self):
+        """Test retrieving a single team"""
+        url = reverse('team-detail', args=[self.team._id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'API Test Team')
+
+
+class UserAPITest(APITestCase):
+    """Test User API endpoints"""
+    
+    def setUp(self):
+        self.user = User.objects.create(
+            _id='api_test_user',
+            name='API Test User',
+            alias='API Hero',
+            email='apitest@test.com',
+            team_id='test_team',
+            total_points=200,
+            activities_completed=10,
+            joined_at=datetime.now()
+        )
+
+    def test_get_users_list(self):
+        """Test retrieving the users list"""
+        url = reverse('user-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_get_user_detail(self):
+        """Test retrieving a single user"""
+        url = reverse('user-detail', args=[self.user._id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'API Test User')
+
+    def test_user_detail_merges_pending_counters(self):
+        """Test that points not yet flushed by the write-behind buffer are included"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        with override_settings(COUNTER_JOURNAL_DIR=directory):
+            self.addCleanup(counter_buffer.reset)
+            counter_buffer.add(FakeDatabase(), 'users', self.user._id, {'total_points': 30, 'activities_completed': 1})
+            response = self.client.get(reverse('user-detail', args=[self.user._id]))
+        self.assertEqual((response.data['total_points'], response.data['activities_completed']), (230, 11))
+
+
+class WorkoutAPITest(APITestCase):
+    """Test Workout API endpoints"""
+    
+    def setUp(self):
+        self.workout = Workout.objects.create(
+            _id='api_test_workout',
+            name='API Test Workout',
+            icon='💪',
+            unit='reps',
+            points_per_unit=5,
+            description='API test workout',
+            created_at=datetime.now()
+        )
+
+    def test_get_workouts_list(self):
+        """Test retrieving the workouts list"""
+        url = reverse('workout-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class ActivityAPITest(APITestCase):
+    """Test Activity API endpoints"""
+    
+    def setUp(self):
+        self.activity = Activity.objects.create(
+            _id='api_test_activity',
+            user_id='test_user',
+            user_name='Test User',
+            user_alias='Test Hero',
+            workout_id='test_workout',
+            workout_name='Test Workout',
+            workout_icon='🏃',
+            description='Test activity',
+            quantity=10,
+            unit='km',
+            points_earned=100,
+            completed_at=datetime.now(),
+            team_id='test_team'
+        )
+
+    def test_get_activities_list(self):
+        """Test retrieving the activities list"""
+        url = reverse('activity-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class LeaderboardAPITest(APITestCase):
+    """Test Leaderboard API endpoints"""
+    
+    def setUp(self):
+        self.leaderboard_entry = Leaderboard.objects.create(
+            _id='api_test_leaderboard',
+            type='individual',
+            rank=1,
+            entity_id='test_user',
+            entity_name='Test User',
+            entity_alias='Test Hero',
+            team_id='test_team',
+            total_points=500,
+            activities_count=20,
+            updated_at=datetime.now()
+        )
+
+    def test_get_leaderboard_list(self):
+        """Test retrieving the leaderboard list"""
+        url = reverse('leaderboard-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_get_individual_leaderboard(self):
+        """Test retrieving individual leaderboard"""
+        url = reverse('leaderboard-individual')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class APIRootTest(APITestCase):
+    """Test API root endpoint"""
+    
+    def test_api_root(self):
+        """Test that API root returns all endpoint links"""
+        url = reverse('api-root')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('teams', response.data)
+        self.assertIn('users', response.data)
+        self.assertIn('workouts', response.data)
+        self.assertIn('activities', response.data)
+        self.assertIn('leaderboard', response.data)
+
+
+class ActivityLeaderboardTest(APITestCase):
+    """Test that Activity writes keep the leaderboard current"""
+
+    def setUp(self):
+        lookups.clear()
+        Workout.objects.create(_id='w', name='Running', icon='🏃', unit='km', points_per_unit=10,
+                               description='Run', created_at=datetime.now())
+        Team.objects.create(_id='team_a', name='Team A', description='A',
+                            created_at=datetime.now(), member_count=2)
+        for user_id, points in (('user_a', 100), ('user_b', 50)):
+            User.objects.create(
+                _id=user_id, name=user_id, alias=user_id, email=f'{user_id}@test.com',
+                team_id='team_a', total_points=points, activities_completed=1,
+                joined_at=datetime.now()
+            )
+        Leaderboard.objects.create(
+            _id='lb_a', type='individual', rank=1, entity_id='user_a', entity_name='user_a',
+            team_id='team_a', total_points=100, activities_count=1, updated_at=datetime.now()
+        )
+        Leaderboard.objects.create(
+            _id='lb_b', type='individual', rank=2, entity_id='user_b', entity_name='user_b',
+            team_id='team_a', total_points=50, activities_count=1, updated_at=datetime.now()
+        )
+
+    def _post_activity(self, points):
+        return self.client.post(reverse('activity-list'), {
+            '_id': f'activity_{points}', 'user_id': 'user_b', 'workout_id': 'w',
+            'description': 'Run', 'quantity': points // 10,
+            'completed_at': datetime.now().isoformat(),
+        }, format='json')
+
+    def test_create_activity_updates_ranks(self):
+        """Test that overtaking a user swaps both ranks"""
+        response = self._post_activity(80)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        counter_buffer.flush()
+        self.assertEqual(User.objects.get(_id='user_b').total_points, 130)
+        self.assertEqual(Leaderboard.objects.get(_id='lb_b').rank, 1)
+        self.assertEqual(Leaderboard.objects.get(_id='lb_a').rank, 2)
+        team_row = Leaderboard.objects.get(type='team', entity_id='team_a')
+        self.assertEqual(team_row.total_points, 80)
+
+    def test_delete_activity_reverts_ranks(self):
+        """Test that deleting an activity restores the previous ranking"""
+        self._post_activity(80)
+        response = self.client.delete(reverse('activity-detail', args=['activity_80']))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        counter_buffer.flush()
+        self.assertEqual(User.objects.get(_id='user_b').total_points, 50)
+        self.assertEqual(Leaderboard.objects.get(_id='lb_a').rank, 1)
+        self.assertEqual(Leaderboard.objects.get(_id='lb_b').rank, 2)
+
+
+class ActivityPaginationTest(APITestCase):
+    """Test keyset pagination and streaming on the activities list"""
+
+    def setUp(self):
+        now = datetime.now()
+        for i in range(5):
+            Activity.objects.create(
+                _id=f'page_activity_{i}', user_id='test_user', user_name='Test User',
+                user_alias='Test Hero', workout_id='test_workout', workout_name='Running',
+                workout_icon='🏃', description='Run', quantity=i, unit='km',
+                points_earned=i * 10, completed_at=now - timedelta(minutes=i // 2),
+                team_id='test_team'
+            )
+
+    def test_follow_cursor_through_all_pages(self):
+        """Test that following next links visits every activity once, in order"""
+        url = reverse('activity-list') + '?page_size=2'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen.extend(item['_id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [f'page_activity_{i}' for i in range(5)])
+
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        response = self.client.get(reverse('activity-list') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stream_list(self):
+        """Test that ?stream=true returns the full list as a JSON array"""
+        response = self.client.get(reverse('activity-list') + '?stream=true')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(data), 5)
+
+
+class AggregationPipelineTest(SimpleTestCase):
+    """Test the native leaderboard pipelines against the in-process fake"""
+
+    def setUp(self):
+        self.db = FakeDatabase()
+        self.db.teams.insert_many([
+            {'_id': 'team_a', 'name': 'Team A', 'member_count': 1},
+            {'_id': 'team_b', 'name': 'Team B', 'member_count': 2},
+        ])
+        self.db.users.insert_many([
+            {'_id': 'u1', 'name': 'One', 'alias': 'O', 'team_id': 'team_a',
+             'total_points': 300, 'activities_completed': 3},
+            {'_id': 'u2', 'name': 'Two', 'alias': 'T', 'team_id': 'team_b',
+             'total_points': 300, 'activities_completed': 2},
+            {'_id': 'u3', 'name': 'Three', 'alias': 'H', 'team_id': 'team_b',
+             'total_points': 100, 'activities_completed': 1},
+        ])
+        now = timezone.now()
+        self.db.activities.insert_many([
+            {'_id': 'a1', 'user_id': 'u3', 'user_name': 'Three', 'team_id': 'team_b',
+             'workout_id': 'w1', 'workout_name': 'Running', 'unit': 'km', 'quantity': 5,
+             'points_earned': 50, 'completed_at': now},
+            {'_id': 'a2', 'user_id': 'u1', 'user_name': 'One', 'team_id': 'team_a',
+             'workout_id': 'w1', 'workout_name': 'Running', 'unit': 'km', 'quantity': 2,
+             'points_earned': 20, 'completed_at': now},
+            {'_id': 'a3', 'user_id': 'u1', 'user_name': 'One', 'team_id': 'team_a',
+             'workout_id': 'w1', 'workout_name': 'Running', 'unit': 'km', 'quantity': 9,
+             'points_earned': 90, 'completed_at': now - timedelta(days=60)},
+        ])
+
+    def test_live_individual_leaderboard_shares_ranks_on_ties(self):
+        """Test that equal totals share a rank and the next rank is skipped"""
+        rows = aggregations.live_leaderboard('individual', db=self.db)
+        self.assertEqual([(row['entity_id'], row['rank']) for row in rows],
+                         [('u1', 1), ('u2', 1), ('u3', 3)])
+
+    def test_live_team_leaderboard(self):
+        """Test that team totals are summed from the activities logged for each team and named on the server"""
+        self.db.users.update_one({'_id': 'u3'}, {'$set': {'team_id': 'team_a'}})
+        rows = aggregations.live_leaderboard('team', db=self.db)
+        self.assertEqual([(row['entity_id'], row['total_points'], row['rank']) for row in rows],
+                         [('team_a', 110, 1), ('team_b', 50, 2)])
+        self.assertEqual((rows[1]['entity_name'], rows[1]['member_count'], rows[1]['activities_count']),
+                         ('Team B', 2, 1))
+
+    def test_period_leaderboard_only_counts_period(self):
+        """Test that activities outside the period are ignored"""
+        since, until = aggregations.period_bounds('week')
+        rows = aggregations.period_leaderboard('individual', since, until, db=self.db)
+        self.assertEqual([(row['entity_id'], row['total_points']) for row in rows],
+                         [('u3', 50), ('u1', 20)])
+
+    def test_team_activity_totals(self):
+        """Test per-team workout totals"""
+        rows = aggregations.team_activity_totals('team_a', db=self.db)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['total_quantity'], 11)
+        self.assertEqual(rows[0]['total_points'], 110)
+
+
+class IndexPlanTest(SimpleTestCase):
+    """Test index planning from the ViewSet filter declarations"""
+
+    def test_plan_follows_filters_and_ordering(self):
+        """Test that filtered lists get (filter, default ordering) indexes"""
+        plans = plan_indexes(router.registry)
+        self.assertIn([('team_id', 1), ('completed_at', -1), ('_id', 1)], plans['activities'])
+        self.assertIn([('type', 1), ('rank', 1), ('_id', 1)], plans['leaderboard'])
+        self.assertIn([('team_id', 1), ('total_points', -1), ('_id', 1)], plans['users'])
+
+    def test_ensure_indexes_is_idempotent(self):
+        """Test that a second run creates nothing"""
+        db = FakeDatabase()
+        plans = plan_indexes(router.registry)
+        created, existing = ensure_indexes(db, plans)
+        self.assertTrue(created)
+        self.assertEqual(existing, [])
+        created, existing = ensure_indexes(db, plans)
+        self.assertEqual(created, [])
+        self.assertEqual(missing_indexes(db, plans), [])
+
+
+class RedisProtocolCacheTest(SimpleTestCase):
+    """Test the Redis-protocol cache backend against the in-process fake"""
+
+    def setUp(self):
+        self.server = FakeRedisServer().__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        self.cache = RedisProtocolCache(self.server.url, {'TIMEOUT': 30})
+
+    def test_set_get_and_add(self):
+        """Test round-tripping values and add-if-absent"""
+        self.cache.set('data', {'results': [1, 2]})
+        self.assertEqual(self.cache.get('data'), {'results': [1, 2]})
+        self.assertFalse(self.cache.add('data', 'other'))
+        self.assertTrue(self.cache.add('fresh', 'value'))
+        self.assertEqual(self.cache.get_many(['data', 'fresh', 'missing']),
+                         {'data': {'results': [1, 2]}, 'fresh': 'value'})
+
+    def test_incr_and_expiry(self):
+        """Test counters and TTL expiry"""
+        self.cache.set('counter', 1, timeout=None)
+        self.assertEqual(self.cache.incr('counter'), 2)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.cache.set('short', 'value', timeout=0.01)
+        time.sleep(0.05)
+        self.assertIsNone(self.cache.get('short'))
+
+
+class ResponseCacheTest(APITestCase):
+    """Test cached responses and signal-driven invalidation"""
+
+    def setUp(self):
+        response_cache().clear()
+        Workout.objects.create(_id='cached_workout', name='Running', icon='🏃', unit='km',
+                               points_per_unit=10, description='Run', created_at=datetime.now())
+
+    def test_list_is_served_from_cache(self):
+        """Test that writes bypassing the ORM are not seen until invalidated"""
+        url = reverse('workout-list')
+        self.assertEqual(self.client.get(url).data['results'][0]['name'], 'Running')
+        Workout.objects.filter(_id='cached_workout').update(name='Jogging')
+        self.assertEqual(self.client.get(url).data['results'][0]['name'], 'Running')
+        versions.bump('workouts')
+        self.assertEqual(self.client.get(url).data['results'][0]['name'], 'Jogging')
+
+    def test_model_write_invalidates(self):
+        """Test that saving a model invalidates responses reading its collection"""
+        url = reverse('workout-list')
+        self.assertEqual(len(self.client.get(url).data['results']), 1)
+        Workout.objects.create(_id='cached_workout_2', name='Cycling', icon='🚴', unit='km',
+                               points_per_unit=5, description='Ride', created_at=datetime.now())
+        self.assertEqual(len(self.client.get(url).data['results']), 2)
+
+
+@override_settings(VERSIONS_SHARED=True)
+class ConditionalGetTest(APITestCase):
+    """Test ETag / Last-Modified handling on polled endpoints"""
+
+    def setUp(self):
+        Leaderboard.objects.create(
+            _id='etag_entry', type='individual', rank=1, entity_id='test_user',
+            entity_name='Test User', total_points=500, updated_at=datetime.now()
+        )
+
+    def test_matching_etag_returns_304_without_queries(self):
+        """Test that a matching If-None-Match is answered before any query"""
+        url = reverse('leaderboard-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_write_changes_etag(self):
+        """Test that a write to the collection invalidates the ETag"""
+        url = reverse('leaderboard-list')
+        etag = self.client.get(url)['ETag']
+        Leaderboard.objects.filter(_id='etag_entry').delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_validators_need_shared_counters_and_whole_seconds(self):
+        """Test that process-local counters send no ETag and Last-Modified only names past seconds"""
+        with override_settings(VERSIONS_SHARED=None):
+            self.assertNotIn('ETag', self.client.get(reverse('leaderboard-list')))
+        response = HttpResponse()
+        with mock.patch('octofit_tracker.conditional.time.time', return_value=100.5):
+            set_validators(response, '"v1"', 100.2)
+        self.assertNotIn('Last-Modified', response)
+        with mock.patch('octofit_tracker.conditional.time.time', return_value=101.5):
+            set_validators(response, '"v1"', 100.2)
+        self.assertEqual(response['Last-Modified'], http_date(101))
+        request = RequestFactory().get('/', HTTP_IF_MODIFIED_SINCE=http_date(101))
+        self.assertTrue(not_modified(request, '"v2"', 100.2))
+        self.assertFalse(not_modified(request, '"v2"', 101.0))
+
+
+class BulkActivityIngestTest(FakeDatabaseMixin, SimpleTestCase):
+    """Test bulk activity ingestion against the in-process fake"""
+    client_class = APIClient
+    db_modules = ('ingest', 'ranking', 'rollups', 'team_summaries')
+
+    def setUp(self):
+        super().setUp()
+        self.db.teams.insert_one({'_id': 'team_a', 'name': 'Team A', 'member_count': 1})
+        self.db.users.insert_one({'_id': 'user_a', 'name': 'User A', 'alias': 'A', 'team_id': 'team_a',
+                                  'total_points': 0, 'activities_completed': 0})
+        self.db.workouts.insert_one({'_id': 'run', 'name': 'Running', 'icon': '🏃', 'unit': 'km',
+                                     'points_per_unit': 10})
+        self.url = reverse('activity-bulk')
+
+    def _item(self, **overrides):
+        item = {'user_id': 'user_a', 'workout_id': 'run', 'quantity': 3,
+                'description': 'Run', 'completed_at': '2024-05-01T08:00:00Z'}
+        item.update(overrides)
+        return item
+
+    def test_bulk_json_resolves_fields_and_totals(self):
+        """Test that points and denormalized fields are computed on the server"""
+        items = [self._item(_id='bulk_1', points_earned=9999), self._item(_id='bulk_2', quantity=2)]
+        response = self.client.post(self.url, items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['inserted'], 2)
+        stored = self.db.activities.find_one({'_id': 'bulk_1'})
+        self.assertEqual(stored['points_earned'], 30)
+        self.assertEqual(stored['user_alias'], 'A')
+        self.assertEqual(stored['team_id'], 'team_a')
+        counter_buffer.flush()
+        user = self.db.users.find_one({'_id': 'user_a'})
+        self.assertEqual((user['total_points'], user['activities_completed']), (50, 2))
+        team_row = self.db.leaderboard.find_one({'type': 'team', 'entity_id': 'team_a'})
+        self.assertEqual(team_row['total_points'], 50)
+
+    def test_ranks_count_rows_written_by_other_workers(self):
+        """Test that a move ranks the entity against the collection, not a per-process copy"""
+        self.client.post(self.url, [self._item(_id='bulk_1')], format='json')
+        row = self.db.leaderboard.find_one({'type': 'individual', 'entity_id': 'user_a'})
+        self.assertEqual(row['rank'], 1)
+        # Another worker ranks a new entity above user_a.
+        self.db.leaderboard.insert_one({'_id': 'leaderboard_individual_user_x', 'type': 'individual',
+                                        'entity_id': 'user_x', 'total_points': 100, 'rank': 1})
+        self.db.leaderboard.update_one({'_id': row['_id']}, {'$inc': {'rank': 1}})
+        self.client.post(self.url, [self._item(_id='bulk_2', quantity=2)], format='json')
+        row = self.db.leaderboard.find_one({'type': 'individual', 'entity_id': 'user_a'})
+        self.assertEqual((row['total_points'], row['rank']), (50, 2))
+
+    def test_new_team_row_is_seeded_with_the_team_total(self):
+        """Test that a team without a leaderboard row starts from all of its activities, not the batch"""
+        self.db.activities.insert_one({'_id': 'earlier', 'user_id': 'user_b', 'team_id': 'team_a',
+                                       'points_earned': 40})
+        self.db.activities_archive.insert_one({'_id': 'archived', 'user_id': 'user_b', 'team_id': 'team_a',
+                                               'points_earned': 15})
+        self.client.post(self.url, [self._item(_id='bulk_1')], format='json')
+        team_row = self.db.leaderboard.find_one({'type': 'team', 'entity_id': 'team_a'})
+        self.assertEqual(team_row['total_points'], 85)
+        self.client.post(self.url, [self._item(_id='bulk_2', quantity=1)], format='json')
+        team_row = self.db.leaderboard.find_one({'type': 'team', 'entity_id': 'team_a'})
+        self.assertEqual(team_row['total_points'], 95)
+
+    def test_bulk_ndjson_reports_per_item_errors(self):
+        """Test that bad items are reported by index and the rest are stored"""
+        self.db.activities.insert_one({'_id': 'taken'})
+        lines = [self._item(), self._item(user_id='nobody'), self._item(quantity='lots'),
+                 self._item(_id='taken')]
+        body = '\n'.join(json.dumps(line) for line in lines)
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['inserted'], 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2, 3])
+        self.assertIn('user_id', response.data['errors'][0]['errors'])
+
+
+class ActivityCreateTest(APITestCase):
+    """Test server-side resolution of Activity fields on create"""
+
+    def setUp(self):
+        lookups.clear()
+        for target in ('octofit_tracker.views.leaderboard_engine', 'octofit_tracker.views.rollups',
+                       'octofit_tracker.views.team_summaries'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        User.objects.create(_id='create_user', name='Create User', alias='Creator',
+                            email='create@test.com', team_id='team_c', joined_at=datetime.now())
+        Workout.objects.create(_id='create_workout', name='Boxing', icon='🥊', unit='rounds',
+                               points_per_unit=20, description='Box', created_at=datetime.now())
+
+    def test_minimal_payload_is_resolved(self):
+        """Test that clients only send ids, quantity and time"""
+        response = self.client.post(reverse('activity-list'), {
+            'user_id': 'create_user', 'workout_id': 'create_workout', 'quantity': 3,
+            'completed_at': datetime.now().isoformat(), 'points_earned': 100000,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['points_earned'], 60)
+        self.assertEqual(response.data['user_alias'], 'Creator')
+        self.assertEqual(response.data['workout_icon'], '🥊')
+        self.assertEqual(response.data['team_id'], 'team_c')
+        self.assertTrue(response.data['_id'].startswith('activity_'))
+
+    def test_unknown_workout_is_rejected(self):
+        """Test that activities must reference an existing workout"""
+        response = self.client.post(reverse('activity-list'), {
+            'user_id': 'create_user', 'workout_id': 'missing', 'quantity': 3,
+            'completed_at': datetime.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('workout_id', response.data)
+
+    def test_quantity_must_be_positive(self):
+        """Test that zero and negative quantities are rejected"""
+        for quantity in (0, -3):
+            response = self.client.post(reverse('activity-list'), {
+                'user_id': 'create_user', 'workout_id': 'create_workout', 'quantity': quantity,
+                'completed_at': datetime.now().isoformat(),
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('quantity', response.data)
+
+    def test_unknown_workouts_are_remembered(self):
+        """Test that a missing workout reloads the table once, until a workout is saved"""
+        self.assertIsNone(lookups.get_workout('missing'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(lookups.get_workout('missing'))
+        Workout.objects.create(_id='missing', name='Rowing', icon='🚣', unit='km',
+                               points_per_unit=5, description='Row', created_at=datetime.now())
+        self.assertEqual(lookups.get_workout('missing')['name'], 'Rowing')
+
+    def test_lookups_are_cached(self):
+        """Test that repeated lookups do not hit the database"""
+        lookups.get_user('create_user')
+        lookups.get_workout('create_workout')
+        with self.assertNumQueries(0):
+            self.assertEqual(lookups.get_user('create_user')['alias'], 'Creator')
+            self.assertEqual(lookups.get_workout('create_workout')['points_per_unit'], 20)
+
+
+class ActivityRollupTest(FakeDatabaseMixin, APITestCase):
+    """Test the time-bucketed activity rollups"""
+    db_modules = ('rollups',)
+
+    def setUp(self):
+        super().setUp()
+        monday = datetime(2024, 5, 6, 9, 30)
+        self.activities = [
+            {'_id': 'a1', 'user_id': 'roll_user', 'team_id': 'team_r', 'workout_id': 'run',
+             'quantity': 2, 'points_earned': 20, 'completed_at': monday},
+            {'_id': 'a2', 'user_id': 'roll_user', 'team_id': 'team_r', 'workout_id': 'run',
+             'quantity': 1, 'points_earned': 10, 'completed_at': monday + timedelta(minutes=20)},
+            {'_id': 'a3', 'user_id': 'roll_user', 'team_id': 'team_r', 'workout_id': 'swim',
+             'quantity': 3, 'points_earned': 45, 'completed_at': monday + timedelta(days=8)},
+        ]
+
+    def _rows(self, bucket):
+        return sorted(self.db[rollups.BUCKETS[bucket]].find({}), key=lambda row: row['_id'])
+
+    def test_incremental_writes_match_backfill(self):
+        """Test that $inc upserts and a parallel backfill produce the same rows"""
+        rollups.apply(self.activities)
+        rollups.apply([self.activities[1]], sign=-1)
+        rollups.apply([self.activities[1]])
+        incremental = {bucket: self._rows(bucket) for bucket in rollups.BUCKETS}
+        day = self.db.rollups_daily.find_one({'_id': 'user:roll_user:2024-05-06T00:00:00'})
+        self.assertEqual((day['points'], day['activities'], day['quantity']), (30, 2, 3))
+        self.assertEqual(self.db.rollups_weekly.count_documents({'entity_type': 'user'}), 2)
+
+        for collection in rollups.BUCKETS.values():
+            self.db[collection].drop()
+        self.db.activities.insert_many(self.activities)
+        self.assertEqual(rollups.backfill(workers=2, weeks_per_chunk=1), 3)
+        self.assertEqual({bucket: self._rows(bucket) for bucket in rollups.BUCKETS}, incremental)
+
+    def test_backfill_deletes_rows_of_emptied_buckets(self):
+        """Test that a backfill leaves no rows for buckets without activities"""
+        rollups.apply(self.activities[:2])
+        expected = {bucket: self._rows(bucket) for bucket in rollups.BUCKETS}
+        rollups.apply(self.activities)
+        self.db.rollups_daily.insert_one({'_id': 'user:ghost:2024-05-07T00:00:00', 'entity_type': 'user',
+                                          'entity_id': 'ghost', 'start': datetime(2024, 5, 7), 'points': 5})
+        self.db.activities.insert_many(self.activities[:2])
+        collection = type(self.db.rollups_daily)
+        with mock.patch.object(collection, 'delete_many', autospec=True,
+                               side_effect=collection.delete_many) as delete_many:
+            self.assertEqual(rollups.backfill(workers=2, weeks_per_chunk=1), 2)
+        # Every delete is a range of the standings index rather than a collection scan
+        self.assertEqual({tuple(call.args[1]['entity_type']['$in']) for call in delete_many.call_args_list},
+                         {tuple(rollups.ENTITIES)})
+        self.assertEqual({bucket: self._rows(bucket) for bucket in rollups.BUCKETS}, expected)
+        self.db.activities.delete_many({})
+        self.assertEqual(rollups.backfill(), 0)
+        self.assertEqual(sum(self.db[collection].count_documents({}) for collection in rollups.BUCKETS.values()), 0)
+
+    def test_stats_endpoint_filters_by_bucket_and_range(self):
+        """Test that /users/{id}/stats/ returns the rollup rows in range"""
+        User.objects.create(_id='roll_user', name='Roll User', alias='Roller',
+                            email='roll@test.com', team_id='team_r', joined_at=datetime.now())
+        rollups.apply(self.activities)
+        url = reverse('user-stats', args=['roll_user'])
+        response = self.client.get(url, {'bucket': 'day', 'from': '2024-05-06', 'to': '2024-05-10'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['points'], row['activities']) for row in response.data], [(30, 2)])
+        response = self.client.get(url, {'bucket': 'week'})
+        self.assertEqual([row['points'] for row in response.data], [30, 45])
+        response = self.client.get(url, {'bucket': 'month'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PeriodLeaderboardTest(FakeDatabaseMixin, SimpleTestCase):
+    """Test period-scoped leaderboards and their snapshots"""
+    client_class = APIClient
+    db_modules = ('rollups', 'periods')
+
+    def setUp(self):
+        super().setUp()
+        self.db.users.insert_many([
+            {'_id': 'p1', 'name': 'One', 'alias': 'P1', 'team_id': 'pt'},
+            {'_id': 'p2', 'name': 'Two', 'alias': 'P2', 'team_id': 'pt'},
+            {'_id': 'p3', 'name': 'Three', 'alias': 'P3', 'team_id': 'pt'},
+        ])
+        self.now = timezone.now()
+        self.last_week = self.now - timedelta(weeks=1)
+
+    def _log(self, user_id, points, when):
+        rollups.apply([{'user_id': user_id, 'team_id': 'pt', 'workout_id': 'run',
+                        'quantity': 1, 'points_earned': points, 'completed_at': when}])
+
+    @override_settings(PERIOD_FREEZE_DELAY_HOURS=0)
+    def test_closed_period_is_frozen(self):
+        """Test that a closed week is ranked live until the freeze job snapshots it once"""
+        self._log('p1', 10, self.last_week)
+        self._log('p2', 30, self.last_week)
+        with override_settings(PERIOD_FREEZE_DELAY_HOURS=24 * 8):
+            board = periods.leaderboard('individual', 'week', self.last_week)
+            self.assertFalse(board['frozen'])
+            with self.assertRaises(ValueError):
+                periods.freeze('individual', 'week', board['start'])
+        self._log('p3', 10, self.last_week)
+        board = periods.leaderboard('individual', 'week', self.last_week)
+        self.assertFalse(board['frozen'])
+        response = self.client.get(reverse('leaderboard-list'), {'period': 'week', 'date': self.last_week.isoformat()})
+        self.assertFalse(response.data['frozen'])
+        self.assertEqual(self.db[periods.SNAPSHOT_HEADERS].count_documents({}), 0)
+        self.assertEqual(self.db[periods.SNAPSHOTS].count_documents({}), 0)
+
+        periods.freeze_closed(periods=('week',), board_types=('individual',))
+        board = periods.leaderboard('individual', 'week', self.last_week)
+        self.assertTrue(board['frozen'])
+        self.assertEqual([(row['entity_id'], row['rank']) for row in board['results']],
+                         [('p2', 1), ('p1', 2), ('p3', 2)])
+        self.assertEqual(board['results'][0]['entity_alias'], 'P2')
+
+        self._log('p3', 100, self.last_week)
+        board = periods.leaderboard('individual', 'week', self.last_week)
+        self.assertEqual(board['results'][0]['entity_id'], 'p2')
+        self.assertEqual(self.db[periods.SNAPSHOT_HEADERS].count_documents({}), 1)
+
+    def test_current_period_via_api(self):
+        """Test that ?period= ranks the current period from the rollups"""
+        self._log('p1', 10, self.now)
+        self._log('p2', 5, self.now)
+        self._log('p1', 50, self.last_week)
+        response = self.client.get(reverse('leaderboard-list'), {'period': 'week', 'limit': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['frozen'])
+        self.assertEqual([(row['entity_id'], row['total_points']) for row in response.data['results']],
+                         [('p1', 10)])
+        response = self.client.get(reverse('leaderboard-list'), {'period': 'month', 'type': 'team'})
+        self.assertEqual(response.data['results'][0]['entity_id'], 'pt')
+        response = self.client.get(reverse('leaderboard-list'), {'period': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_periods_past_the_last_date_are_rejected(self):
+        """Test that a period ending after year 9999 is a 400 rather than a server error"""
+        for url, params in [(reverse('leaderboard-list'), {'period': 'day', 'date': '9999-12-31'}),
+                            (reverse('leaderboard-by-period'), {'period': 'month', 'date': '9999-12-15'}),
+                            (reverse('leaderboard-team-totals'), {'period': 'week', 'date': '9999-12-30'})]:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('date', response.data)
+
+
+class SyntheticDataTest(SimpleTestCase):
+    """Test the scalable populate_db data generator"""
+
+    def _populate(self, **options):
+        db = FakeDatabase()
+        settings = dict(users=40, teams=3, activities=900, seed=7, workers=3, chunk_size=128)
+        settings.update(options)
+        synthetic.populate(db, **settings)
+        return db
+
+    def test_totals_match_activities(self):
+        """Test that streamed user, team and leaderboard totals agree with the activities"""
+        db = self._populate()
+        self.assertEqual(db.activities.count_documents({}), 900)
+        per_user = {}
+        for activity in db.activities.find({}):
+            per_user[activity['user_id']] = per_user.get(activity['user_id'], 0) + activity['points_earned']
+        users = {user['_id']: user for user in db.users.find({})}
+        self.assertEqual({user_id: user['total_points'] for user_id, user in users.items() if user['total_points']},
+                         per_user)
+        self.assertEqual(users['user_1']['alias'], 'Iron Man')
+        self.assertGreater(users['user_1']['activities_completed'], users['user_40']['activities_completed'])
+        for team in db.teams.find({}):
+            row = db.leaderboard.find_one({'type': 'team', 'entity_id': team['_id']})
+            self.assertEqual(row['total_points'], sum(user['total_points'] for user in users.values()
+                                                      if user['team_id'] == team['_id']))
+        for row in db.leaderboard.find({'type': 'individual'}):
+            self.assertEqual(row['rank'], 1 + db.leaderboard.count_documents(
+                {'type': 'individual', 'total_points': {'$gt': row['total_points']}}))
+
+    def test_seed_is_reproducible_across_workers(self):
+        """Test that the same seed gives the same data whatever the worker count"""
+        first = self._populate(workers=1)
+        second = self._populate(workers=4)
+        strip = ('completed_at',)
+        rows = [[{key: value for key, value in doc.items() if key not in strip}
+                 for doc in db.activities.find({}).sort('_id', 1)] for db in (first, second)]
+        self.assertEqual(rows[0], rows[1])
+
+
+class BenchmarkTest(SimpleTestCase):
+    """Test the benchmark endpoint plan and regression check"""
+
+    def test_plan_covers_routes_and_actions(self):
+        """Test that every GET route variant gets an endpoint"""
+        samples = {
+            'team': {'_id': 'team_a', 'name': 'Team A'},
+            'user': {'_id': 'user_a', 'name': 'Ann Lee', 'team_id': 'team_a'},
+            'workout': None,
+            'activity': None,
+            'leaderboard': None,
+        }
+        endpoints = dict(benchmark.plan_endpoints(router.registry, samples))
+        self.assertEqual(endpoints['team-detail'], '/api/teams/team_a/')
+        self.assertEqual(endpoints['team-members'], '/api/teams/team_a/members/')
+        self.assertEqual(endpoints['user-list?team_id'], '/api/users/?team_id=team_a')
+        self.assertEqual(endpoints['user-list?search'], '/api/users/?search=Ann')
+        self.assertIn('activity-recent', endpoints)
+        self.assertIn('leaderboard-individual', endpoints)
+        self.assertIn('leaderboard-list?ordering=-total_points', endpoints)
+        self.assertNotIn('workout-detail', endpoints)
+        self.assertNotIn('activity-bulk', endpoints)
+
+    def test_compare_flags_regressions(self):
+        """Test that slower, hungrier or chattier endpoints are reported"""
+        self.assertEqual(benchmark.percentile([5, 1, 4, 2, 3], 0.5), 3)
+        base = {'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0, 'peak_kib': 100.0, 'queries': 2}
+        same = dict(base, p50_ms=11.0)
+        worse = dict(base, p95_ms=40.0, queries=3)
+        regressions = benchmark.compare({'a': same, 'b': worse, 'c': base}, {'a': base, 'b': base})
+        self.assertEqual([(name, metric) for name, metric, _, _ in regressions],
+                         [('b', 'p95_ms'), ('b', 'queries')])
+
+    def test_profile_counts_mongo_commands_of_every_client(self):
+        """Test that the profiled request counts the commands of every client, inside the middleware too"""
+        def view(request):
+            for request_id, collection in enumerate(('users', 'activities', 'leaderboard')):
+                instrumentation.command_timer.started(mock.Mock(
+                    command_name='find', command={'find': collection}, request_id=request_id))
+            return HttpResponse('ok')
+
+        middleware = instrumentation.InstrumentationMiddleware(view)
+
+        def get(client, path):
+            return 1.0, middleware(RequestFactory().get(path)).status_code
+
+        with mock.patch('octofit_tracker.benchmark._get', side_effect=get):
+            queries, _peak_kib, status_code = benchmark._profile('/api/users/')
+        self.assertEqual((queries, status_code), (3, 200))
+
+
+class _Queries:
+    """The query wrapping of a Django connection, without the connection"""
+    execute_wrapper = BaseDatabaseWrapper.execute_wrapper
+
+    def __init__(self):
+        self.execute_wrappers = []
+
+
+class InstrumentationTest(FakeDatabaseMixin, SimpleTestCase):
+    """Test the request instrumentation middleware and metrics endpoint"""
+    client_class = APIClient
+    db_modules = ('rollups', 'periods')
+
+    def setUp(self):
+        super().setUp()
+        instrumentation.registry.clear()
+        self.addCleanup(instrumentation.registry.clear)
+
+    def test_server_timing_and_metrics(self):
+        """Test that phases are reported in Server-Timing and aggregated for Prometheus"""
+        response = self.client.get(reverse('leaderboard-list'), {'period': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = response['Server-Timing']
+        self.assertIn('render;dur=', timing)
+        self.assertIn('total;dur=', timing)
+        metrics = self.client.get('/api/_metrics')
+        self.assertTrue(metrics['Content-Type'].startswith('text/plain'))
+        body = metrics.content.decode()
+        self.assertIn('octofit_requests_total{view="leaderboard-list",method="GET",status="200"} 1', body)
+        self.assertIn('octofit_request_duration_seconds_count{view="leaderboard-list"} 1', body)
+        self.assertIn('octofit_phase_seconds_total{view="leaderboard-list",phase="render"}', body)
+
+    def test_metrics_are_internal(self):
+        """Test that /api/_metrics is only served to staff and to the configured scraper addresses"""
+        request = RequestFactory().get('/api/_metrics', REMOTE_ADDR='203.0.113.7')
+        request.user = mock.Mock(is_staff=False)
+        self.assertEqual(instrumentation.metrics_view(request).status_code, status.HTTP_403_FORBIDDEN)
+        request.user.is_staff = True
+        self.assertEqual(instrumentation.metrics_view(request).status_code, status.HTTP_200_OK)
+        request.user.is_staff = False
+        with self.settings(INSTRUMENTATION_METRICS_IPS=['203.0.113.7']):
+            self.assertEqual(instrumentation.metrics_view(request).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/api/_metrics', REMOTE_ADDR='203.0.113.7').status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+    def test_queries_on_every_alias_are_timed(self):
+        """Test that ORM queries on the replica alias and commands of every client are timed"""
+        aliases = {'default': _Queries(), 'replica': _Queries()}
+
+        def view(request):
+            for queries in aliases.values():
+                queries.execute_wrappers[0](lambda *args: None, 'SELECT 1', None, False, {})
+            return HttpResponse('ok')
+
+        with self.settings(DATABASES=dict.fromkeys(aliases, {})), \
+                mock.patch('octofit_tracker.instrumentation.connections', aliases):
+            response = instrumentation.InstrumentationMiddleware(view)(RequestFactory().get('/'))
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+        self.assertEqual([queries.execute_wrappers for queries in aliases.values()], [[], []])
+        mongo.close_clients()
+        self.addCleanup(mongo.close_clients)
+        with mock.patch('octofit_tracker.mongo.MongoClient') as client:
+            mongo.get_client()
+        self.assertIn(instrumentation.command_timer, client.call_args.kwargs['event_listeners'])
+
+    def test_mongo_commands_and_slow_capture(self):
+        """Test that pymongo commands are timed and slow requests log their operations"""
+        listener = instrumentation.CommandTimer()
+        event = mock.Mock(request_id=1, command_name='find', command={'find': 'users'}, duration_micros=2500)
+
+        def view(request):
+            listener.started(event)
+            listener.succeeded(event)
+            return HttpResponse('ok')
+
+        with self.settings(INSTRUMENTATION_SLOW_REQUEST_MS=0):
+            middleware = instrumentation.InstrumentationMiddleware(view)
+            request = RequestFactory().get('/slow')
+            with self.assertLogs('octofit_tracker.requests', 'WARNING') as logs:
+                response = middleware(request)
+        self.assertIn('mongo;dur=2.5;desc="1 commands"', response['Server-Timing'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['mongo_count'], 1)
+        self.assertEqual(record['operations'], [{'phase': 'mongo', 'ms': 2.5, 'detail': 'find users'}])
+
+
+class FastSerializerTest(APITestCase):
+    """Test the compiled list serializers and the orjson renderer"""
+
+    def setUp(self):
+        now = timezone.now().replace(microsecond=123456)
+        Team.objects.create(_id='team_a', name='Team Ünïcode', description='A', created_at=now, member_count=1)
+        User.objects.create(_id='u1', name='Ana', alias='Hero\u2028One', email='ana@example.com',
+                            team_id='team_a', total_points=10, activities_completed=1, joined_at=now)
+        Workout.objects.create(_id='w', name='Running', icon='🏃', unit='km', points_per_unit=10,
+                               description='Run', created_at=now)
+        Activity.objects.create(_id='a1', user_id='u1', user_name='Ana', user_alias='Hero', workout_id='w',
+                                workout_name='Running', workout_icon='🏃', description='Run', quantity=3,
+                                unit='km', points_earned=30, completed_at=now, team_id='team_a')
+        Leaderboard.objects.create(_id='leaderboard_user_u1', type='user', rank=1, entity_id='u1',
+                                   entity_name='Ana', total_points=10, updated_at=now)
+
+    def test_compiled_output_matches_serializer(self):
+        """Test that compiled serializers produce the same data as the ModelSerializers"""
+        for serializer_class in (TeamSerializer, UserSerializer, WorkoutSerializer,
+                                 ActivitySerializer, LeaderboardSerializer):
+            compiled = compile_serializer(serializer_class)
+            self.assertIsNotNone(compiled, serializer_class.__name__)
+            queryset = serializer_class.Meta.model.objects.all()
+            expected = serializer_class(queryset, many=True).data
+            self.assertEqual(compiled.many(compiled.rows(queryset)), expected)
+
+    def test_orjson_renderer_matches_json_renderer(self):
+        """Test that the orjson renderer output is byte-identical to JSONRenderer"""
+        data = ActivitySerializer(Activity.objects.all(), many=True).data
+        data += UserSerializer(User.objects.all(), many=True).data
+        data += TeamSerializer(Team.objects.all(), many=True).data
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        response = self.client.get(reverse('user-list'))
+        self.assertIn(b'Hero\\u2028One', response.content)
+
+
+class AsyncViewTest(SimpleTestCase):
+    """Test the async read endpoints on a fake motor database"""
+    client_class = AsyncClient
+
+    def setUp(self):
+        self.db = FakeAsyncDatabase()
+        patcher = mock.patch('octofit_tracker.async_views.get_async_db', return_value=self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        sync = self.db.delegate
+        now = datetime(2024, 5, 6, 12, 0)
+        sync.teams.insert_one({'_id': 'team_a', 'name': 'Team A', 'description': 'A', 'created_at': now,
+                               'member_count': 2})
+        for index, points in enumerate((10, 30)):
+            sync.users.insert_one({'_id': f'u{index}', 'name': f'User {index}', 'alias': f'Hero {index}',
+                                   'email': f'u{index}@example.com', 'team_id': 'team_a',
+                                   'total_points': points, 'activities_completed': 1, 'joined_at': now})
+            sync.activities.insert_one({
+                '_id': f'a{index}', 'user_id': f'u{index}', 'user_name': f'User {index}',
+                'user_alias': f'Hero {index}', 'workout_id': 'w', 'workout_name': 'Running',
+                'workout_icon': '🏃', 'description': 'Run', 'quantity': points // 10, 'unit': 'km',
+                'points_earned': points, 'completed_at': now + timedelta(hours=index), 'team_id': 'team_a'})
+        team_summaries.rebuild(sync)
+
+    async def test_team_dashboard_gathers_queries(self):
+        """Test that the dashboard issues its queries concurrently and serializes documents"""
+        response = await self.client.get('/api/async/teams/team_a/dashboard/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content)
+        self.assertEqual(data['team']['created_at'], '2024-05-06T12:00:00Z')
+        self.assertEqual([member['_id'] for member in data['members']], ['u1', 'u0'])
+        self.assertEqual([activity['_id'] for activity in data['recent_activities']], ['a1', 'a0'])
+        self.assertEqual(self.db.max_in_flight, 4)
+        missing = await self.client.get('/api/async/teams/nope/dashboard/')
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(VERSIONS_SHARED=True)
+    async def test_conditional_get_and_validation(self):
+        """Test that unchanged data is answered with 304 without querying and bad params with 400"""
+        response = await self.client.get('/api/async/activities/recent/')
+        self.assertEqual(len(json.loads(response.content)), 2)
+        operations = self.db.operations
+        again = await self.client.get('/api/async/activities/recent/', **{'if-none-match': response['ETag']})
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.db.operations, operations)
+        bad = await self.client.get('/api/async/leaderboard/', {'type': 'everyone'})
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+        posted = await self.client.post('/api/async/leaderboard/')
+        self.assertEqual(posted.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class PushTest(FakeDatabaseMixin, SimpleTestCase):
+    """Test the push hub, brokers and the Server-Sent Events endpoint"""
+    db_modules = ('ingest', 'ranking', 'rollups', 'team_summaries')
+
+    def setUp(self):
+        super().setUp()
+        previous = push.set_broker(push.LocalBroker(push.hub))
+        self.addCleanup(push.set_broker, previous)
+
+    async def test_sse_stream_delivers_published_events(self):
+        """Test that subscribers receive only the events of their topics"""
+        requests, sent = asyncio.Queue(), []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/stream/',
+                 'query_string': b'topic=activities', 'headers': [(b'origin', b'http://localhost:3000')]}
+        task = asyncio.ensure_future(push.PushRouter(None)(scope, requests.get, send))
+        while not push.hub.subscriber_count():
+            await asyncio.sleep(0)
+        push.publish_many(push.activity_messages('deleted', [{'_id': 'a1', 'user_id': 'u1', 'team_id': 't1'}]))
+        push.publish_many([('leaderboard:team', {'type': 'rank', 'entity_id': 't1'})])
+        while len(sent) < 3:
+            await asyncio.sleep(0)
+        await requests.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(task, 1)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertIn((b'access-control-allow-origin', b'http://localhost:3000'), sent[0]['headers'])
+        body = b''.join(message.get('body', b'') for message in sent[1:]).decode()
+        self.assertIn('event: activity.deleted', body)
+        self.assertIn('"activity":{"_id":"a1","user_id":"u1","team_id":"t1"}', body)
+        self.assertNotIn('rank', body)
+        self.assertEqual(push.hub.subscriber_count(), 0)
+
+    async def test_slow_subscriber_is_dropped(self):
+        """Test that a subscriber whose queue is full is dropped instead of blocking others"""
+        hub = push.Hub()
+        slow = hub.subscribe(['activities'], maxsize=2)
+        fast = hub.subscribe(['activities'], maxsize=10)
+        hub.dispatch([('activities', {'type': 'activity.created', 'n': n}) for n in range(3)])
+        await asyncio.sleep(0)
+        self.assertIs(await slow.get(0), push.DROPPED)
+        self.assertEqual([(await fast.get(0))['n'] for _ in range(3)], [0, 1, 2])
+        self.assertEqual((hub.dropped, hub.subscriber_count()), (1, 1))
+
+    async def test_redis_broker_reaches_other_workers(self):
+        """Test that events published by one worker reach subscribers of another"""
+        with FakeRedisServer() as server:
+            hubs = [push.Hub(), push.Hub()]
+            brokers = [push.RedisBroker(hub, server.url) for hub in hubs]
+            try:
+                for broker in brokers:
+                    self.assertTrue(broker.wait_subscribed(2))
+                subscription = hubs[1].subscribe(['leaderboard:individual'])
+                brokers[0].publish([('leaderboard:individual', {'type': 'rank', 'entity_id': 'u1', 'rank': 1})])
+                event = await subscription.get(2)
+            finally:
+                for broker in brokers:
+                    broker.close()
+        self.assertEqual((event['type'], event['entity_id'], event['rank']), ('rank', 'u1', 1))
+
+    async def test_ingest_publishes_activity_and_rank_deltas(self):
+        """Test that bulk ingestion publishes new activities and leaderboard moves"""
+        self.db.teams.insert_one({'_id': 'team_a', 'name': 'Team A', 'member_count': 2})
+        for user_id, points in (('user_a', 0), ('user_b', 20)):
+            self.db.users.insert_one({'_id': user_id, 'name': user_id, 'alias': user_id, 'team_id': 'team_a',
+                                      'total_points': points, 'activities_completed': 0})
+            self.db.leaderboard.insert_one({'_id': f'leaderboard_individual_{user_id}', 'type': 'individual',
+                                            'entity_id': user_id, 'total_points': points,
+                                            'rank': 1 if points else 2})
+        self.db.workouts.insert_one({'_id': 'run', 'name': 'Running', 'icon': '🏃', 'unit': 'km',
+                                     'points_per_unit': 10})
+        subscription = push.hub.subscribe(['team:team_a', 'leaderboard:individual'])
+        self.addCleanup(subscription.close)
+        item = {'_id': 'bulk_1', 'user_id': 'user_a', 'workout_id': 'run', 'quantity': 3,
+                'description': 'Run', 'completed_at': '2024-05-01T08:00:00Z'}
+        await sync_to_async(ingest_activities)([item])
+        events = []
+        while (event := await subscription.get(0.5)) is not None:
+            events.append(event)
+        created, moved = events[0], events[1]
+        self.assertEqual(created['type'], 'activity.created')
+        self.assertEqual(created['activity']['completed_at'], '2024-05-01T08:00:00Z')
+        self.assertEqual((moved['entity_id'], moved['rank'], moved['total_points']), ('user_a', 1, 30))
+        self.assertEqual(moved['shift'], {'from': 0, 'to': 30, 'by': 1})
+        self.assertEqual(events[2]['board'], 'team')
+
+
+class TeamDashboardTest(FakeDatabaseMixin, SimpleTestCase):
+    """Test the team summaries and the dashboard endpoint"""
+    client_class = APIClient
+    db_modules = ('ingest', 'ranking', 'rollups', 'team_summaries')
+
+    def setUp(self):
+        super().setUp()
+        self.patch('octofit_tracker.team_summaries.RECENT_SIZE', 2)
+        self.db.teams.insert_one({'_id': 'team_a', 'name': 'Team A', 'description': 'A',
+                                  'created_at': datetime(2024, 1, 1), 'member_count': 2})
+        for user_id in ('user_a', 'user_b'):
+            self.db.users.insert_one({'_id': user_id, 'name': user_id, 'alias': user_id, 'team_id': 'team_a',
+                                      'email': f'{user_id}@example.com', 'total_points': 0,
+                                      'activities_completed': 0})
+        self.db.workouts.insert_one({'_id': 'run', 'name': 'Running', 'icon': '🏃', 'unit': 'km',
+                                     'points_per_unit': 10})
+        self.db.workouts.insert_one({'_id': 'swim', 'name': 'Swimming', 'icon': '🏊', 'unit': 'laps',
+                                     'points_per_unit': 5})
+        items = [
+            {'_id': f'act_{day}', 'user_id': 'user_a' if day % 2 else 'user_b',
+             'workout_id': 'run' if day < 3 else 'swim', 'quantity': day,
+             'completed_at': f'2024-05-0{day}T08:00:00Z'}
+            for day in range(1, 5)
+        ]
+        ingest_activities(items)
+        counter_buffer.flush()
+
+    def test_dashboard_is_assembled_from_summaries(self):
+        """Test that the dashboard returns totals, members, workouts and a bounded recent list"""
+        response = self.client.get(reverse('team-dashboard', args=['team_a']), {'members': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data
+        self.assertEqual(data['team']['name'], 'Team A')
+        self.assertEqual(data['rank'], 1)
+        self.assertEqual(data['totals'], {'points': 65, 'activities': 4, 'quantity': 10})
+        self.assertEqual([member['_id'] for member in data['members']], ['user_b'])
+        self.assertEqual([(workout['workout_id'], workout['points'], workout['activities'])
+                          for workout in data['workouts']], [('swim', 35, 2), ('run', 30, 2)])
+        self.assertEqual([activity['_id'] for activity in data['recent_activities']], ['act_4', 'act_3'])
+        missing = self.client.get(reverse('team-dashboard', args=['nope']))
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_removal_refills_recent_and_matches_rebuild(self):
+        """Test that removed activities are subtracted and the recent list is re-read"""
+        removed = self.db.activities.find_one({'_id': 'act_4'})
+        self.db.activities.delete_one({'_id': 'act_4'})
+        team_summaries.apply(removed=[removed])
+        incremental = self.db.team_summaries.find_one({'_id': 'team_a'})
+        self.assertEqual([activity['_id'] for activity in incremental['recent']], ['act_3', 'act_2'])
+        self.assertEqual(incremental['workouts']['swim']['activities'], 1)
+        team_summaries.rebuild()
+        rebuilt = self.db.team_summaries.find_one({'_id': 'team_a'})
+        for field in ('points', 'activities', 'quantity', 'recent', 'workouts'):
+            self.assertEqual(incremental[field], rebuilt[field], field)
+
+
+class SearchTest(FakeDatabaseMixin, APITestCase):
+    """Test the ranked search backends"""
+    db_modules = ('search',)
+
+    def setUp(self):
+        super().setUp()
+        search.user_index.invalidate()
+        self.addCleanup(search.user_index.invalidate)
+        for user_id, alias, points in (('u1', 'Thunderbolt', 300), ('u2', 'Bolt Runner', 100),
+                                       ('u3', 'Thor', 200)):
+            User.objects.create(_id=user_id, name=f'{alias} Smith', alias=alias, email=f'{user_id}@example.com',
+                                team_id='t1', total_points=points, activities_completed=0,
+                                joined_at=datetime.now())
+
+    def _ids(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['_id'] for row in response.data['results']]
+
+    def test_user_search_is_ranked_prefix_search_kept_fresh_by_signals(self):
+        """Test that users are found by prefix and substring, ranked, and re-indexed on save"""
+        url = reverse('user-list')
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'th'})), ['u3', 'u1'])
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'bolt'})), ['u2', 'u1'])
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'bolt', 'ordering': '-total_points'})),
+                         ['u1', 'u2'])
+        first = self.client.get(url, {'search': 'smith', 'page_size': 2})
+        self.assertEqual(self._ids(first), ['u2', 'u3'])
+        self.assertEqual(self._ids(self.client.get(first.data['next'])), ['u1'])
+
+        user = User.objects.get(pk='u3')
+        user.name = user.alias = 'Zoë Storm'
+        user.save()
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'zoe'})), ['u3'])
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'thor'})), [])
+        suggestions = self.client.get(reverse('user-suggest'), {'q': 'sto'})
+        self.assertEqual([(row['_id'], row['alias']) for row in suggestions.data], [('u3', 'Zoë Storm')])
+
+    def test_activity_search_uses_text_index_with_regex_fallback(self):
+        """Test that activity search ranks by text score and falls back to regexes for partial words"""
+        for activity_id, description in (('a1', 'easy run'), ('a2', 'run run run'), ('a3', 'swim')):
+            document = {'_id': activity_id, 'user_id': 'u1', 'user_name': 'Ann', 'user_alias': 'Thunderbolt',
+                        'workout_id': 'run', 'workout_name': 'Running', 'workout_icon': '🏃',
+                        'description': description, 'quantity': 1, 'unit': 'km', 'points_earned': 10,
+                        'completed_at': datetime(2024, 5, int(activity_id[1])), 'team_id': 't1'}
+            Activity.objects.create(**document)
+            self.db.activities.insert_one(document)
+        url = reverse('activity-list')
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'run'})), ['a3', 'a2', 'a1'])
+
+        created, _ = search.ensure_text_indexes(self.db)
+        self.assertIn(('activities', 'user_alias_text_user_name_text_workout_name_text_description_text'), created)
+        self.assertEqual(search.ensure_text_indexes(self.db)[0], [])
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'run'})), ['a2', 'a1'])
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'swim'})), ['a3'])
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'runn'})), ['a3', 'a2', 'a1'])
+        # Every word has to match, as with the regex search
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'easy run'})), ['a1'])
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'easy swim'})), [])
+
+    def test_user_index_reloads_after_its_ttl_without_shared_versions(self):
+        """Test that writes no version bump reaches are picked up once the index expires"""
+        url = reverse('user-list')
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'thor'})), ['u3'])
+        User.objects.filter(pk='u3').update(alias='Loki', name='Loki Smith')
+        self.assertEqual(self._ids(self.client.get(url, {'search': 'thor'})), ['u3'])
+        expired = time.monotonic() + search.USER_INDEX_TTL + 1
+        with mock.patch('octofit_tracker.search.time.monotonic', return_value=expired):
+            self.assertEqual(self._ids(self.client.get(url, {'search': 'thor'})), [])
+            self.assertEqual(self._ids(self.client.get(url, {'search': 'loki'})), ['u3'])
+
+
+class DenormalizationTest(APITestCase):
+    """Test propagation and verification of the fields activities copy"""
+
+    def setUp(self):
+        self.db = FakeDatabase()
+        self.db.users.insert_one({'_id': 'u1', 'name': 'Ann', 'alias': 'Ace', 'team_id': 't1'})
+        self.db.workouts.insert_one({'_id': 'run', 'name': 'Running', 'icon': '🏃', 'unit': 'km'})
+        for day in range(1, 4):
+            self.db.activities.insert_one({
+                '_id': f'a{day}', 'user_id': 'u1', 'user_name': 'Ann', 'user_alias': 'Ace', 'team_id': 't1',
+                'workout_id': 'run', 'workout_name': 'Running', 'workout_icon': '🏃', 'unit': 'km',
+                'quantity': day, 'points_earned': 10 * day, 'completed_at': datetime(2024, 5, day)})
+        team_summaries.rebuild(self.db)
+
+    def test_user_update_is_propagated_after_commit(self):
+        """Test that a user's new alias reaches their activities and team summaries, but not a new team"""
+        User.objects.create(_id='u1', name='Ann', alias='Ace', email='ann@example.com', team_id='t1',
+                            total_points=60, activities_completed=3, joined_at=datetime.now())
+        with mock.patch('octofit_tracker.signals.get_db', return_value=self.db):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.patch(reverse('user-detail', args=['u1']),
+                                             {'alias': 'Ace of Spades', 'team_id': 't2'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(denormalization.propagation_queue.join(timeout=5))
+        self.assertEqual({(activity['user_alias'], activity['team_id']) for activity in self.db.activities.find()},
+                         {('Ace of Spades', 't1')})
+        self.assertIsNone(self.db.team_summaries.find_one({'_id': 't2'}))
+        summary = self.db.team_summaries.find_one({'_id': 't1'})
+        self.assertEqual(summary['activities'], 3)
+        self.assertEqual({activity['user_alias'] for activity in summary['recent']}, {'Ace of Spades'})
+        self.assertEqual(list(self.db[denormalization.JOBS].find()), [])
+
+    def test_activity_edit_keeps_its_team_after_a_team_change(self):
+        """Test that editing an old activity does not move its points to the user's new team"""
+        User.objects.create(_id='u1', name='Ann', alias='Ace', email='ann@example.com', team_id='t2',
+                            total_points=60, activities_completed=3, joined_at=datetime.now())
+        Workout.objects.create(_id='run', name='Running', icon='🏃', unit='km', points_per_unit=10,
+                               description='Run', created_at=datetime.now())
+        Activity.objects.create(_id='a1', user_id='u1', user_name='Ann', user_alias='Ace', workout_id='run',
+                                workout_name='Running', workout_icon='🏃', description='', quantity=1, unit='km',
+                                points_earned=10, completed_at=datetime(2024, 5, 1), team_id='t1')
+        self.db.users.update_one({'_id': 'u1'}, {'$set': {'team_id': 't2', 'total_points': 60}})
+        for team_id, points in (('t1', 60), ('t2', 0)):
+            self.db.teams.insert_one({'_id': team_id, 'name': team_id, 'member_count': 1})
+            self.db.leaderboard.insert_one({'_id': f'leaderboard_team_{team_id}', 'type': 'team',
+                                            'entity_id': team_id, 'total_points': points, 'rank': 1})
+        for module in ('ranking', 'rollups', 'team_summaries'):
+            patcher = mock.patch(f'octofit_tracker.{module}.get_db', return_value=self.db)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        response = self.client.patch(reverse('activity-detail', args=['a1']), {'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['team_id'], response.data['points_earned']), ('t1', 20))
+        self.assertEqual(Activity.objects.get(_id='a1').team_id, 't1')
+        self.assertEqual({row['entity_id']: row['total_points'] for row in self.db.leaderboard.find({'type': 'team'})},
+                         {'t1': 70, 't2': 0})
+
+    def test_verify_repairs_drift_and_resume_finishes_checkpointed_jobs(self):
+        """Test that verify finds and repairs stale copies and unfinished jobs are resumed"""
+        self.db.workouts.update_one({'_id': 'run'}, {'$set': {'name': 'Trail run'}})
+        self.db.activities.update_one({'_id': 'a2'}, {'$set': {'user_name': 'Anne'}})
+        report = denormalization.verify(self.db, workers=2, chunk_size=1, repair=False)
+        self.assertEqual(sorted((entry['source'], entry['stale'], entry['repaired']) for entry in report),
+                         [('users', 1, 0), ('workouts', 3, 0)])
+        report = denormalization.verify(self.db, workers=2, chunk_size=1)
+        self.assertEqual(sorted((entry['source'], entry['repaired']) for entry in report),
+                         [('users', 1), ('workouts', 3)])
+        self.assertEqual(denormalization.verify(self.db), [])
+        self.assertEqual(self.db.team_summaries.find_one({'_id': 't1'})['workouts']['run']['name'], 'Trail run')
+
+        self.db.activities.update_many({}, {'$set': {'user_alias': 'Old'}})
+        self.db[denormalization.JOBS].insert_one({
+            '_id': 'users:u1', 'source': 'users', 'source_id': 'u1', 'updated': 1,
+            'values': {'user_name': 'Ann', 'user_alias': 'Ace'}})
+        self.assertEqual(denormalization.resume(self.db), [('users:u1', 3)])
+        self.assertEqual({activity['user_alias'] for activity in self.db.activities.find()}, {'Ace'})
+        self.assertEqual(list(self.db[denormalization.JOBS].find()), [])
+
+
+class CounterBufferTest(SimpleTestCase):
+    """Test the write-behind user counters"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        settings_override = override_settings(COUNTER_JOURNAL_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        counter_buffer.reset()
+        self.addCleanup(counter_buffer.reset)
+        self.db = FakeDatabase(name='counter_test')
+        self.db.users.insert_one({'_id': 'u1', 'total_points': 10, 'activities_completed': 1})
+        self.journal = os.path.join(self.directory, 'counter_test')
+
+    def _stored(self):
+        user = self.db.users.find_one({'_id': 'u1'})
+        return user['total_points'], user['activities_completed']
+
+    def test_pending_increments_are_merged_and_written_once(self):
+        """Test that reads merge pending deltas and a flush writes them as one $inc"""
+        for _ in range(2):
+            counter_buffer.add(self.db, 'users', 'u1', {'total_points': 5, 'activities_completed': 1})
+        user, = counter_buffer.merge('users', [self.db.users.find_one({'_id': 'u1'})])
+        self.assertEqual((user['total_points'], user['activities_completed']), (20, 3))
+        before = versions.current(['users'])
+        counter_buffer.flush()
+        self.assertEqual(self._stored(), (20, 3))
+        self.assertNotEqual(versions.current(['users']), before)
+        user, = counter_buffer.merge('users', [self.db.users.find_one({'_id': 'u1'})])
+        self.assertEqual(user['total_points'], 20)
+        self.assertEqual(os.listdir(self.journal), [])
+
+    def test_journal_left_by_a_dead_process_is_replayed_once(self):
+        """Test that orphaned journal segments are replayed, torn lines skipped, and never applied twice"""
+        os.makedirs(self.journal)
+        segment = os.path.join(self.journal, '99999-0-deadbeef.log')
+        lines = '["users", "u1", {"total_points": 3}]\n["users", "u1", {"total_points": 4}]\n["users", "u'
+        for _ in range(2):
+            with open(segment, 'w') as handle:
+                handle.write(lines)
+            counter_buffer.recover(self.db)
+            self.assertEqual(self._stored(), (17, 1))
+            self.assertFalse(os.path.exists(segment))
+
+
+class ArchiveTest(SimpleTestCase):
+    """Test the columnar activity archive"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.db = FakeDatabase()
+        self.start = datetime(2024, 4, 28)
+        self._log(0, [('a1', 'u1', 't1', 10), ('a2', 'u2', 't1', 5), ('a3', 'u1', 't1', 7), ('a4', 'u3', 't2', 20)])
+
+    def _log(self, first_day, rows):
+        self.db.activities.insert_many([
+            {'_id': activity_id, 'user_id': user_id, 'team_id': team_id, 'workout_id': 'w1', 'quantity': 1,
+             'points_earned': points, 'completed_at': self.start + timedelta(days=first_day + position * 2)}
+            for position, (activity_id, user_id, team_id, points) in enumerate(rows)
+        ])
+
+    def test_export_is_incremental_and_partitioned_by_month(self):
+        """Test that a second export only appends activities after the watermark"""
+        until = datetime(2024, 6, 1)
+        result = archive.export(self.db, self.directory, until=until)
+        self.assertEqual(result['rows'], 4)
+        self.assertEqual([partition for partition, _ in archive.manifests(self.directory)],
+                         ['month=2024-04', 'month=2024-05'])
+        self.assertEqual(archive.export(self.db, self.directory, until=until)['rows'], 0)
+        self._log(8, [('a5', 'u2', 't1', 1)])
+        self.assertEqual(archive.export(self.db, self.directory, until=until)['rows'], 1)
+        self.assertEqual(archive.read_watermark(self.directory), (self.start + timedelta(days=8), 'a5'))
+
+    def test_verify_reports_changes_behind_the_watermark_and_rebuild_repairs_them(self):
+        """Test that back-dated, edited and aged-out activities are detected and re-exported once"""
+        until = datetime(2024, 6, 1)
+        archive.export(self.db, self.directory, until=until)
+        self.assertEqual(archive.verify(self.db, self.directory), [])
+        self._log(-30, [('a0', 'u1', 't1', 3)])
+        self.db.activities.update_one({'_id': 'a4'}, {'$set': {'points_earned': 25}})
+        moved = self.db.activities.find_one({'_id': 'a1'})
+        self.db.activities_archive.insert_one(moved)
+        self.db.activities.delete_one({'_id': 'a1'})
+        self.assertEqual(archive.export(self.db, self.directory, until=until)['rows'], 0)
+        stale = archive.verify(self.db, self.directory)
+        self.assertEqual([(month['partition'], month['live']) for month in stale],
+                         [('month=2024-03', (1, 3)), ('month=2024-05', (2, 32))])
+        for month in stale:
+            archive.rebuild(month['partition'], self.db, self.directory)
+        self.assertEqual(archive.verify(self.db, self.directory), [])
+        self.assertEqual(archive.export(self.db, self.directory, until=until)['rows'], 0)
+        users = archive_analytics.totals('user', self.directory)
+        self.assertEqual([(row['entity_id'], row['total_points']) for row in users],
+                         [('u3', 25), ('u1', 20), ('u2', 5)])
+
+    def test_totals_read_the_mapped_columns(self):
+        """Test that archive totals match the activities, with and without a time range"""
+        archive.export(self.db, self.directory, until=datetime(2024, 6, 1))
+        users = archive_analytics.totals('user', self.directory)
+        self.assertEqual([(row['entity_id'], row['total_points'], row['activities_count'], row['rank'])
+                          for row in users], [('u3', 20, 1, 1), ('u1', 17, 2, 2), ('u2', 5, 1, 3)])
+        teams = archive_analytics.totals('team', self.directory, since=datetime(2024, 4, 30),
+                                         until=datetime(2024, 5, 5))
+        self.assertEqual([(row['entity_id'], row['total_points']) for row in teams], [('t2', 20), ('t1', 12)])
+        with self.assertRaises(ValueError):
+            archive_analytics.totals('country', self.directory)
+
+
+class TieringTest(APITestCase):
+    """Test the hot/cold activity tiers"""
+
+    def setUp(self):
+        User.objects.create(_id='tier_user', name='Tier User', alias='Tiers', email='tiers@example.com',
+                            team_id='test_team', joined_at=timezone.now())
+        now = timezone.now()
+        for index, days in enumerate([0, 1, 2, 200, 300]):
+            model = Activity if days < 90 else ArchivedActivity
+            model.objects.create(
+                _id=f'tier_activity_{index}', user_id='tier_user', user_name='Tier User', user_alias='Tiers',
+                workout_id='test_workout', workout_name='Running', workout_icon='🏃', description='Run',
+                quantity=1, unit='km', points_earned=10, completed_at=now - timedelta(days=days), team_id='test_team'
+            )
+
+    def _follow(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(item['_id'] for item in response.data['results'])
+            url = response.data['next']
+        return seen
+
+    def test_reads_reach_the_cold_tier_only_when_needed(self):
+        """Test that pages merge in archived activities only once the range reaches them"""
+        everything = [f'tier_activity_{i}' for i in range(5)]
+        self.assertEqual(self._follow(reverse('activity-list') + '?page_size=2'), everything)
+        self.assertEqual(self._follow(reverse('user-activities', args=['tier_user']) + '?page_size=3'), everything)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('activity-list') + '?page_size=2')
+            since = (timezone.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+            self.assertEqual(self._follow(reverse('activity-list') + f'?from={since}'), everything[:3])
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertFalse([query for query in queries.captured_queries if 'activities_archive' in query['sql']])
+        ordered = self._follow(reverse('activity-list') + '?ordering=completed_at&page_size=2')
+        self.assertEqual(ordered, everything[::-1])
+        stream = json.loads(b''.join(self.client.get(reverse('activity-list') + '?stream=true').streaming_content))
+        self.assertEqual([item['_id'] for item in stream], everything)
+        response = self.client.get(reverse('activity-detail', args=['tier_activity_4']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_move_copies_then_deletes_old_activities(self):
+        """Test that the move job empties the old end of the hot tier in batches"""
+        db = FakeDatabase()
+        now = datetime.utcnow()
+        db.activities.insert_many([{'_id': f'a{days}', 'completed_at': now - timedelta(days=days)}
+                                   for days in (1, 100, 120, 400)])
+        db.activities_archive.insert_one({'_id': 'a400', 'completed_at': now - timedelta(days=400)})
+        self.assertEqual(tiering.pending(db), 3)
+        self.assertEqual(tiering.move(db, batch_size=2), 3)
+        self.assertEqual([document['_id'] for document in db.activities.find()], ['a1'])
+        self.assertEqual(sorted(document['_id'] for document in db.activities_archive.find()),
+                         ['a100', 'a120', 'a400'])
+        self.assertEqual(tiering.move(db), 0)
+
+    def test_newest_cold_is_reprobed_after_its_ttl(self):
+        """Test that the cached newest archived date expires even when no version bump reaches this process"""
+        tiering._newest_cold.clear()
+        self.addCleanup(tiering._newest_cold.clear)
+        with mock.patch('octofit_tracker.tiering.current', return_value=[(1, 0)]):
+            oldest = tiering.newest_cold()
+            moved = ArchivedActivity.objects.get(_id='tier_activity_4')
+            moved._id, moved.completed_at = 'tier_activity_5', oldest + timedelta(days=10)
+            moved.save()
+            self.assertEqual(tiering.newest_cold(), oldest)
+            expired = time.monotonic() + tiering.NEWEST_COLD_TTL + 1
+            with mock.patch('octofit_tracker.tiering.time.monotonic', return_value=expired):
+                self.assertEqual(tiering.newest_cold(), oldest + timedelta(days=10))
+
+    def test_history_aggregates_read_both_tiers(self):
+        """Test that period leaderboards, rollup backfills and team rebuilds include archived activities"""
+        db = FakeDatabase()
+        now = datetime.utcnow()
+        activity = {'user_id': 'u1', 'user_name': 'One', 'team_id': 't1', 'workout_id': 'w1', 'quantity': 1,
+                    'points_earned': 10}
+        db.activities.insert_one(dict(activity, _id='hot', completed_at=now))
+        db.activities_archive.insert_one(dict(activity, _id='cold', completed_at=now - timedelta(days=200)))
+        row, = aggregations.period_leaderboard(since=now - timedelta(days=365), db=db)
+        self.assertEqual(row['total_points'], 20)
+        self.assertEqual(rollups.backfill(db, workers=1), 2)
+        team_summaries.rebuild(db)
+        self.assertEqual(db[team_summaries.COLLECTION].find_one({'_id': 't1'})['points'], 20)
+
+
+class ResolveTest(APITestCase):
+    """Test batched entity lookups and ?expand="""
+
+    def setUp(self):
+        resolve.clear()
+        self.addCleanup(resolve.clear)
+        now = timezone.now()
+        self.team = Team.objects.create(_id='resolve_team', name='Resolvers', description='', created_at=now)
+        for index in range(3):
+            User.objects.create(_id=f'resolve_user_{index}', name=f'User {index}', alias=f'U{index}',
+                                email=f'resolve{index}@example.com', team_id='resolve_team', joined_at=now)
+        Workout.objects.create(_id='resolve_workout', name='Rowing', icon='🚣', unit='km', points_per_unit=5,
+                               description='', created_at=now)
+
+    def test_resolve_batches_and_caches_lookups(self):
+        """Test that each kind is one query, then served from the cache until written"""
+        url = reverse('resolve') + '?users=resolve_user_0,resolve_user_2,nobody&teams=resolve_team'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(response.data['users']['resolve_user_2']['alias'], 'U2')
+        self.assertIsNone(response.data['users']['nobody'])
+        self.assertEqual(response.data['teams']['resolve_team']['name'], 'Resolvers')
+        User.objects.filter(pk='resolve_user_2').update(alias='stale')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(queries), 1)  # only the unknown id is looked up again
+        self.assertEqual(response.data['users']['resolve_user_2']['alias'], 'U2')
+        # Activity writes $inc user totals and bump 'users'; that alone keeps the entries
+        versions.bump('users')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).data['users']['resolve_user_2']['alias'], 'U2')
+        self.assertEqual(len(queries), 1)
+        # Raw profile writes (populate_db) invalidate the user index, which drops them
+        search.user_index.invalidate()
+        self.addCleanup(search.user_index.invalidate)
+        self.assertEqual(self.client.get(url).data['users']['resolve_user_2']['alias'], 'stale')
+        user = User.objects.get(pk='resolve_user_2')
+        user.alias = 'U2 renamed'
+        user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data['users']['resolve_user_2']['alias'], 'U2 renamed')
+        self.assertEqual(self.client.get(reverse('resolve')).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expand_embeds_referenced_entities(self):
+        """Test that ?expand= adds users, teams and workouts to list rows"""
+        now = timezone.now()
+        Leaderboard.objects.create(_id='resolve_lb_1', type='individual', rank=1, entity_id='resolve_user_1',
+                                   entity_name='User 1', team_id='resolve_team', total_points=10, updated_at=now)
+        Leaderboard.objects.create(_id='resolve_lb_2', type='team', rank=1, entity_id='resolve_team',
+                                   entity_name='Resolvers', total_points=10, updated_at=now)
+        response = self.client.get(reverse('leaderboard-list') + '?expand=user,team')
+        rows = {row['_id']: row for row in response.data['results']}
+        self.assertEqual(rows['resolve_lb_1']['user']['name'], 'User 1')
+        self.assertEqual(rows['resolve_lb_1']['team']['name'], 'Resolvers')
+        self.assertIsNone(rows['resolve_lb_2']['user'])
+        self.assertEqual(rows['resolve_lb_2']['team']['_id'], 'resolve_team')
+        Activity.objects.create(
+            _id='resolve_activity', user_id='resolve_user_0', user_name='User 0', user_alias='U0',
+            workout_id='resolve_workout', workout_name='Rowing', workout_icon='🚣', description='', quantity=2,
+            unit='km', points_earned=10, completed_at=now, team_id='resolve_team')
+        response = self.client.get(reverse('activity-recent') + '?expand=workout,user')
+        self.assertEqual(response.data[0]['workout']['points_per_unit'], 5)
+        self.assertEqual(response.data[0]['user']['email'], 'resolve0@example.com')
+        response = self.client.get(reverse('leaderboard-list') + '?expand=workout')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MongoClientTest(SimpleTestCase):
+    """Test the shared Mongo client factory and its pool metrics"""
+
+    def setUp(self):
+        self.addCleanup(mongo.close_clients)
+        instrumentation.pool_metrics.clear()
+        self.addCleanup(instrumentation.pool_metrics.clear)
+
+    def test_client_is_shared_per_process(self):
+        """Test that one client is reused until the process id changes (a fork)"""
+        client = mongo.get_client()
+        self.assertIs(mongo.get_client(), client)
+        with mock.patch('octofit_tracker.mongo.os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(mongo.get_client(), client)
+        self.assertEqual(mongo.available_compressors('bogus, zlib'), ['zlib'])
+        # Django's no-database wrapper shares the default client
+        self.assertIs(mongo.get_client(NO_DB_ALIAS), mongo.get_client())
+
+    def test_pool_metrics(self):
+        """Test that checkouts, wait times and failures are exported"""
+        address = ('db', 27017)
+        pool = instrumentation.pool_metrics
+        pool.connection_created(monitoring.ConnectionCreatedEvent(address, 1))
+        pool.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+        pool.connection_checked_out(monitoring.ConnectionCheckedOutEvent(address, 1))
+        pool.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+        pool.connection_check_out_failed(monitoring.ConnectionCheckOutFailedEvent(address, 'timeout'))
+        body = self.client.get('/api/_metrics').content.decode()
+        self.assertIn('octofit_mongo_pool_connections{address="db:27017"} 1', body)
+        self.assertIn('octofit_mongo_pool_checked_out{address="db:27017"} 1', body)
+        self.assertIn('octofit_mongo_pool_checkout_failures_total{address="db:27017",reason="timeout"} 1', body)
+        self.assertIn('octofit_mongo_pool_wait_seconds_count{address="db:27017"} 1', body)
+        pool.connection_checked_in(monitoring.ConnectionCheckedInEvent(address, 1))
+        self.assertIn('octofit_mongo_pool_checked_out{address="db:27017"} 0', pool.render())
+
+
+class _FakeNode:
+    """A replica set member standing in for a Django connection"""
+
+    def __init__(self, db):
+        self.connection = db
+
+    def ensure_connection(self):
+        pass
+
+
+@override_settings(READ_REPLICA_ALIAS='replica', VERSIONS_SHARED=True)
+class ReplicaRoutingTest(APITestCase):
+    """Test routing of read-only actions to secondaries"""
+
+    def setUp(self):
+        response_cache().clear()
+        self.primary, self.secondary = FakeDatabase(), FakeDatabase()
+        for db in (self.primary, self.secondary):
+            db.users.insert_one({'_id': 'u1', 'name': 'One', 'alias': 'O', 'team_id': 't1',
+                                 'total_points': 100, 'activities_completed': 1})
+        # A write the secondary has not replicated yet
+        self.primary.users.insert_one({'_id': 'u2', 'name': 'Two', 'alias': 'T', 'team_id': 't1',
+                                       'total_points': 50, 'activities_completed': 1})
+        nodes = {'default': _FakeNode(self.primary), 'replica': _FakeNode(self.secondary)}
+        for target in ('octofit_tracker.replicas.connections', 'octofit_tracker.mongo.connections'):
+            patcher = mock.patch(target, nodes)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_reads_go_to_secondary_until_the_client_writes(self):
+        """Test that a client reads its own writes from the primary"""
+        url = reverse('leaderboard-live')
+        self.assertEqual([row['entity_id'] for row in self.client.get(url).data], ['u1'])
+        response = self.client.post(reverse('team-list'), {'_id': 'replica_team', 'name': 'Replica',
+                                                           'description': 'Team', 'member_count': 0,
+                                                           'created_at': datetime.now().isoformat()},
+                                    HTTP_ORIGIN='https://example-3000.app.github.dev')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # The frontend's origin can read the token and send it back
+        self.assertIn(replicas.STICKY_HEADER.lower(), response['Access-Control-Expose-Headers'].lower())
+        token = {'HTTP_X_OCTOFIT_PRIMARY_UNTIL': response[replicas.STICKY_HEADER]}
+        self.assertEqual([row['entity_id'] for row in self.client.get(url, **token).data], ['u1', 'u2'])
+        self.assertEqual([row['entity_id'] for row in self.client.get(url, {'limit': 5}).data], ['u1'])
+        # Other clients keep reading the secondary, uncached while it may lag
+        other = APIClient()
+        response = other.get(url, {'limit': 10})
+        self.assertEqual([row['entity_id'] for row in response.data], ['u1'])
+        self.assertNotIn('ETag', response)
+        self.secondary.users.insert_one(self.primary.users.find_one({'_id': 'u2'}))
+        self.assertEqual([row['entity_id'] for row in other.get(url, {'limit': 10}).data], ['u1', 'u2'])
+
+    def test_writes_and_other_reads_stay_on_primary(self):
+        """Test that only the declared actions are routed, and writes never are"""
+        router = replicas.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(User))
+        self.assertEqual(router.db_for_write(User), 'default')
+        self.assertIs(mongo.get_db(), self.primary)
+        # A routed action that fails must not leave the thread reading from the secondary
+        with mock.patch('octofit_tracker.aggregations.live_leaderboard', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.get(reverse('leaderboard-live'))
+        self.assertIsNone(router.db_for_read(User))
+        with override_settings(READ_REPLICA_ALIAS=None):
+            self.assertEqual([row['entity_id'] for row in self.client.get(reverse('leaderboard-live')).data],
+                             ['u1', 'u2'])
+
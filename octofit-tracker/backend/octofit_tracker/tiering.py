@@ -0,0 +1,241 @@
+"""
+Hot/cold tiering of the ``activities`` collection.
+
+Almost every read is for the last few weeks, yet the history grows
+forever. ``move()`` (the ``tier_activities`` command, run periodically)
+moves activities completed more than ``ACTIVITY_HOT_DAYS`` ago to the
+``activities_archive`` collection, ``BATCH_SIZE`` at a time: each batch is
+upserted into the cold tier and then deleted from the hot one, so a run
+can stop anywhere and the next one picks up where it left off. The cold
+collection is created with zstd block compression and gets the same
+secondary indexes as the hot one. The working set and index memory of
+``activities`` stay bounded by the hot window.
+
+Reads go through ``tiered()``, which returns the hot queryset unless the
+requested range reaches archived data, and otherwise a
+``TieredQuerySet`` that runs the same query on both tiers and merges the
+rows in the requested order. For the default newest-first order a page
+only touches the cold tier once the hot rows run out: the cold tier
+holds nothing newer than ``newest_cold()``, which is cached until the
+cold tier's version changes or for ``NEWEST_COLD_TTL`` seconds, whichever
+comes first, since moves run in another process whose version bumps may
+not reach this one. An activity caught between the two steps of a move
+is in both tiers and is returned once.
+
+Archived activities are read-only through the API, and the async
+``recent`` endpoints (``async_views.py``) read the hot tier only. The
+incrementally maintained aggregates (leaderboards, rollups, team
+summaries) are not affected by moves. The pipelines that aggregate or
+rebuild from history (period leaderboards, team totals,
+``rollups.backfill``, ``team_summaries.rebuild``,
+``denormalization.verify``) read both tiers through ``both_tiers()``;
+``archive.export`` reads the hot tier only, and runs far more often than
+activities age out of it (``archive.verify`` and ``archive.rebuild`` read
+both).
+"""
+import functools
+import heapq
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ReplaceOne
+from pymongo.errors import CollectionInvalid
+
+from .models import ArchivedActivity
+from .mongo import get_db
+from .rollups import to_utc_naive
+from .versions import bump, current
+
+HOT = 'activities'
+COLD = 'activities_archive'
+TIERS = (HOT, COLD)
+BATCH_SIZE = 1000
+STORAGE_ENGINE = {'wiredTiger': {'configString': 'block_compressor=zstd'}}
+NEWEST_COLD_TTL = 10
+
+_newest_cold = {}
+
+
+def hot_cutoff(days=None):
+    """Activities completed before this (UTC, naive) belong in the cold tier."""
+    days = days if days is not None else getattr(settings, 'ACTIVITY_HOT_DAYS', 90)
+    return to_utc_naive(timezone.now()) - timedelta(days=days)
+
+
+def index_plans(plans):
+    """The hot tier's planned indexes (``indexes.plan_indexes``) for the cold tier."""
+    return {COLD: list(plans.get(HOT, []))}
+
+
+def ensure_cold_collection(db):
+    """Create the cold collection with compressed storage if it does not exist."""
+    if COLD in db.list_collection_names():
+        return False
+    try:
+        db.create_collection(COLD, storageEngine=STORAGE_ENGINE)
+    except CollectionInvalid:
+        return False  # created concurrently
+    return True
+
+
+def move(db=None, days=None, batch_size=BATCH_SIZE, pause=0, progress=None):
+    """
+    Move the activities completed more than ``days`` (default
+    ``ACTIVITY_HOT_DAYS``) ago to the cold tier, sleeping ``pause`` seconds
+    between batches. Returns the number of activities moved.
+    """
+    db = db if db is not None else get_db()
+    cutoff = hot_cutoff(days)
+    ensure_cold_collection(db)
+    moved = 0
+    while True:
+        batch = list(db[HOT].find({'completed_at': {'$lt': cutoff}})
+                     .sort([('completed_at', 1), ('_id', 1)]).limit(batch_size))
+        if not batch:
+            break
+        db[COLD].bulk_write([ReplaceOne({'_id': document['_id']}, document, upsert=True) for document in batch],
+                            ordered=False)
+        # Readers learn about the cold rows before they leave the hot tier.
+        bump(COLD)
+        db[HOT].delete_many({'_id': {'$in': [document['_id'] for document in batch]}})
+        bump(HOT)
+        moved += len(batch)
+        if progress:
+            progress(batch[-1]['completed_at'], moved)
+        if pause:
+            time.sleep(pause)
+    return moved
+
+
+def both_tiers(match=None):
+    """
+    Leading stages of a pipeline run on the hot tier that select the
+    activities matching ``match`` in both tiers (``$unionWith``, MongoDB
+    4.4+). An activity caught between the two steps of a move is counted
+    twice until its delete lands.
+    """
+    stages = [{'$match': match}] if match else []
+    return stages + [{'$unionWith': {'coll': COLD, 'pipeline': list(stages)}}]
+
+
+def pending(db=None, days=None):
+    """How many activities ``move()`` would move now."""
+    db = db if db is not None else get_db()
+    return db[HOT].count_documents({'completed_at': {'$lt': hot_cutoff(days)}})
+
+
+def newest_cold():
+    """``completed_at`` of the newest archived activity, or ``None`` when the cold tier is empty."""
+    (version, _modified), = current([COLD])
+    cached = _newest_cold.get('value')
+    if cached is not None and cached[0] == version and cached[1] > time.monotonic():
+        return cached[2]
+    newest = ArchivedActivity.objects.order_by('-completed_at').values_list('completed_at', flat=True).first()
+    _newest_cold['value'] = (version, time.monotonic() + NEWEST_COLD_TTL, newest)
+    return newest
+
+
+def _value(row, name):
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+def _ordering(queryset):
+    ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+    pk = queryset.model._meta.pk.name
+    if not any(field.lstrip('-') in (pk, 'pk') for field in ordering):
+        ordering.append(pk)
+    return [(pk if field.lstrip('-') == 'pk' else field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+
+def _sort_key(ordering):
+    def compare(left, right):
+        for name, descending in ordering:
+            mine, theirs = _value(left, name), _value(right, name)
+            if mine != theirs:
+                before = mine > theirs if descending else mine < theirs
+                return -1 if before else 1
+        return 0
+    return functools.cmp_to_key(compare)
+
+
+class TieredQuerySet:
+    """
+    The same query over the hot and the cold tier, merged in the query's
+    order. Supports what the list code uses: ``order_by()``, ``filter()``,
+    ``values()``, slicing and iteration.
+    """
+
+    def __init__(self, hot, cold, newest):
+        self.hot = hot
+        self.cold = cold
+        self.newest = newest
+        self.model = hot.model
+        self.query = hot.query
+
+    def _chain(self, method, *args, **kwargs):
+        return TieredQuerySet(getattr(self.hot, method)(*args, **kwargs),
+                              getattr(self.cold, method)(*args, **kwargs), self.newest)
+
+    def order_by(self, *fields):
+        return self._chain('order_by', *fields)
+
+    def filter(self, *args, **kwargs):
+        return self._chain('filter', *args, **kwargs)
+
+    def values(self, *fields):
+        return self._chain('values', *fields)
+
+    def _merge(self, hot, cold):
+        ordering = _ordering(self.hot)
+        pk = self.model._meta.pk.attname
+        previous = None
+        for row in heapq.merge(hot, cold, key=_sort_key(ordering)):
+            key = _value(row, pk)
+            if key != previous:
+                yield row
+            previous = key
+
+    def _hot_suffices(self, rows, count):
+        """Whether no cold row can sort before the first ``count`` hot ``rows``."""
+        name, descending = _ordering(self.hot)[0]
+        return (name == 'completed_at' and descending and len(rows) >= count
+                and _value(rows[count - 1], 'completed_at') > self.newest)
+
+    def __getitem__(self, item):
+        if isinstance(item, int):
+            return self[item:item + 1][0]
+        if item.stop is None:
+            return list(self)[item]
+        hot = list(self.hot[:item.stop])
+        if self._hot_suffices(hot, item.stop):
+            return hot[item]
+        return list(self._merge(hot, list(self.cold[:item.stop])))[item]
+
+    def iterator(self, chunk_size=2000):
+        return self._merge(self.hot.iterator(chunk_size=chunk_size), self.cold.iterator(chunk_size=chunk_size))
+
+    def __iter__(self):
+        return self.iterator()
+
+
+def tiered(hot, cold, since=None, until=None):
+    """
+    Activities of ``hot`` (an ``Activity`` queryset) completed in
+    ``[since, until)``, including the cold tier when the range reaches it.
+    ``cold`` builds the matching ``ArchivedActivity`` queryset, or is
+    ``None`` to read the hot tier only.
+    """
+    bounds = {}
+    if since is not None:
+        bounds['completed_at__gte'] = since
+    if until is not None:
+        bounds['completed_at__lt'] = until
+    hot = hot.filter(**bounds)
+    if cold is None:
+        return hot
+    newest = newest_cold()
+    if newest is None or (since is not None and since > newest):
+        return hot
+    return TieredQuerySet(hot, cold().filter(**bounds), newest)
@@ -20,7 +20,9 @@ from rest_framework import routers
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from .views import TeamViewSet, UserViewSet, WorkoutViewSet, ActivityViewSet, LeaderboardViewSet
+from . import async_views
+from .instrumentation import metrics_view
+from .views import TeamViewSet, UserViewSet, WorkoutViewSet, ActivityViewSet, LeaderboardViewSet, resolve_entities
 
 
 @api_view(['GET'])
@@ -41,6 +43,7 @@ def api_root(request, format=None):
         'workouts': f'{base_url}api/workouts/',
         'activities': f'{base_url}api/activities/',
         'leaderboard': f'{base_url}api/leaderboard/',
+        'resolve': f'{base_url}api/resolve/',
     })
 
 
@@ -55,5 +58,12 @@ router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', api_root, name='api-root'),
+    path('api/_metrics', metrics_view, name='metrics'),
+    path('api/resolve/', resolve_entities, name='resolve'),
+    path('api/async/leaderboard/', async_views.leaderboard, name='async-leaderboard'),
+    path('api/async/activities/recent/', async_views.recent_activities, name='async-activity-recent'),
+    path('api/async/users/<str:pk>/activities/', async_views.user_activities, name='async-user-activities'),
+    path('api/async/teams/<str:pk>/activities/', async_views.team_activities, name='async-team-activities'),
+    path('api/async/teams/<str:pk>/dashboard/', async_views.team_dashboard, name='async-team-dashboard'),
     path('api/', include(router.urls)),
 ]
@@ -0,0 +1,87 @@
+"""
+Per-collection version counters.
+
+Every write to a collection bumps its counter (``signals.py`` for ORM
+writes, ``bump()`` called explicitly for raw pymongo writes) and records
+when it happened. Counters only ever increase, so the tuple of counters a
+view reads identifies the data it would return without querying it: the
+response cache and the ETags are both built from them.
+
+Counters live in the ``versions`` cache alias, which must be shared between
+workers (Redis) for ETags to agree across processes; with process-local
+counters ``shared()`` is false and no validators are sent.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+VERSIONS_CACHE_ALIAS = 'versions'
+
+
+def _store():
+    return caches[VERSIONS_CACHE_ALIAS]
+
+
+def _version_key(collection):
+    return f'version:{collection}'
+
+
+def _modified_key(collection):
+    return f'modified:{collection}'
+
+
+def _seed(store, collection):
+    # Seed from the clock rather than 0 so a counter that was evicted or
+    # lost in a restart never re-validates an old cache entry or ETag.
+    now = time.time()
+    store.add(_version_key(collection), time.time_ns() // 1000, timeout=None)
+    store.add(_modified_key(collection), now, timeout=None)
+
+
+def shared():
+    """
+    Whether every worker sees the same counters: ``VERSIONS_SHARED`` if
+    set, otherwise unless the ``versions`` alias is process-local.
+    """
+    configured = getattr(settings, 'VERSIONS_SHARED', None)
+    if configured is not None:
+        return configured
+    return not isinstance(_store(), LocMemCache)
+
+
+def current(collections):
+    """``[(version, modified_at), ...]`` for each of ``collections``."""
+    store = _store()
+    keys = []
+    for name in collections:
+        keys += [_version_key(name), _modified_key(name)]
+    found = store.get_many(keys)
+    if len(found) < len(keys):
+        for name in collections:
+            if _version_key(name) not in found or _modified_key(name) not in found:
+                _seed(store, name)
+        found = store.get_many(keys)
+    return [(found[_version_key(name)], found[_modified_key(name)]) for name in collections]
+
+
+def bump(*collections):
+    """Record a write to each of ``collections``."""
+    store = _store()
+    now = time.time()
+    for name in collections:
+        try:
+            store.incr(_version_key(name))
+        except ValueError:
+            _seed(store, name)
+            store.incr(_version_key(name))
+        store.set(_modified_key(name), now, timeout=None)
+
+
+def reads(*collections):
+    """Declare the collections (``db_table`` names) a ViewSet action reads."""
+    def decorator(method):
+        method.reads = collections
+        return method
+    return decorator
@@ -1,15 +1,77 @@
-from rest_framework import viewsets, filters
-from rest_framework.decorators import action
+from datetime import datetime, time
+
+from rest_framework import viewsets, filters, status
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Team, User, Workout, Activity, Leaderboard
+from . import aggregations, periods, push, resolve, rollups, team_summaries, tiering
+from .cache import cache_response
+from .conditional import ConditionalGetMixin
+from .counters import merge_leaderboard, merge_serialized_users
+from .ingest import BULK_MAX_ITEMS, ingest_activities
+from .models import Team, User, Workout, Activity, ArchivedActivity, Leaderboard
+from .pagination import KeysetListMixin
+from .parsers import NDJSONParser
+from .ranking import leaderboard_engine
+from .replicas import ReplicaReadMixin
+from .search import RankedSearchFilter, SUGGEST_LIMIT, TextSearch, user_index
 from .serializers import (
     TeamSerializer, UserSerializer, WorkoutSerializer,
     ActivitySerializer, LeaderboardSerializer
 )
+from .versions import reads
+
+
+def _parse_when(value):
+    """Parse an ISO date or datetime query parameter into an aware datetime."""
+    try:
+        when = parse_datetime(value)
+        day = None if when else parse_date(value)
+    except ValueError:
+        return None
+    if when is None:
+        if day is None:
+            return None
+        when = datetime.combine(day, time.min)
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+
+def _bounds(request):
+    """The ``(from, to)`` query parameters as aware datetimes (``None`` when absent)."""
+    bounds = []
+    for name in ('from', 'to'):
+        value = request.query_params.get(name)
+        when = _parse_when(value) if value else None
+        if value and when is None:
+            raise ValidationError({name: 'Use an ISO 8601 date or datetime.'})
+        bounds.append(when)
+    return bounds
+
 
+def _rollup_stats(request, entity_type, entity_id):
+    """Rollup rows for ?bucket=hour|day|week&from=&to= (default: daily, all time)."""
+    bucket = request.query_params.get('bucket', 'day')
+    if bucket not in rollups.BUCKETS:
+        raise ValidationError({'bucket': f"Must be one of {', '.join(rollups.BUCKETS)}."})
+    return Response(rollups.stats(entity_type, entity_id, bucket, *_bounds(request)))
 
-class TeamViewSet(viewsets.ModelViewSet):
+
+def _tiered_activities(request, **filters):
+    """Activities matching ``filters`` completed in ?from=&to=, from the tiers the range reaches."""
+    return tiering.tiered(Activity.objects.filter(**filters), lambda: ArchivedActivity.objects.filter(**filters),
+                          *_bounds(request))
+
+
+class TeamViewSet(ReplicaReadMixin, ConditionalGetMixin, KeysetListMixin, viewsets.ModelViewSet):
     """
     API endpoint for teams.
     """
@@ -19,46 +81,103 @@ class TeamViewSet(viewsets.ModelViewSet):
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'created_at', 'member_count']
     ordering = ['name']
+    replica_actions = ('list', 'retrieve', 'members', 'activities')
 
     @action(detail=True, methods=['get'])
+    @reads('teams', 'users')
     def members(self, request, pk=None):
         """Get all members of a team"""
         team = self.get_object()
-        members = User.objects.filter(team_id=team._id)
-        serializer = UserSerializer(members, many=True)
-        return Response(serializer.data)
+        members = User.objects.filter(team_id=team._id).order_by('-total_points')
+        response = self.list_response(members, UserSerializer)
+        merge_serialized_users(getattr(response, 'data', None))
+        return response
 
     @action(detail=True, methods=['get'])
+    @reads('teams', 'activities')
     def activities(self, request, pk=None):
-        """Get all activities for a team"""
+        """Get all activities for a team (?from=&to= to bound completed_at)"""
+        team = self.get_object()
+        return self.list_response(_tiered_activities(request, team_id=team._id), ActivitySerializer)
+
+    @action(detail=True, methods=['get'])
+    @reads('teams', 'rollups')
+    def stats(self, request, pk=None):
+        """Get a team's points and activity counts per hour/day/week"""
         team = self.get_object()
-        activities = Activity.objects.filter(team_id=team._id)
-        serializer = ActivitySerializer(activities, many=True)
-        return Response(serializer.data)
+        return _rollup_stats(request, 'team', team._id)
+
+    @action(detail=True, methods=['get'])
+    @reads('teams', 'users', 'leaderboard', 'team_summaries')
+    def dashboard(self, request, pk=None):
+        """Get a team's rank, top members, workout breakdown and recent activities"""
+        try:
+            members = int(request.query_params.get('members', team_summaries.DEFAULT_MEMBERS))
+        except ValueError:
+            raise ValidationError({'members': 'Must be an integer.'})
+        board = team_summaries.dashboard(pk, max(1, min(members, team_summaries.MAX_MEMBERS)))
+        if board is None:
+            raise NotFound()
+        return Response(board)
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ReplicaReadMixin, ConditionalGetMixin, KeysetListMixin, viewsets.ModelViewSet):
     """
     API endpoint for users.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, RankedSearchFilter, filters.OrderingFilter]
     filterset_fields = ['team_id']
     search_fields = ['name', 'alias', 'email']
+    search_backend = user_index
     ordering_fields = ['name', 'total_points', 'activities_completed', 'joined_at']
     ordering = ['-total_points']
 
+    @staticmethod
+    def _merged(response):
+        # Streamed lists carry no .data to merge into.
+        if isinstance(response, Response) and response.status_code == status.HTTP_200_OK:
+            merge_serialized_users(response.data)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        """List users, with the counter deltas this process has not written yet"""
+        return self._merged(super().list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._merged(super().retrieve(request, *args, **kwargs))
+
+    def update(self, request, *args, **kwargs):
+        return self._merged(super().update(request, *args, **kwargs))
+
     @action(detail=True, methods=['get'])
+    @reads('users', 'activities')
     def activities(self, request, pk=None):
-        """Get all activities for a user"""
+        """Get all activities for a user (?from=&to= to bound completed_at)"""
         user = self.get_object()
-        activities = Activity.objects.filter(user_id=user._id)
-        serializer = ActivitySerializer(activities, many=True)
-        return Response(serializer.data)
+        return self.list_response(_tiered_activities(request, user_id=user._id), ActivitySerializer)
+
+    @action(detail=True, methods=['get'])
+    @reads('users', 'rollups')
+    def stats(self, request, pk=None):
+        """Get a user's points and activity counts per hour/day/week"""
+        user = self.get_object()
+        return _rollup_stats(request, 'user', user._id)
+
+    @action(detail=False, methods=['get'])
+    @reads('users')
+    def suggest(self, request):
+        """Type-ahead: the users whose alias, name or email match ?q=, best first"""
+        try:
+            limit = int(request.query_params.get('limit', SUGGEST_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+        query = request.query_params.get('q', '')
+        return Response(user_index.suggest(query, max(1, min(limit, 50))) if query.strip() else [])
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(ReplicaReadMixin, ConditionalGetMixin, KeysetListMixin, viewsets.ModelViewSet):
     """
     API endpoint for workout types.
     """
@@ -69,28 +188,98 @@ class WorkoutViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name', 'points_per_unit']
     ordering = ['name']
 
+    @cache_response('workouts')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @action(detail=True, methods=['get'])
+    @reads('workouts', 'rollups')
+    def stats(self, request, pk=None):
+        """Get a workout's points and activity counts per hour/day/week"""
+        workout = self.get_object()
+        return _rollup_stats(request, 'workout', workout._id)
+
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(ReplicaReadMixin, ConditionalGetMixin, KeysetListMixin, viewsets.ModelViewSet):
     """
     API endpoint for activities.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, RankedSearchFilter, filters.OrderingFilter]
     filterset_fields = ['user_id', 'workout_id', 'team_id']
     search_fields = ['user_name', 'user_alias', 'workout_name', 'description']
+    search_backend = TextSearch('activities')
     ordering_fields = ['completed_at', 'points_earned', 'quantity']
     ordering = ['-completed_at']
+    replica_actions = ('list', 'retrieve', 'recent')
+
+    def list(self, request, *args, **kwargs):
+        """List activities (?from=&to= to bound completed_at); searches cover the hot tier only"""
+        searching = request.query_params.get(api_settings.SEARCH_PARAM, '').strip()
+        cold = None if searching else (lambda: self.filter_queryset(ArchivedActivity.objects.all()))
+        return self.list_response(tiering.tiered(self.filter_queryset(self.get_queryset()), cold, *_bounds(request)))
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve':
+                raise
+            return get_object_or_404(ArchivedActivity, pk=self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+
+    def perform_create(self, serializer):
+        activity = serializer.save()
+        push.publish_many(push.activity_messages('created', [serializer.data]))
+        leaderboard_engine.activity_created(activity)
+        rollups.apply([activity])
+        team_summaries.apply(added=[activity])
+
+    def perform_update(self, serializer):
+        previous = rollups.activity_fields(serializer.instance)
+        activity = serializer.save()
+        push.publish_many(push.activity_messages('updated', [serializer.data]))
+        leaderboard_engine.activity_updated(
+            (previous['user_id'], previous['team_id'], previous['points_earned']), activity)
+        rollups.apply([previous], sign=-1)
+        rollups.apply([activity])
+        team_summaries.apply(added=[activity], removed=[previous])
+
+    def perform_destroy(self, instance):
+        activity_id = instance._id
+        instance.delete()
+        push.publish_many(push.activity_messages('deleted', [{
+            '_id': activity_id, 'user_id': instance.user_id, 'team_id': instance.team_id}]))
+        leaderboard_engine.activity_deleted(instance)
+        rollups.apply([instance], sign=-1)
+        team_summaries.apply(removed=[instance])
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """Create many activities from a JSON array or an NDJSON stream"""
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of activities.']})
+        if len(items) > BULK_MAX_ITEMS:
+            raise ValidationError({'non_field_errors': [f'At most {BULK_MAX_ITEMS} activities per request.']})
+        inserted, errors = ingest_activities(items)
+        if errors and not inserted:
+            code = status.HTTP_400_BAD_REQUEST
+        elif errors:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_201_CREATED
+        return Response({'inserted': len(inserted), 'ids': inserted, 'errors': errors}, status=code)
 
     @action(detail=False, methods=['get'])
+    @cache_response('activities')
     def recent(self, request):
         """Get recent activities"""
-        recent_activities = Activity.objects.all()[:20]
-        serializer = self.get_serializer(recent_activities, many=True)
-        return Response(serializer.data)
+        recent_activities = tiering.tiered(Activity.objects.all(), ArchivedActivity.objects.all)
+        return Response(self.serialize_many(recent_activities, limit=20))
 
 
-class LeaderboardViewSet(viewsets.ReadOnlyModelViewSet):
+class LeaderboardViewSet(ReplicaReadMixin, ConditionalGetMixin, KeysetListMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for leaderboard (read-only).
     """
@@ -100,17 +289,111 @@ class LeaderboardViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_fields = ['type']
     ordering_fields = ['rank', 'total_points']
     ordering = ['rank']
+    replica_actions = ('list', 'retrieve', 'individual', 'team', 'live', 'by_period', 'team_totals')
+    # Lookups and range updates issued by ranking.LeaderboardEngine
+    extra_indexes = [
+        [('type', 1), ('entity_id', 1)],
+        [('type', 1), ('total_points', -1)],
+    ]
+
+    @reads('leaderboard', 'rollups', 'users', 'teams')
+    def list(self, request, *args, **kwargs):
+        """
+        List the all-time leaderboard, or with ?period=day|week|month[&date=]
+        the leaderboard of that period (frozen once the period has ended).
+        """
+        period = request.query_params.get('period', 'all')
+        if period == 'all':
+            return super().list(request, *args, **kwargs)
+        if period not in aggregations.PERIODS:
+            raise ValidationError({'period': f"Must be one of all, {', '.join(aggregations.PERIODS)}."})
+        start, _ = self._period_bounds(request, period)
+        board = periods.leaderboard(self._board_type(request), period, start, self._limit(request))
+        return Response(board)
 
     @action(detail=False, methods=['get'])
+    @cache_response('leaderboard')
     def individual(self, request):
         """Get individual leaderboard"""
         individual_leaderboard = Leaderboard.objects.filter(type='individual')
-        serializer = self.get_serializer(individual_leaderboard, many=True)
-        return Response(serializer.data)
+        return self.list_response(individual_leaderboard)
 
     @action(detail=False, methods=['get'])
+    @cache_response('leaderboard')
     def team(self, request):
         """Get team leaderboard"""
         team_leaderboard = Leaderboard.objects.filter(type='team')
-        serializer = self.get_serializer(team_leaderboard, many=True)
-        return Response(serializer.data)
+        return self.list_response(team_leaderboard)
+
+    def _board_type(self, request):
+        board_type = request.query_params.get('type', 'individual')
+        if board_type not in ('individual', 'team'):
+            raise ValidationError({'type': "Must be 'individual' or 'team'."})
+        return board_type
+
+    def _limit(self, request, default=100, maximum=1000):
+        try:
+            limit = int(request.query_params.get('limit', default))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+        return max(1, min(limit, maximum))
+
+    def _date(self, request):
+        if 'date' not in request.query_params:
+            return None
+        at = _parse_when(request.query_params['date'])
+        if at is None:
+            raise ValidationError({'date': 'Use an ISO 8601 date or datetime.'})
+        return at
+
+    def _period_bounds(self, request, period):
+        """The ``[start, end)`` of the ``period`` containing ?date= (default: now)."""
+        if period not in aggregations.PERIODS:
+            raise ValidationError({'period': f"Must be one of {', '.join(aggregations.PERIODS)}."})
+        try:
+            return aggregations.period_bounds(period, self._date(request))
+        except ValueError as exc:
+            raise ValidationError({'date': str(exc)})
+
+    def _range(self, request):
+        """Resolve ?period=day|week|month[&date=] or ?from=&to= into bounds."""
+        if 'period' in request.query_params:
+            return self._period_bounds(request, request.query_params['period'])
+        return tuple(_bounds(request))
+
+    @action(detail=False, methods=['get'])
+    @cache_response('users', 'activities', 'teams')
+    def live(self, request):
+        """Get the current leaderboard, ranked by the database"""
+        board_type = self._board_type(request)
+        rows = aggregations.live_leaderboard(board_type, self._limit(request))
+        return Response(merge_leaderboard(board_type, rows))
+
+    @action(detail=False, methods=['get'])
+    @cache_response('activities', 'teams')
+    def by_period(self, request):
+        """Get the leaderboard for points earned in a day/week/month or date range"""
+        since, until = self._range(request)
+        rows = aggregations.period_leaderboard(
+            self._board_type(request), since, until, self._limit(request))
+        return Response(rows)
+
+    @action(detail=False, methods=['get'])
+    @cache_response('activities')
+    def team_totals(self, request):
+        """Get per-team, per-workout activity totals"""
+        since, until = self._range(request)
+        rows = aggregations.team_activity_totals(request.query_params.get('team_id'), since, until)
+        return Response(rows)
+
+
+@api_view(['GET'])
+def resolve_entities(request):
+    """
+    Users, teams and workouts by id in one request:
+    ?users=a,b&teams=x&workouts=y -> {kind: {id: entity or null}}
+    """
+    wanted = resolve.parse_ids(request)
+    if not wanted:
+        raise ValidationError({'non_field_errors': ['Give at least one of ?users=, ?teams=, ?workouts=.']})
+    return Response(resolve.resolve(wanted))
@@ -0,0 +1,20 @@
+// After a write the API answers with an X-Octofit-Primary-Until header; echoing it
+// back keeps this tab's reads on the primary database until then, so they see the
+// write (read-your-writes, see backend/octofit_tracker/replicas.py). A header works
+// across origins where a cookie would not.
+const PRIMARY_UNTIL = 'X-Octofit-Primary-Until';
+
+export function apiFetch(url, options = {}) {
+  const headers = new Headers(options.headers);
+  const primaryUntil = sessionStorage.getItem(PRIMARY_UNTIL);
+  if (primaryUntil && Number(primaryUntil) * 1000 > Date.now()) {
+    headers.set(PRIMARY_UNTIL, primaryUntil);
+  }
+  return fetch(url, { ...options, headers }).then(response => {
+    const until = response.headers.get(PRIMARY_UNTIL);
+    if (until) {
+      sessionStorage.setItem(PRIMARY_UNTIL, until);
+    }
+    return response;
+  });
+}
@@ -1,4 +1,5 @@
 import React, { useState, useEffect } from 'react';
+import { apiFetch } from '../api';
 
 function Activities() {
   const [activities, setActivities] = useState([]);
@@ -9,7 +10,7 @@ function Activities() {
     const apiUrl = `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/activities/`;
     console.log('Activities API endpoint:', apiUrl);
     
-    fetch(apiUrl)
+    apiFetch(apiUrl)
       .then(response => {
         if (!response.ok) {
           throw new Error('Network response was not ok');
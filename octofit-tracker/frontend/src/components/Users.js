@@ -1,4 +1,5 @@
 import React, { useState, useEffect } from 'react';
+import { apiFetch } from '../api';
 
 function Users() {
   const [users, setUsers] = useState([]);
@@ -25,7 +26,7 @@ function Users() {
     const apiUrl = `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/users/`;
     console.log('Users API endpoint:', apiUrl);
     
-    fetch(apiUrl)
+    apiFetch(apiUrl)
       .then(response => {
         if (!response.ok) {
           throw new Error('Network response was not ok');
@@ -48,7 +49,7 @@ function Users() {
 
   const fetchTeams = () => {
     const apiUrl = `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/teams/`;
-    fetch(apiUrl)
+    apiFetch(apiUrl)
       .then(response => response.json())
       .then(data => {
         const teamsData = data.results || data;
@@ -102,7 +103,7 @@ function Users() {
       team_id: formData.team_id
     };
     
-    fetch(apiUrl, {
+    apiFetch(apiUrl, {
       method: 'PATCH',
       headers: {
         'Content-Type': 'application/json',
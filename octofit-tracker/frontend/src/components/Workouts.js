@@ -1,4 +1,5 @@
 import React, { useState, useEffect } from 'react';
+import { apiFetch } from '../api';
 
 function Workouts() {
   const [workouts, setWorkouts] = useState([]);
@@ -9,7 +10,7 @@ function Workouts() {
     const apiUrl = `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/workouts/`;
     console.log('Workouts API endpoint:', apiUrl);
     
-    fetch(apiUrl)
+    apiFetch(apiUrl)
       .then(response => {
         if (!response.ok) {
           throw new Error('Network response was not ok');